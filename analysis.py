@@ -0,0 +1,137 @@
+# DUBLIN BIKES: dashboard analytics that do not depend on Streamlit, so the
+# benchmark suite can run them offline.
+import numpy as np
+import pandas as pd
+
+SURPLUS_UTIL = 0.90
+DEFICIT_UTIL = 0.10
+MAX_FLOW_GAP_S = 1800   # as in etl/rollup.py
+
+# ── Peak analysis ─────────────────────────────────────────────────────────────
+def compute_peak_data(df):
+    peak_data = df.groupby("station_id").agg(
+        name        =("name",                "first"),
+        capacity    =("capacity",            "first"),
+        lat         =("lat",                 "first"),
+        lon         =("lon",                 "first"),
+        max_util    =("utilization",         "max"),
+        avg_util    =("utilization",         "mean"),
+        max_imbalance=("imbalance",          "max"),
+        max_demand  =("num_bikes_available", "max"),
+        min_supply  =("num_bikes_available", "min"),
+        avg_docks   =("num_docks_available", "mean"),
+    ).round(3)
+    return _score_peak_data(peak_data)
+
+def compute_peak_data_from_rollup(rollup):
+    # Same output as compute_peak_data, from station_hourly_rollup rows.
+    peak_data = rollup.groupby("station_id").agg(
+        name         =("name",          "first"),
+        capacity     =("capacity",      "first"),
+        lat          =("lat",           "first"),
+        lon          =("lon",           "first"),
+        max_util     =("max_util",      "max"),
+        sum_util     =("sum_util",      "sum"),
+        max_imbalance=("max_imbalance", "max"),
+        max_demand   =("max_bikes",     "max"),
+        min_supply   =("min_bikes",     "min"),
+        sum_docks    =("sum_docks",     "sum"),
+        samples      =("samples",       "sum"),
+    )
+    peak_data.insert(5, "avg_util", peak_data["sum_util"] / peak_data["samples"])
+    peak_data["avg_docks"] = peak_data["sum_docks"] / peak_data["samples"]
+    peak_data = peak_data.drop(columns=["sum_util", "sum_docks", "samples"]).round(3)
+    return _score_peak_data(peak_data)
+
+def hourly_heatmap_frame(rollup):
+    return rollup[["hour", "station_id", "mean_util"]].rename(columns={"mean_util": "utilization"})
+
+def quantile_from_counts(values, counts, q):
+    # Linear-interpolated quantile (pandas/percentile_cont semantics) of a
+    # distribution given as value -> count pairs, without expanding it.
+    order = np.argsort(values, kind="stable")
+    values = np.asarray(values, dtype=float)[order]
+    cumulative = np.cumsum(np.asarray(counts, dtype=np.int64)[order])
+    if len(cumulative) == 0 or cumulative[-1] == 0:
+        return float("nan")
+    position = (cumulative[-1] - 1) * q
+    lower = int(np.floor(position))
+    lo = values[np.searchsorted(cumulative, lower, side="right")]
+    hi = values[np.searchsorted(cumulative, min(lower + 1, cumulative[-1] - 1), side="right")]
+    return float(lo + (hi - lo) * (position - lower))
+
+def rollup_from_historical(df):
+    # station_hourly_rollup rows for one day of cleaned historical rows, built
+    # the way etl/rollup.py builds them in SQL. Names are compared as strings,
+    # like MAX(name), not in the order of a categorical's categories.
+    rollup = df.assign(name=df["name"].astype(object)).groupby(["hour", "station_id"], sort=False).agg(
+        name         =("name",                "max"),
+        capacity     =("capacity",            "max"),
+        lat          =("lat",                 "max"),
+        lon          =("lon",                 "max"),
+        samples      =("station_id",          "size"),
+        max_util     =("utilization",         "max"),
+        mean_util    =("utilization",         "mean"),
+        sum_util     =("utilization",         "sum"),
+        max_imbalance=("imbalance",           "max"),
+        min_bikes    =("num_bikes_available", "min"),
+        max_bikes    =("num_bikes_available", "max"),
+        mean_docks   =("num_docks_available", "mean"),
+        sum_docks    =("num_docks_available", "sum"),
+    ).reset_index()
+    rollup["sum_docks"] = rollup["sum_docks"].astype("float64")
+    flows = station_flows(df)
+    return rollup.merge(flows, on=["hour", "station_id"], how="left")
+
+def station_flows(df):
+    # Per (hour, station): bikes gained and lost between consecutive samples
+    # and the seconds they span, by the rules of etl/rollup.py.
+    samples = df[["station_id", "hour", "last_reported", "num_bikes_available"]] \
+        .sort_values(["station_id", "last_reported"], kind="stable")
+    same_station = samples["station_id"].eq(samples["station_id"].shift())
+    change = samples["num_bikes_available"].astype("int32").diff().where(same_station)
+    gap_s = samples["last_reported"].diff().dt.total_seconds().where(same_station)
+    counted = gap_s <= MAX_FLOW_GAP_S
+    flows = pd.DataFrame({
+        "hour": samples["hour"], "station_id": samples["station_id"],
+        "arrivals": change.clip(lower=0).where(counted, 0),
+        "departures": (-change).clip(lower=0).where(counted, 0),
+        "observed_s": gap_s.where(counted, 0),
+    }).groupby(["hour", "station_id"], sort=False).sum().reset_index()
+    return flows.astype({"arrivals": "int32", "departures": "int32", "observed_s": "float64"})
+
+def utilization_counts(df):
+    # (hour, utilization, n) rows for quantile_from_counts.
+    return (df.dropna(subset=["utilization"])
+              .groupby(["hour", "utilization"]).size()
+              .rename("n").reset_index())
+
+def compact_rollup(rollup):
+    # The cached day is kept in narrow dtypes; sums stay float64 so re-aggregated
+    # means match the database.
+    return rollup.astype({
+        "station_id": "int32", "hour": "int8", "name": "category",
+        "capacity": "int16", "samples": "int32",
+        "lat": "float32", "lon": "float32",
+        "max_util": "float32", "mean_util": "float32", "max_imbalance": "float32",
+        "min_bikes": "int16", "max_bikes": "int16", "mean_docks": "float32",
+        "arrivals": "int32", "departures": "int32",
+    })
+
+def _score_peak_data(peak_data):
+    for col in ("capacity", "max_util", "avg_util"):
+        peak_data[col] = pd.to_numeric(peak_data[col], errors="coerce")
+
+    # Derived metrics
+    peak_data["imbalance_score"] = (
+        np.abs(peak_data["max_util"] - 0.5) * peak_data["capacity"]
+    )
+    peak_data["imbalance_score"] = (
+        pd.to_numeric(peak_data["imbalance_score"], errors="coerce").fillna(0)
+    )
+
+    peak_data["status"] = np.where(
+        peak_data["max_util"] > SURPLUS_UTIL, "SURPLUS",
+        np.where(peak_data["avg_util"] < DEFICIT_UTIL, "DEFICIT", "BALANCED"),
+    )
+    return peak_data
@@ -0,0 +1,63 @@
+# Runs the streaming realtime daemon against local GBFS stand-ins and a
+# scratch Postgres, and reports its end-to-end latency.
+#
+#   BENCH_POSTGRES_URI=postgresql+psycopg2://localhost/bench \
+#       python benchmarks/bench_daemon.py --systems 3 --ttl 2 --seconds 20
+#
+# Raw snapshots go to a file-backed Mongo stand-in, and the lake (when on) to
+# a temporary directory, so nothing is left in the repository.
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("POSTGRES_URI", "postgresql://localhost/benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("ETL_RUN_ID", "benchmark")
+sys.path.insert(0, os.path.join(ROOT, "etl"))
+
+from sqlalchemy import create_engine
+import config
+from daemon import RealtimeDaemon
+from schema import create_tables
+from file_mongo import FileDatabase
+from gbfs_server import serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming realtime daemon")
+    parser.add_argument("--systems", type=int, default=3)
+    parser.add_argument("--stations", type=int, default=115)
+    parser.add_argument("--ttl", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--seconds", type=float, default=20)
+    args = parser.parse_args()
+
+    uri = os.getenv("BENCH_POSTGRES_URI")
+    if not uri:
+        raise SystemExit("bench_daemon needs BENCH_POSTGRES_URI pointing at a scratch database")
+    engine = create_engine(uri)
+    create_tables(engine)
+
+    config.DAEMON_REPORT_INTERVAL = max(1, args.seconds / 4)
+    server, systems = serve(args.systems, args.stations, args.ttl, args.latency_ms)
+    try:
+        with tempfile.TemporaryDirectory(prefix="dublin-bikes-daemon-") as workdir:
+            if config.LAKE_DIR:
+                config.LAKE_DIR = os.path.join(workdir, "lake")
+            daemon = RealtimeDaemon(engine, FileDatabase(workdir), systems=systems)
+            report = daemon.run(max_seconds=args.seconds)
+    finally:
+        server.shutdown()
+
+    print()
+    print(f"snapshots stored {report['stored']}, rows loaded {report['rows_loaded']:,} "
+          f"in {report['batches']} micro-batches")
+    for name in ("pipeline_latency_s", "data_latency_s"):
+        latency = report[name]
+        print(f"{name:<20} p50 {latency['p50']}s  p95 {latency['p95']}s  max {latency['max']}s")
+
+
+if __name__ == "__main__":
+    main()
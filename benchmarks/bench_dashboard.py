@@ -0,0 +1,89 @@
+# Times the Streamlit dashboard headlessly with streamlit's AppTest against a
+# database the ETL has already filled:
+#
+#   BENCH_POSTGRES_URI=postgresql+psycopg2://localhost/bench \
+#       python benchmarks/bench_dashboard.py --cold 3
+#
+# "cold" is a fresh Python process importing the app and running it once,
+# i.e. what the first visitor after a restart waits for. "warm" reruns the
+# same process the way a user does: moving the hour sliders, and switching
+# dashboard sections if the app has a section selector.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "visualization.py")
+
+
+def app_test(uri):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=300)
+    at.secrets["POSTGRES_URI"] = uri
+    return at
+
+
+def timed_run(at):
+    started = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return round(time.perf_counter() - started, 3)
+
+
+def cold(uri):
+    started = time.perf_counter()
+    at = app_test(uri)
+    imported = time.perf_counter() - started
+    first_run = timed_run(at)
+    print(json.dumps({"import_s": round(imported, 3), "first_run_s": first_run,
+                      "cold_s": round(imported + first_run, 3),
+                      "modules": len(sys.modules)}))
+
+
+def warm(uri, ranges):
+    at = app_test(uri)
+    timed_run(at)
+    timings = {}
+    for start, end in ranges:
+        at.sidebar.slider[0].set_value(start)
+        at.sidebar.slider[1].set_value(end)
+        name = f"hours {start:02d}-{end:02d}"
+        timings[name + (" (again)" if name in timings else "")] = timed_run(at)
+    if any(radio.key == "section" for radio in at.radio):
+        for option in at.radio(key="section").options:
+            at.radio(key="section").set_value(option)
+            timings[f"section {option}"] = timed_run(at)
+            # Opening it again is served from the figure caches.
+            timings[f"section {option} (again)"] = timed_run(at)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard cold start and rerun latency")
+    parser.add_argument("--cold", type=int, default=3, help="number of fresh-process cold starts")
+    parser.add_argument("--cold-once", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    uri = os.getenv("BENCH_POSTGRES_URI")
+    if not uri:
+        raise SystemExit("bench_dashboard needs BENCH_POSTGRES_URI pointing at a filled database")
+    if args.cold_once:
+        return cold(uri)
+
+    for i in range(args.cold):
+        result = subprocess.run([sys.executable, __file__, "--cold-once"], capture_output=True, text=True)
+        if result.returncode:
+            raise SystemExit(result.stderr)
+        print(f"cold start {i + 1}: {result.stdout.strip().splitlines()[-1]}")
+
+    ranges = [(7, 10), (16, 19), (0, 23), (7, 10)]
+    for name, seconds in warm(uri, ranges).items():
+        print(f"warm {name:<32} {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
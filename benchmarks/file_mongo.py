@@ -0,0 +1,118 @@
+# A tiny, file-backed stand-in for the part of the pymongo API the ETL uses
+# (insert_many, find with sort/limit/projection, find_one, distinct,
+# delete_many; $in/$lt/$lte/$exists queries; create_index is a no-op), so
+# raw_store can be benchmarked without a MongoDB server. Documents are pickled
+# per collection under a directory; nothing here aims to be a general-purpose
+# Mongo emulator.
+import copy
+import os
+import pickle
+from itertools import count
+
+class _Cursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, keys, direction=1):
+        if isinstance(keys, str):
+            keys = [(keys, direction)]
+        for key, order in reversed(keys):
+            self._docs.sort(key=lambda d: d.get(key), reverse=order < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+_OPERATORS = {
+    "$in":     lambda doc, key, arg: doc.get(key) in arg,
+    "$lt":     lambda doc, key, arg: doc.get(key) is not None and doc[key] < arg,
+    "$lte":    lambda doc, key, arg: doc.get(key) is not None and doc[key] <= arg,
+    "$exists": lambda doc, key, arg: (key in doc) == bool(arg),
+}
+
+
+def _matches(doc, query):
+    for key, condition in (query or {}).items():
+        if isinstance(condition, dict):
+            if not all(_OPERATORS[op](doc, key, arg) for op, arg in condition.items()):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class _DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class FileCollection:
+    _ids = count()
+
+    def __init__(self, path):
+        self._path = path
+        self._docs = []
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._docs = pickle.load(f)
+
+    def _flush(self):
+        with open(self._path, "wb") as f:
+            pickle.dump(self._docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc.setdefault("_id", next(self._ids))
+            self._docs.append(copy.deepcopy(doc))
+        self._flush()
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def delete_many(self, query):
+        kept = [d for d in self._docs if not _matches(d, query)]
+        deleted = len(self._docs) - len(kept)
+        self._docs = kept
+        self._flush()
+        return _DeleteResult(deleted)
+
+    def find(self, query=None, projection=None):
+        docs = [d for d in self._docs if _matches(d, query)]
+        if projection:
+            keep = [k for k, v in projection.items() if v]
+            docs = [{k: d[k] for k in keep if k in d} for d in docs]
+        return _Cursor([copy.deepcopy(d) for d in docs])
+
+    def find_one(self, query=None, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def distinct(self, key):
+        values = []
+        for doc in self._docs:
+            if key in doc and doc[key] not in values:
+                values.append(doc[key])
+        return values
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def storage_bytes(self):
+        return os.path.getsize(self._path) if os.path.exists(self._path) else 0
+
+
+class FileDatabase:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FileCollection(os.path.join(self._directory, f"{name}.pkl"))
+        return self._collections[name]
@@ -0,0 +1,105 @@
+# Local stand-in for GBFS APIs, for exercising the collectors and the
+# streaming daemon without the network.
+#
+#   python benchmarks/gbfs_server.py --systems 3 --ttl 5 --latency-ms 50
+#
+# Serves /<system_id>/gbfs.json, station_information.json and
+# station_status.json for every synthetic system. station_status publishes a
+# new version every `ttl` seconds (last_updated moves, bikes change) and
+# honours If-None-Match with 304, like the real feeds.
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from generators import station_information, station_status
+
+class _System:
+    def __init__(self, system_id, n_stations, ttl, seed):
+        self.system_id = system_id
+        self.ttl = ttl
+        self.info = station_information(n_stations, seed)
+        self.info["ttl"] = ttl
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._version = None
+        self._status = None
+
+    def status(self):
+        # One status version per ttl window, generated on first request.
+        version = int(time.time() // self.ttl) * self.ttl
+        with self._lock:
+            if version != self._version:
+                self._status = station_status(self.info, version, self._rng)
+                self._status["ttl"] = self.ttl
+                self._version = version
+            return self._status, f'"{self.system_id}-{version}"'
+
+def make_handler(systems, latency_s):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=None, etag=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if latency_s:
+                time.sleep(latency_s)
+            parts = self.path.strip("/").split("/")
+            system = systems.get(parts[0]) if len(parts) == 2 else None
+            if system is None:
+                return self._send(404, {"error": "not found"})
+
+            feed = parts[1]
+            if feed == "gbfs.json":
+                host = f"http://{self.headers.get('Host')}/{system.system_id}"
+                return self._send(200, {"last_updated": int(time.time()), "ttl": system.ttl, "data": {"en": {
+                    "feeds": [{"name": name, "url": f"{host}/{name}.json"}
+                              for name in ("station_information", "station_status")]}}})
+            if feed == "station_information.json":
+                return self._send(200, system.info)
+            if feed == "station_status.json":
+                body, etag = system.status()
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, etag=etag)
+                return self._send(200, body, etag=etag)
+            return self._send(404, {"error": "not found"})
+
+    return Handler
+
+def serve(n_systems=1, n_stations=115, ttl=5, latency_ms=0, host="127.0.0.1", port=0):
+    # Starts the server on a background thread; returns (server, discovery
+    # URLs by system_id). Call server.shutdown() to stop it.
+    systems = {f"system{i}": _System(f"system{i}", n_stations, ttl, seed=i) for i in range(n_systems)}
+    server = ThreadingHTTPServer((host, port), make_handler(systems, latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://{host}:{server.server_address[1]}"
+    return server, {system_id: f"{base}/{system_id}/gbfs.json" for system_id in systems}
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic GBFS feeds locally")
+    parser.add_argument("--systems", type=int, default=1)
+    parser.add_argument("--stations", type=int, default=115)
+    parser.add_argument("--ttl", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server, urls = serve(args.systems, args.stations, args.ttl, args.latency_ms, port=args.port)
+    print("GBFS_DISCOVERY_URLS=" + ",".join(f"{k}={v}" for k, v in urls.items()))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
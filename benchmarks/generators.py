@@ -0,0 +1,123 @@
+# Synthetic Dublin Bikes data for offline benchmarks.
+#
+# historical_frame()/write_historical_csv() mimic the smartdublin export (one
+# row per station per report, several days); gbfs_snapshots() produces raw
+# documents in the layout fetch_and_store_gbfs_snapshots() collects, with
+# station_information and station_status payloads shaped like the Cyclocity
+# GBFS feeds.
+import numpy as np
+import pandas as pd
+
+DUBLIN_LAT, DUBLIN_LON = 53.3498, -6.2603
+_START_TS = 1_725_148_800  # 2024-09-01 00:00:00 UTC
+
+def _stations(n_stations, rng):
+    capacity = rng.integers(15, 41, n_stations)
+    lat = DUBLIN_LAT + rng.normal(0, 0.015, n_stations)
+    lon = DUBLIN_LON + rng.normal(0, 0.025, n_stations)
+    return capacity, lat, lon
+
+def _daily_profile(hours, n_stations, rng):
+    # Morning and evening commuter peaks with a per-station phase: residential
+    # stations empty in the morning, city-centre stations fill up.
+    phase = rng.choice([-1.0, 1.0], n_stations)
+    morning = np.exp(-((hours[:, None] - 8.5) ** 2) / 3.0)
+    evening = np.exp(-((hours[:, None] - 17.5) ** 2) / 4.0)
+    return 0.5 + 0.35 * phase * (morning - evening)
+
+def historical_frame(n_stations=115, days=3, start="2024-08-31", interval_minutes=5, seed=0):
+    rng = np.random.default_rng(seed)
+    capacity, lat, lon = _stations(n_stations, rng)
+    times = pd.date_range(start, periods=days * 24 * 60 // interval_minutes,
+                          freq=f"{interval_minutes}min")
+    hours = times.hour.to_numpy() + times.minute.to_numpy() / 60
+
+    fill = _daily_profile(hours, n_stations, rng)
+    fill = np.clip(fill + rng.normal(0, 0.08, fill.shape), 0, 1)
+    bikes = np.rint(fill * capacity).astype(int)
+    jitter = rng.integers(0, interval_minutes * 60, bikes.shape)
+
+    n_times = len(times)
+    frame = pd.DataFrame({
+        "station_id": np.tile(np.arange(1, n_stations + 1), n_times),
+        "name": np.tile([f"Station {i}" for i in range(1, n_stations + 1)], n_times),
+        "capacity": np.tile(capacity, n_times),
+        "lat": np.tile(lat.round(6), n_times),
+        "lon": np.tile(lon.round(6), n_times),
+        "last_reported": (np.repeat(times.to_numpy(), n_stations)
+                          + jitter.ravel().astype("timedelta64[s]")),
+        "num_bikes_available": bikes.ravel(),
+        "num_docks_available": (capacity - bikes).ravel(),
+        "status": "OPEN",
+    })
+    # A sprinkle of the dirt the cleaner is there to remove.
+    bad = rng.random(len(frame)) < 0.002
+    frame.loc[bad, "num_bikes_available"] = -1
+    frame.loc[rng.random(len(frame)) < 0.001, "lat"] = np.nan
+    return frame
+
+def write_historical_csv(path, **kwargs):
+    frame = historical_frame(**kwargs)
+    frame.to_csv(path, index=False)
+    return len(frame)
+
+def station_information(n_stations, seed=0):
+    rng = np.random.default_rng(seed)
+    capacity, lat, lon = _stations(n_stations, rng)
+    return {
+        "last_updated": _START_TS,
+        "ttl": 60,
+        "version": "2.3",
+        "data": {"stations": [
+            {
+                "station_id": str(i + 1),
+                "name": f"Station {i + 1}",
+                "capacity": int(capacity[i]),
+                # Some feed versions use the long coordinate names.
+                **({"lat": float(lat[i]), "lon": float(lon[i])} if i % 5
+                   else {"latitude": float(lat[i]), "longitude": float(lon[i])}),
+            }
+            for i in range(n_stations)
+        ]},
+    }
+
+def station_status(info, last_updated, rng):
+    stations = info["data"]["stations"]
+    capacity = np.array([s["capacity"] for s in stations])
+    bikes = rng.integers(0, capacity + 1)
+    return {
+        "last_updated": int(last_updated),
+        "ttl": 60,
+        "version": "2.3",
+        "data": {"stations": [
+            {
+                "station_id": s["station_id"],
+                "num_bikes_available": int(bikes[i]),
+                "num_docks_available": int(capacity[i] - bikes[i]),
+                "is_installed": True,
+                "is_renting": True,
+                "is_returning": bool(i % 11),
+                "last_reported": int(last_updated) - int(rng.integers(0, 300)),
+            }
+            for i, s in enumerate(stations)
+        ]},
+    }
+
+def gbfs_snapshots(n_stations=115, n_snapshots=20, interval_s=60, seed=0, system_id="dublin"):
+    rng = np.random.default_rng(seed)
+    info = station_information(n_stations, seed)
+    docs = []
+    for k in range(n_snapshots):
+        ts = _START_TS + k * interval_s
+        status = station_status(info, ts, rng)
+        docs.append({
+            "system_id": system_id,
+            "snapshot_id": ts,
+            "snapshot_num": k,
+            "timestamp_utc": pd.Timestamp(ts, unit="s").isoformat(),
+            "status_raw": status,
+            "info_raw": info,
+            "status_count": len(status["data"]["stations"]),
+            "info_count": len(info["data"]["stations"]),
+        })
+    return docs
@@ -0,0 +1,207 @@
+# Offline benchmark harness for the ETL and dashboard hot paths.
+#
+#   python benchmarks/run.py --stations 115 --days 3 --snapshots 20
+#   BENCH_POSTGRES_URI=postgresql+psycopg2://localhost/bench python benchmarks/run.py --loads
+#
+# Every stage runs inside etl/metrics.stage(), so results carry the same
+# fields as production METRIC lines (wall time, rows, rows/sec, bytes, peak
+# RSS). --trace-memory additionally records each stage's peak Python heap via
+# tracemalloc, which is per-stage rather than process-wide, at some cost in
+# speed. Load stages only run against an explicit BENCH_POSTGRES_URI, never
+# the POSTGRES_URI used by the pipeline.
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("POSTGRES_URI", "postgresql://localhost/benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("ETL_RUN_ID", "benchmark")
+sys.path.insert(0, os.path.join(ROOT, "etl"))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+import config
+import metrics
+import raw_store
+import lake
+from transform import (
+    clean_historical, clean_historical_chunks, clean_historical_stream, clean_realtime_snapshots,
+    HISTORICAL_SOURCE_COLUMNS,
+)
+from analysis import compute_peak_data, rollup_from_historical
+from rebalance import plan_moves
+from spatial import build_index, dbscan_labels
+from simulate import evaluate_plan, start_inventory
+from generators import write_historical_csv, gbfs_snapshots
+from file_mongo import FileDatabase
+
+
+@contextmanager
+def bench_stage(name, trace_memory, rows_in=None):
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with metrics.stage(name, rows_in=rows_in) as record:
+            yield record
+    finally:
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record["traced_peak_mb"] = round(peak / 1024 / 1024, 1)
+
+
+def run_benchmarks(args, workdir):
+    trace = args.trace_memory
+    csv_path = os.path.join(workdir, "historical.csv")
+
+    with bench_stage("generate_historical_csv", trace):
+        rows = write_historical_csv(csv_path, n_stations=args.stations, days=args.days,
+                                    start=pd.Timestamp(config.HISTORICAL_DATE) - pd.Timedelta(days=args.days // 2))
+        metrics.set_rows(rows_out=rows)
+        metrics.add_bytes(os.path.getsize(csv_path))
+
+    with bench_stage("clean_historical", trace, rows_in=rows):
+        df_hist = clean_historical(pd.read_csv(csv_path))
+        metrics.set_rows(rows_out=len(df_hist))
+
+    with bench_stage("clean_historical_chunks", trace, rows_in=rows):
+        chunks = pd.read_csv(csv_path, chunksize=args.chunksize)
+        streamed = sum(len(chunk) for chunk in clean_historical_chunks(chunks))
+        metrics.set_rows(rows_out=streamed)
+
+    # The lake is written once from the CSV; the reprocessing stage then reads
+    # the target day back (memory-mapped, needed columns only) instead.
+    lake_dir = os.path.join(workdir, "lake")
+    with bench_stage("lake.write_raw_historical", trace, rows_in=rows):
+        chunks = pd.read_csv(csv_path, chunksize=args.chunksize)
+        for _ in lake.write_chunks(chunks, "raw_historical", lake_dir):
+            pass
+    with bench_stage("clean_historical[lake]", trace, rows_in=rows):
+        day = lake.read("raw_historical", columns=HISTORICAL_SOURCE_COLUMNS,
+                        dates=[config.HISTORICAL_DATE], lake_dir=lake_dir)
+        df_lake = clean_historical_stream([day])
+        assert len(df_lake) == len(df_hist)
+        metrics.set_rows(rows_out=len(df_lake))
+
+    docs = gbfs_snapshots(n_stations=args.stations, n_snapshots=args.snapshots)
+    with bench_stage("clean_realtime_snapshots", trace, rows_in=args.stations * args.snapshots):
+        df_rt = clean_realtime_snapshots(docs)
+        metrics.set_rows(rows_out=len(df_rt))
+
+    mongo_db = FileDatabase(os.path.join(workdir, "mongo"))
+    with bench_stage("raw_store.store_snapshots", trace, rows_in=len(docs)):
+        raw_store.store_snapshots(mongo_db, docs)
+        metrics.add_bytes(sum(mongo_db[name].storage_bytes() for name in
+                              (raw_store.SNAPSHOT_COLLECTION, raw_store.INFO_COLLECTION)))
+    with bench_stage("raw_store.iter_snapshots", trace, rows_in=len(docs)):
+        rebuilt = list(raw_store.iter_snapshots(mongo_db))
+        assert len(rebuilt) == len(docs)
+    with bench_stage("lake.write_raw_snapshots", trace, rows_in=len(docs)):
+        lake.write_raw_snapshots(docs, lake_dir)
+    with bench_stage("lake.read_raw_snapshots", trace, rows_in=len(docs)):
+        rebuilt = list(lake.read_raw_snapshots(lake_dir=lake_dir))
+        assert len(rebuilt) == len(docs)
+
+    with bench_stage("dashboard.peak_data", trace, rows_in=len(df_hist)):
+        peak_data = compute_peak_data(df_hist)
+        metrics.set_rows(rows_out=len(peak_data))
+
+    with bench_stage("dashboard.station_clusters", trace, rows_in=len(peak_data)):
+        geometry = peak_data.reset_index()[["station_id", "lat", "lon"]]
+        labels = dbscan_labels(build_index(geometry), radius_m=500)
+        metrics.set_rows(rows_out=len(labels))
+
+    with bench_stage("dashboard.rebalance", trace, rows_in=len(peak_data)):
+        moves, _ = plan_moves(peak_data)
+        metrics.set_rows(rows_out=len(moves))
+
+    # The dashboard's default window, 07–10.
+    rollup = rollup_from_historical(df_hist)
+    with bench_stage("dashboard.simulate", trace, rows_in=len(rollup)):
+        per_station, _ = evaluate_plan(start_inventory(rollup, 7), rollup, moves, list(range(7, 11)))
+        metrics.set_rows(rows_out=len(per_station))
+
+    if args.loads:
+        run_load_benchmarks(df_hist, df_rt, trace)
+
+
+def run_load_benchmarks(df_hist, df_rt, trace):
+    from sqlalchemy import create_engine, text
+    import load
+    from schema import create_tables, TABLE_COLUMNS
+
+    uri = os.getenv("BENCH_POSTGRES_URI")
+    if not uri:
+        raise SystemExit("--loads needs BENCH_POSTGRES_URI pointing at a scratch database")
+    engine = create_engine(uri)
+    create_tables(engine)
+    df_hist = df_hist.drop_duplicates(subset=["station_id", "last_reported"])
+    hist_columns = [name for name, _ in TABLE_COLUMNS["historical_stations"]]
+
+    for method, fmt in (("to_sql", None), ("copy", "text"), ("copy", "binary")):
+        label = method if fmt is None else f"{method}/{fmt}"
+        with bench_stage(f"load_historical[{label}]", trace, rows_in=len(df_hist)):
+            if method == "copy":
+                load.copy_to_postgres(df_hist[hist_columns], "historical_stations", engine, fmt=fmt)
+            else:
+                load._to_sql_replace(df_hist[hist_columns], "historical_stations", engine)
+        with bench_stage(f"load_realtime[{label}]", trace, rows_in=len(df_rt)):
+            if method == "copy":
+                load.copy_to_postgres(df_rt, "realtime_stations", engine, fmt=fmt)
+            else:
+                load._to_sql_replace(df_rt, "realtime_stations", engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM etl_watermarks"))
+    with bench_stage("load_incremental[first]", trace, rows_in=len(df_hist)):
+        load.load_incremental(df_hist[hist_columns], "historical_stations", engine)
+    with bench_stage("load_incremental[rerun]", trace, rows_in=len(df_hist)):
+        load.load_incremental(df_hist[hist_columns], "historical_stations", engine)
+
+    # Two consecutive loads of one system: the second must compare against
+    # that system's watermark and only upsert the rows at it.
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE realtime_stations"))
+    with bench_stage("load_incremental_realtime[first]", trace, rows_in=len(df_rt)):
+        first = load.load_incremental(df_rt, "realtime_stations", engine)
+    with bench_stage("load_incremental_realtime[rerun]", trace, rows_in=len(df_rt)):
+        rerun = load.load_incremental(df_rt, "realtime_stations", engine)
+    assert first == len(df_rt), (first, len(df_rt))
+    assert rerun == int((df_rt["snapshot_id"] == df_rt["snapshot_id"].max()).sum()), rerun
+
+
+def print_table(records):
+    print()
+    print(f"{'stage':<34} {'wall s':>8} {'rows/sec':>12} {'MB moved':>9} {'peak RSS':>9} {'traced':>8}")
+    for r in records:
+        traced = r.get("traced_peak_mb")
+        print(f"{r['stage']:<34} {r['wall_s']:>8.3f} {r['rows_per_sec'] or 0:>12,.0f} "
+              f"{r['bytes'] / 1024 / 1024:>9.2f} {r['peak_rss_mb']:>9.1f} "
+              f"{'' if traced is None else f'{traced:.1f}':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ETL/dashboard benchmarks on synthetic data")
+    parser.add_argument("--stations", type=int, default=115)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--snapshots", type=int, default=20)
+    parser.add_argument("--chunksize", type=int, default=config.HISTORICAL_CHUNKSIZE or 200_000)
+    parser.add_argument("--loads", action="store_true", help="also benchmark Postgres loads (BENCH_POSTGRES_URI)")
+    parser.add_argument("--trace-memory", action="store_true", help="per-stage tracemalloc peaks")
+    parser.add_argument("--json", help="write all stage records to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="dublin-bikes-bench-") as workdir:
+        run_benchmarks(args, workdir)
+
+    print_table(metrics.records())
+    if args.json:
+        metrics.write_json(args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from sqlalchemy import text
+from extract import download_historical_csv, extract_historical_csv_chunks
+from transform import clean_historical_stream, concat_frames, HISTORICAL_SOURCE_COLUMNS
+from load import copy_to_postgres
+from schema import create_tables, TABLE_COLUMNS
+from migrations import partition_ddl
+from rollup import refresh_hourly_rollup
+from geometry import refresh_station_geometry
+from source_state import read_source_state
+import config
+import metrics
+import lake
+import resources
+
+# ── Multi-day historical backfill ─────────────────────────────────────────────
+#   python etl/backfill.py 2024-09-01 2024-09-30 [--workers 8]
+#
+# The export is parsed once and split into per-day partitions of the raw lake
+# (every day it contains, so later backfills of other ranges skip this step).
+# Each requested day is then cleaned with clean_historical's rules, loaded and
+# rolled up by a worker process with its own database connection. A day is
+# replaced whole in one transaction (COPY mode "replace_days"), so rerunning a
+# range, or a single failed day, is safe. The daily pipeline's watermark and
+# source_state are left alone.
+
+HISTORICAL_TABLE_COLUMNS = [name for name, _ in TABLE_COLUMNS['historical_stations']]
+
+def date_range(start, end):
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+    if last < first:
+        raise ValueError(f"Backfill range ends before it starts: {start} → {end}")
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+# ── Partitioning ──────────────────────────────────────────────────────────────
+def split_export(engine, days, lake_dir):
+    # Makes sure every requested day that the export has is in the raw lake.
+    present = set(lake.available_dates('raw_historical', lake_dir))
+    missing = [day for day in days if day not in present]
+    if not missing:
+        print(f"   All {len(days)} day(s) are already in the raw lake")
+        return
+    print(f"   {len(missing)} day(s) not in the raw lake; splitting the export...")
+    path = os.path.join(config.SOURCE_CACHE_DIR, "historical.csv")
+    validators = read_source_state(engine) if os.path.exists(path) else None
+    download_historical_csv(path, validators=validators)
+    with metrics.stage("backfill.split"):
+        chunks = extract_historical_csv_chunks(config.HISTORICAL_CHUNKSIZE or 200_000, path=path)
+        for _ in lake.write_chunks(chunks, 'raw_historical', lake_dir):
+            pass
+
+def create_day_partitions(engine, days):
+    # Up front, so the concurrent loads never wait on each other's DDL.
+    with engine.begin() as conn:
+        for day in days:
+            conn.execute(text(partition_ddl('historical_stations', date.fromisoformat(day))))
+
+# ── Workers ───────────────────────────────────────────────────────────────────
+def backfill_day(day, lake_dir):
+    # Runs in a worker process, on that process's own pooled engine (see
+    # resources.py). The step-by-step output of the clean and load is kept
+    # back (and only shown if the day fails); the parent reports one line per
+    # day.
+    engine = resources.postgres_engine()
+    with metrics.stage(f"backfill[{day}]") as record, \
+            contextlib.redirect_stdout(io.StringIO()) as log:
+        try:
+            started = time.perf_counter()
+            raw = lake.read('raw_historical', columns=HISTORICAL_SOURCE_COLUMNS, dates=[day],
+                            lake_dir=lake_dir)
+            df_clean = clean_historical_stream([raw], target_date=day)
+            cleaned = time.perf_counter()
+            if len(df_clean):
+                copy_to_postgres(df_clean[HISTORICAL_TABLE_COLUMNS], 'historical_stations', engine,
+                                 mode="replace_days", staging=f"historical_stations_staging_{day.replace('-', '')}")
+                refresh_hourly_rollup(engine, [day])
+                if config.LAKE_DIR:
+                    lake.write(df_clean, 'historical')
+            metrics.set_rows(rows_in=len(raw), rows_out=len(df_clean))
+        except Exception:
+            sys.stderr.write(log.getvalue())
+            raise
+    latest = df_clean.sort_values('last_reported').drop_duplicates('station_id', keep='last')
+    return {
+        'day': day, 'raw_rows': len(raw), 'rows': len(df_clean), 'pid': os.getpid(),
+        'clean_s': cleaned - started, 'load_s': time.perf_counter() - cleaned,
+        'wall_s': record['wall_s'], 'latest': latest,
+    }
+
+# ── Driver ────────────────────────────────────────────────────────────────────
+def run_backfill(start, end, workers=config.BACKFILL_WORKERS):
+    days = date_range(start, end)
+    print(f"Backfilling historical_stations for {days[0]} → {days[-1]} "
+          f"({len(days)} day(s), {workers} worker(s))...")
+    engine = resources.postgres_engine()
+    create_tables(engine)
+
+    with contextlib.ExitStack() as stack:
+        lake_dir = config.LAKE_DIR or stack.enter_context(tempfile.TemporaryDirectory(prefix="etl-backfill-"))
+        with metrics.stage("backfill", rows_in=0) as overall:
+            split_export(engine, days, lake_dir)
+            create_day_partitions(engine, days)
+
+            results, failed = [], []
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(backfill_day, day, lake_dir): day for day in days}
+                for n, future in enumerate(as_completed(futures), 1):
+                    day = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed.append(day)
+                        print(f"   [{n}/{len(days)}] {day}: FAILED ({e})", flush=True)
+                        continue
+                    results.append(result)
+                    if not result['rows']:
+                        print(f"   [{n}/{len(days)}] {day}: no rows in the export", flush=True)
+                        continue
+                    print(f"   [{n}/{len(days)}] {day}: {result['raw_rows']:,} rows → {result['rows']:,} clean, "
+                          f"clean {result['clean_s']:.2f}s, load+rollup {result['load_s']:.2f}s "
+                          f"({result['rows'] / result['wall_s']:,.0f} rows/sec, pid {result['pid']})", flush=True)
+
+            loaded = [result for result in results if result['rows']]
+            if loaded:
+                refresh_station_geometry(engine, concat_frames([r['latest'] for r in loaded],
+                                                               'historical_stations'))
+            overall['rows_in'] = sum(result['raw_rows'] for result in results)
+            overall['rows_out'] = sum(result['rows'] for result in results)
+
+    print(f"Backfill complete: {len(loaded)} day(s), {overall['rows_out']:,} rows in {overall['wall_s']:.1f}s "
+          f"({overall['rows_per_sec'] or 0:,.0f} rows/sec)")
+    print("METRIC_POOLS " + json.dumps(resources.pool_stats()))
+    if failed:
+        raise SystemExit(f"Backfill failed for {len(failed)} day(s): {', '.join(sorted(failed))} "
+                         f"(rerun them; each day is replaced whole)")
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill a range of historical days in parallel")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="last day, YYYY-MM-DD (default: start)")
+    parser.add_argument("--workers", type=int, default=config.BACKFILL_WORKERS,
+                        help="worker processes (default %(default)s)")
+    args = parser.parse_args()
+    run_backfill(args.start, args.end or args.start, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+from datetime import datetime
 
 # ── Configurations ────────────────────────────────────────────────────────────
 # All secrets must be set as environment variables (locally via .env or shell
@@ -19,11 +20,153 @@ if not MONGO_URI:
         "Add it to your .streamlit/secrets.toml or Streamlit Cloud secrets."
     )
 
+# ── Connections ───────────────────────────────────────────────────────────────
+# Every Postgres engine, MongoDB client and HTTP session is created and pooled
+# by etl/resources.py, once per process, with these settings.
+# POSTGRES_POOLER says what sits in front of Postgres: "transaction" (e.g.
+# Supabase's transaction pooler on port 6543, which cannot keep server-side
+# prepared statements or session state), "session", "none", or "auto" to
+# decide from the URI's port.
+POSTGRES_POOLER          = os.getenv("POSTGRES_POOLER", "auto")
+POSTGRES_SSLMODE         = os.getenv("POSTGRES_SSLMODE", "require")
+POSTGRES_POOL_SIZE       = 5
+POSTGRES_MAX_OVERFLOW    = 5
+POSTGRES_POOL_TIMEOUT    = 30      # seconds to wait for a free connection
+POSTGRES_POOL_RECYCLE    = 300     # seconds before a pooled connection is replaced
+POSTGRES_CONNECT_TIMEOUT = 10
+MONGO_POOL_SIZE          = 10
+MONGO_TIMEOUT_MS         = 10_000  # server selection and connect
+
 # ── Data Sources ──────────────────────────────────────────────────────────────
 CSV_URL          = "https://data.smartdublin.ie/dataset/dublinbikes-api/resource/168f55b8-1c3d-4fd3-95b9-f92f388c772a/download"
-GBFS_STATUS_URL  = "https://api.cyclocity.fr/contracts/dublin/gbfs/station_status.json"
-GBFS_INFO_URL    = "https://api.cyclocity.fr/contracts/dublin/gbfs/station_information.json"
+
+# GBFS systems to collect, as system_id → gbfs.json discovery URL. Override
+# with GBFS_DISCOVERY_URLS="dublin=https://...,lyon=https://...". The
+# system_id is stored on every raw document and realtime row.
+def _parse_systems(value):
+    systems = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        system_id, _, url = entry.partition("=")
+        if not url:
+            raise EnvironmentError(f"GBFS_DISCOVERY_URLS entry {entry!r} is not system_id=url")
+        systems[system_id.strip()] = url.strip()
+    return systems
+
+DEFAULT_SYSTEM_ID = "dublin"
+GBFS_SYSTEMS = _parse_systems(os.getenv("GBFS_DISCOVERY_URLS", "")) or {
+    DEFAULT_SYSTEM_ID: "https://api.cyclocity.fr/contracts/dublin/gbfs/gbfs.json",
+}
+# Feed URLs used when a system's discovery document cannot be fetched.
+GBFS_FALLBACK_FEEDS = {
+    DEFAULT_SYSTEM_ID: {
+        "station_status":      "https://api.cyclocity.fr/contracts/dublin/gbfs/station_status.json",
+        "station_information": "https://api.cyclocity.fr/contracts/dublin/gbfs/station_information.json",
+    },
+}
+MONGO_DB         = os.getenv("MONGO_DB", "dublin_bikes")
 
 # ── ETL Settings ──────────────────────────────────────────────────────────────
 HISTORICAL_DATE  = "2024-09-01"
 GBFS_SNAPSHOTS   = 20
+
+# Polling follows the feed's own ttl/last_updated, clamped to these bounds
+# (seconds). Unchanged payloads (304 or same last_updated) are not stored.
+GBFS_MIN_POLL_INTERVAL = 0.5
+GBFS_MAX_POLL_INTERVAL = 60
+HTTP_POOL_SIZE         = 10
+
+# Systems are collected side by side by at most this many workers; their
+# feed requests share one HTTP session and one request pool, so a run takes
+# about as long as the slowest feed rather than the sum of all of them.
+GBFS_SYSTEM_WORKERS    = 8
+
+# Raw snapshots in MongoDB reference station_information by content hash;
+# with deltas on, status snapshots after the first of each run only store the
+# stations that changed.
+MONGO_STATUS_DELTAS    = True
+
+# Rows per chunk when streaming the historical CSV. Peak memory of the
+# historical branch is bounded by this rather than by the size of the export.
+# Set to None to fall back to a single full read.
+HISTORICAL_CHUNKSIZE = 200_000
+
+# ── Data lake ─────────────────────────────────────────────────────────────────
+# Raw and cleaned historical and realtime data are also kept as date-partitioned
+# Parquet under LAKE_DIR (see etl/lake.py). Set ETL_LAKE_DIR="" to turn the
+# lake off. With HISTORICAL_FROM_LAKE on, a day that is already in the raw lake
+# is read from there when the export has not changed, instead of parsing the
+# CSV again.
+LAKE_DIR             = os.getenv("ETL_LAKE_DIR", "data_lake")
+HISTORICAL_FROM_LAKE = True
+
+# ── Change detection ──────────────────────────────────────────────────────────
+# The historical export is downloaded to SOURCE_CACHE_DIR with conditional
+# requests (ETag / Last-Modified), resuming an interrupted download where it
+# stopped. Its sha256 and a fingerprint of the cleaned day are kept in the
+# source_state table; when neither changed, the historical branch stops after
+# the check. ETL_FORCE_HISTORICAL=1 reprocesses and reloads regardless.
+SOURCE_CACHE_DIR     = os.getenv("ETL_SOURCE_CACHE_DIR", ".etl_source")
+FORCE_HISTORICAL     = os.getenv("ETL_FORCE_HISTORICAL") == "1"
+
+# ── Backfill ──────────────────────────────────────────────────────────────────
+# etl/backfill.py loads a range of historical days: the export is split into
+# per-day partitions of the raw lake once, then every day is cleaned, loaded
+# and rolled up by one of BACKFILL_WORKERS worker processes.
+BACKFILL_WORKERS     = int(os.getenv("ETL_BACKFILL_WORKERS", min(8, os.cpu_count() or 1)))
+
+# ── Load Settings ─────────────────────────────────────────────────────────────
+# "copy" streams rows with COPY into an unlogged staging table and swaps them
+# into the target in one transaction; "to_sql" is the original multi-row
+# INSERT path, kept for comparison.
+LOAD_METHOD      = "copy"
+COPY_FORMAT      = "text"     # "text" or "binary"
+
+# "incremental" never empties the tables and makes reruns idempotent: realtime
+# rows at or past each system's watermark are upserted on the primary key, and
+# the historical day is replaced whole (both via COPY). "full" truncates and
+# reloads every run.
+LOAD_MODE        = "incremental"
+
+# ── Streaming daemon ──────────────────────────────────────────────────────────
+# "batch" collects GBFS_SNAPSHOTS snapshots inside every pipeline run;
+# "daemon" leaves realtime ingestion to the long-running etl/daemon.py and
+# the pipeline only runs the historical branch.
+REALTIME_MODE            = os.getenv("ETL_REALTIME_MODE", "batch")
+
+# The daemon's stages hand work over through bounded queues: when Postgres
+# falls behind the queues fill and the pollers block instead of buffering
+# without limit. Cleaned snapshots are loaded in micro-batches of up to
+# DAEMON_BATCH_MAX_ROWS rows, or whatever has arrived after
+# DAEMON_BATCH_MAX_SECONDS.
+DAEMON_RAW_QUEUE_SIZE    = 64
+DAEMON_BATCH_QUEUE_SIZE  = 64
+DAEMON_BATCH_MAX_ROWS    = 5_000
+DAEMON_BATCH_MAX_SECONDS = 2
+DAEMON_REPORT_INTERVAL   = 60      # seconds between METRIC lines
+# A micro-batch whose load fails on a lost or refused connection is retried
+# (TASK_RETRY_BACKOFF, doubled each time) up to DAEMON_LOAD_ATTEMPTS times;
+# any other error drops it at once. Its raw snapshots stay in MongoDB.
+DAEMON_LOAD_ATTEMPTS     = 4
+# Raw snapshots older than DAEMON_RETENTION_HOURS are pruned from MongoDB
+# every DAEMON_PRUNE_INTERVAL seconds. With the lake on, raw snapshots and
+# loaded rows are appended to it once DAEMON_LAKE_FLUSH_ROWS station rows or
+# DAEMON_LAKE_FLUSH_SECONDS have accumulated, not once per micro-batch.
+DAEMON_RETENTION_HOURS   = 24
+DAEMON_PRUNE_INTERVAL    = 600     # seconds
+DAEMON_LAKE_FLUSH_ROWS   = 50_000
+DAEMON_LAKE_FLUSH_SECONDS = 900
+
+# ── Orchestration ─────────────────────────────────────────────────────────────
+# The pipeline runs as a task graph (etl/dag.py). Outputs of finished tasks
+# are checkpointed per run id, so a rerun with the same ETL_RUN_ID resumes
+# from the failed step. The default run id is the current UTC hour.
+RUN_ID              = os.getenv("ETL_RUN_ID") or datetime.utcnow().strftime("%Y%m%dT%H")
+CHECKPOINT_DIR      = os.getenv("ETL_CHECKPOINT_DIR", ".etl_checkpoints")
+DAG_MAX_WORKERS     = 4
+TASK_RETRIES        = 2
+TASK_RETRY_BACKOFF  = 5       # seconds; doubled on every retry
+
+# Stage metrics (etl/metrics.py) are always printed as METRIC JSON lines; they
+# can also be written to a JSON file and appended to the pipeline_runs table.
+METRICS_PATH        = os.getenv("ETL_METRICS_PATH")
+PERSIST_METRICS     = True
@@ -0,0 +1,360 @@
+import argparse
+import json
+import queue
+import signal
+import threading
+import time
+from datetime import datetime
+import requests
+from sqlalchemy.exc import DBAPIError, OperationalError
+from extract import fetch_gbfs_feed, next_poll_delay, system_feeds, raw_snapshot
+from transform import clean_realtime_snapshots, concat_frames
+from load import load_incremental, _LATEST_SNAPSHOT_ADVANCE
+from schema import create_tables
+import config
+import metrics
+import raw_store
+import resources
+import lake
+
+# ── Streaming realtime ingestion ──────────────────────────────────────────────
+# Long-running alternative to the hourly 20-snapshot batch:
+#
+#   pollers (one per system) ─raw queue─▶ transformer ─batch queue─▶ loader
+#
+# Pollers follow each feed's ttl/last_updated and only enqueue snapshots whose
+# status changed. The transformer stores whatever has queued up in MongoDB
+# (one insert per drain) and cleans it with the batch transform. The loader
+# upserts cleaned rows into realtime_stations in micro-batches, moving the
+# per-system watermarks and latest_snapshot pointers in the same transaction.
+# Both queues are bounded, so a slow database backs up into the pollers
+# rather than into memory: while a micro-batch is being retried the loader
+# takes nothing new off its queue. A batch that fails for any other reason
+# than a connection error, or runs out of attempts, is dropped and counted
+# (its raw snapshots are already in MongoDB). SIGINT/SIGTERM stop the
+# pollers; queued snapshots are still stored and loaded before the process
+# exits.
+#
+# Raw snapshots past the retention window are pruned from MongoDB on a timer.
+# With the lake on, stored raw snapshots and loaded rows are buffered and
+# appended to the raw_realtime / realtime Parquet datasets in large files
+# (DAEMON_LAKE_FLUSH_ROWS / DAEMON_LAKE_FLUSH_SECONDS), and flushed on exit.
+#
+# Latency is measured per snapshot when its rows commit: "pipeline" is the
+# time since it was fetched, "data" the time since the feed's last_updated.
+
+_STOP = object()
+
+def _earliest(*timeouts):
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    return min(timeouts) if timeouts else None
+
+class _LakeBuffer:
+    # Collects one stage's lake writes until DAEMON_LAKE_FLUSH_ROWS rows or
+    # DAEMON_LAKE_FLUSH_SECONDS have accumulated. Only its own thread uses it.
+    def __init__(self):
+        self.items, self.rows, self.started = [], 0, None
+
+    def add(self, items, rows):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.items.extend(items)
+        self.rows += rows
+
+    def timeout(self):
+        # Seconds until the buffer is due by age; None while it is empty.
+        if self.started is None:
+            return None
+        return max(0.0, self.started + config.DAEMON_LAKE_FLUSH_SECONDS - time.monotonic())
+
+    def due(self):
+        return bool(self.items) and (self.rows >= config.DAEMON_LAKE_FLUSH_ROWS or self.timeout() == 0)
+
+    def take(self):
+        items = self.items
+        self.items, self.rows, self.started = [], 0, None
+        return items
+
+class RealtimeDaemon:
+    def __init__(self, engine, mongo_db, systems=None, session=None):
+        self.engine = engine
+        self.mongo_db = mongo_db
+        self.systems = systems or config.GBFS_SYSTEMS
+        self.session = session or resources.http_session()
+        self.stop_event = threading.Event()
+        self.raw_queue = queue.Queue(maxsize=config.DAEMON_RAW_QUEUE_SIZE)
+        self.batch_queue = queue.Queue(maxsize=config.DAEMON_BATCH_QUEUE_SIZE)
+        self.pipeline_latency = metrics.LatencyWindow()
+        self.data_latency = metrics.LatencyWindow()
+        self.counters = {"fetched": 0, "unchanged": 0, "fetch_errors": 0, "stored": 0, "pruned": 0,
+                         "dropped": 0, "rows_loaded": 0, "batches": 0, "load_errors": 0}
+        self._counter_lock = threading.Lock()
+        self._next_prune = 0.0
+        self._raw_lake = _LakeBuffer()
+        self._loaded_lake = _LakeBuffer()
+
+    def _count(self, name, n=1):
+        with self._counter_lock:
+            self.counters[name] += n
+
+    # ── Pollers ──
+    def _enqueue(self, item):
+        # Blocks while the queue is full (backpressure to the feed), but gives
+        # up once shutdown starts so a stalled loader cannot hang it.
+        while True:
+            try:
+                self.raw_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if self.stop_event.is_set():
+                    self._count("dropped")
+                    return False
+
+    def _poll(self, system_id, discovery_url):
+        try:
+            status_url, info_url = system_feeds(system_id, discovery_url, self.session)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"   [{system_id}] not polled: {e}")
+            return
+
+        snapshot_num = 0
+        previous_id = None
+        failures = 0
+        while not self.stop_event.is_set():
+            data_status = None
+            try:
+                data_status, changed, _, _ = fetch_gbfs_feed(status_url, self.session)
+                if changed:
+                    data_info, _, _, _ = fetch_gbfs_feed(info_url, self.session)
+                    doc = raw_snapshot(system_id, snapshot_num, data_status, data_info, previous_id)
+                    self._count("fetched")
+                    if self._enqueue((doc, time.time(), data_status.get('last_updated'))):
+                        snapshot_num += 1
+                        previous_id = doc['snapshot_id']
+                else:
+                    self._count("unchanged")
+                failures = 0
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                failures += 1
+                self._count("fetch_errors")
+                print(f"   [{system_id}] poll failed ({failures} in a row): {e}")
+
+            if data_status and not failures:
+                delay = next_poll_delay(data_status)
+            else:
+                delay = min(config.GBFS_MIN_POLL_INTERVAL * 2 ** failures, config.GBFS_MAX_POLL_INTERVAL)
+            self.stop_event.wait(delay)
+
+    # ── Lake and retention ──
+    def _archive(self, buffer, what, write, force=False):
+        if not (buffer.due() or (force and buffer.items)):
+            return
+        rows = buffer.rows
+        try:
+            write(buffer.take())
+        except Exception as e:
+            print(f"   Could not archive {rows:,} {what} row(s) to the lake: {e}")
+
+    def _archive_raw(self, force=False):
+        self._archive(self._raw_lake, "raw snapshot", lake.write_raw_snapshots, force)
+
+    def _archive_loaded(self, force=False):
+        self._archive(self._loaded_lake, "realtime",
+                      lambda frames: lake.write(concat_frames(frames, 'realtime_stations'), 'realtime'),
+                      force)
+
+    def _prune(self):
+        # Runs on the transformer thread, the daemon's only MongoDB writer.
+        if time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + config.DAEMON_PRUNE_INTERVAL
+        cutoff = int(time.time() - config.DAEMON_RETENTION_HOURS * 3600)
+        try:
+            deleted = raw_store.prune_snapshots(self.mongo_db, cutoff)
+        except Exception as e:
+            print(f"   Could not prune raw snapshots: {e}")
+            return
+        if deleted:
+            print(f"   Pruned {deleted} raw snapshot(s) older than {config.DAEMON_RETENTION_HOURS}h")
+            self._count("pruned", deleted)
+
+    # ── Transformer ──
+    def _drain(self, first):
+        items = [first]
+        while len(items) < config.DAEMON_RAW_QUEUE_SIZE:
+            try:
+                item = self.raw_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.raw_queue.put(_STOP)
+                break
+            items.append(item)
+        return items
+
+    def _transform(self):
+        while True:
+            try:
+                first = self.raw_queue.get(timeout=self._raw_lake.timeout())
+            except queue.Empty:
+                self._archive_raw()
+                continue
+            if first is _STOP:
+                self._archive_raw(force=True)
+                self.batch_queue.put(_STOP)
+                return
+            items = self._drain(first)
+            docs = [doc for doc, _, _ in items]
+            try:
+                raw_store.store_snapshots(self.mongo_db, docs)
+                self._count("stored", len(docs))
+                df = clean_realtime_snapshots(docs)
+            except Exception as e:
+                print(f"   Transform failed for {len(docs)} snapshot(s), dropped: {e}")
+                continue
+            self._prune()
+            if config.LAKE_DIR:
+                self._raw_lake.add(docs, sum(doc.get('status_count', 0) for doc in docs))
+                self._archive_raw()
+            timings = [(fetched_at, last_updated) for _, fetched_at, last_updated in items]
+            self.batch_queue.put((df, timings))
+
+    # ── Loader ──
+    def _transient(self, error):
+        # SQLAlchemy wraps errors from engine.connect(); the COPY path works on
+        # a raw DB-API connection and raises the driver's own exceptions.
+        dbapi = self.engine.dialect.loaded_dbapi
+        return isinstance(error, (OperationalError, dbapi.OperationalError, dbapi.InterfaceError)) or (
+            isinstance(error, DBAPIError) and error.connection_invalidated)
+
+    def _flush(self, frames, timings):
+        df = concat_frames(frames, 'realtime_stations')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                load_incremental(df, 'realtime_stations', self.engine, extra_sql=_LATEST_SNAPSHOT_ADVANCE)
+                break
+            except Exception as e:
+                self._count("load_errors")
+                if self._transient(e) and attempt < config.DAEMON_LOAD_ATTEMPTS \
+                        and not self.stop_event.is_set():
+                    print(f"   Micro-batch of {len(df):,} rows failed "
+                          f"(attempt {attempt}/{config.DAEMON_LOAD_ATTEMPTS}), will retry: {e}")
+                    self.stop_event.wait(config.TASK_RETRY_BACKOFF * 2 ** (attempt - 1))
+                    continue
+                print(f"   Micro-batch of {len(df):,} rows from {len(timings)} snapshot(s) "
+                      f"dropped after {attempt} attempt(s): {e}")
+                self._count("dropped", len(timings))
+                return False
+
+        committed = time.time()
+        for fetched_at, last_updated in timings:
+            self.pipeline_latency.add(committed - fetched_at)
+            if last_updated:
+                self.data_latency.add(committed - last_updated)
+        self._count("rows_loaded", len(df))
+        self._count("batches")
+        if config.LAKE_DIR:
+            self._loaded_lake.add([df], len(df))
+            self._archive_loaded()
+        return True
+
+    def _load(self):
+        frames, timings, rows = [], [], 0
+        deadline = None
+        stopping = False
+        while True:
+            timeout = _earliest(None if deadline is None else max(0.0, deadline - time.monotonic()),
+                                self._loaded_lake.timeout())
+            try:
+                item = self.batch_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                df, item_timings = item
+                frames.append(df)
+                timings.extend(item_timings)
+                rows += len(df)
+                if deadline is None:
+                    deadline = time.monotonic() + config.DAEMON_BATCH_MAX_SECONDS
+
+            due = stopping or rows >= config.DAEMON_BATCH_MAX_ROWS or (
+                deadline is not None and time.monotonic() >= deadline)
+            if due and frames:
+                # Retries happen inside _flush, so the queue behind it fills
+                # and throttles the pollers meanwhile.
+                self._flush(frames, timings)
+                frames, timings, rows, deadline = [], [], 0, None
+            self._archive_loaded(force=stopping)
+            if stopping:
+                return
+
+    # ── Reporting ──
+    def report(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+        record = {
+            "run_id": config.RUN_ID,
+            "stage": "realtime_daemon",
+            "at": datetime.utcnow().isoformat(),
+            **counters,
+            "raw_queue": self.raw_queue.qsize(),
+            "batch_queue": self.batch_queue.qsize(),
+            "pipeline_latency_s": self.pipeline_latency.snapshot(),
+            "data_latency_s": self.data_latency.snapshot(),
+            "pools": resources.pool_stats(),
+        }
+        print("METRIC " + json.dumps(record), flush=True)
+        return record
+
+    def run(self, max_seconds=None):
+        pollers = [
+            threading.Thread(target=self._poll, args=(system_id, url), name=f"poll-{system_id}", daemon=True)
+            for system_id, url in self.systems.items()
+        ]
+        transformer = threading.Thread(target=self._transform, name="transform", daemon=True)
+        loader = threading.Thread(target=self._load, name="load", daemon=True)
+        for thread in pollers + [transformer, loader]:
+            thread.start()
+        print(f"Realtime daemon started for {len(pollers)} system(s)")
+
+        started = time.monotonic()
+        while not self.stop_event.is_set():
+            remaining = None if max_seconds is None else max_seconds - (time.monotonic() - started)
+            if remaining is not None and remaining <= 0:
+                break
+            wait = config.DAEMON_REPORT_INTERVAL if remaining is None else min(remaining, config.DAEMON_REPORT_INTERVAL)
+            if not self.stop_event.wait(wait):
+                self.report()
+
+        print("Realtime daemon stopping: draining queues...")
+        self.stop_event.set()
+        for thread in pollers:
+            thread.join()
+        self.raw_queue.put(_STOP)
+        transformer.join()
+        loader.join()
+        return self.report()
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+def run_daemon(max_seconds=None):
+    engine = resources.postgres_engine()
+    create_tables(engine)
+    mongo_db = resources.mongo_database()
+    raw_store.ensure_indexes(mongo_db)
+
+    daemon = RealtimeDaemon(engine, mongo_db)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    return daemon.run(max_seconds=max_seconds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream GBFS snapshots into PostgreSQL")
+    parser.add_argument("--seconds", type=float, help="stop after this long (default: run until signalled)")
+    args = parser.parse_args()
+    run_daemon(max_seconds=args.seconds)
@@ -0,0 +1,139 @@
+import os
+import pickle
+import random
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import config
+import metrics
+
+# ── Task graph runner ─────────────────────────────────────────────────────────
+# A task's function receives the outputs of its dependencies, in the order
+# they are listed. Independent tasks run concurrently; a failed task is
+# retried with exponential backoff, and if it still fails only its
+# downstream tasks are skipped. Every finished task's output is pickled under
+# CHECKPOINT_DIR/<run_id>/, so rerunning with the same run id resumes from the
+# first unfinished task.
+
+class Task:
+    def __init__(self, name, fn, deps=(), retries=config.TASK_RETRIES):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.retries = retries
+
+
+class PipelineFailed(RuntimeError):
+    pass
+
+
+def _checkpoint_path(run_dir, name):
+    return os.path.join(run_dir, f"{name}.pkl")
+
+def _save_checkpoint(run_dir, name, value):
+    path = _checkpoint_path(run_dir, name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def _load_checkpoint(run_dir, name):
+    with open(_checkpoint_path(run_dir, name), "rb") as f:
+        return pickle.load(f)
+
+def _ordered(tasks):
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        for dep in task.deps:
+            if dep not in by_name:
+                raise ValueError(f"Task {task.name!r} depends on unknown task {dep!r}")
+
+    ordered, visiting, done = [], set(), set()
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Task graph has a cycle through {name!r}")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(by_name[name])
+    for task in tasks:
+        visit(task.name)
+    return ordered
+
+def _rows(value):
+    return len(value) if hasattr(value, "columns") else None
+
+def _run_with_retries(task, args):
+    rows_in = sum(_rows(arg) or 0 for arg in args) or None
+    with metrics.stage(task.name, rows_in=rows_in):
+        return _attempt(task, args)
+
+def _attempt(task, args):
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            result = task.fn(*args)
+            metrics.set_rows(rows_out=_rows(result))
+            return result, time.perf_counter() - started
+        except Exception as e:
+            if attempt >= task.retries:
+                raise
+            delay = config.TASK_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random() * 0.25)
+            attempt += 1
+            print(f"   [{task.name}] failed ({e!r}); retry {attempt}/{task.retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+def run_dag(tasks, run_id=config.RUN_ID, checkpoint_dir=config.CHECKPOINT_DIR,
+            max_workers=config.DAG_MAX_WORKERS):
+    tasks = _ordered(tasks)
+    run_dir = os.path.join(checkpoint_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    results, failed, skipped = {}, {}, set()
+    for task in tasks:
+        if os.path.exists(_checkpoint_path(run_dir, task.name)):
+            results[task.name] = _load_checkpoint(run_dir, task.name)
+            print(f"   [{task.name}] restored from checkpoint {run_id}")
+
+    pending = [task for task in tasks if task.name not in results]
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for task in list(pending):
+                if any(dep in failed or dep in skipped for dep in task.deps):
+                    pending.remove(task)
+                    skipped.add(task.name)
+                    print(f"   [{task.name}] skipped (upstream failure)")
+                elif all(dep in results for dep in task.deps):
+                    pending.remove(task)
+                    args = [results[dep] for dep in task.deps]
+                    running[pool.submit(_run_with_retries, task, args)] = task
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    failed[task.name] = e
+                    print(f"   [{task.name}] FAILED: {e!r}")
+                    continue
+                _save_checkpoint(run_dir, task.name, result)
+                results[task.name] = result
+                print(f"   [{task.name}] done in {elapsed:.1f}s")
+
+    if failed:
+        raise PipelineFailed(
+            f"{len(failed)} task(s) failed ({', '.join(failed)}); "
+            f"{len(skipped)} skipped. Rerun with ETL_RUN_ID={run_id} to resume."
+        )
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return results
@@ -1,57 +1,312 @@
+import hashlib
+import json
+import os
 import pandas as pd
 import requests
 import time
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pymongo
 import config
+import metrics
+import raw_store
+import resources
+import lake
+from transform import HISTORICAL_SOURCE_COLUMNS
 
-def extract_historical_csv():
-    print("   1.1 Extracting from data.gov.ie...")
-    csv_url = config.CSV_URL
-    df_raw_csv = pd.read_csv(csv_url)
+class _CountingReader:
+    # File-like wrapper that reports every byte read to the current stage.
+    def __init__(self, raw):
+        self._raw = raw
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        metrics.add_bytes(len(data))
+        return data
+
+def _open_csv(url):
+    response = resources.http_session().get(url, stream=True, timeout=60)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response
+
+@contextmanager
+def _open_source(path):
+    # The local copy of the export when there is one, otherwise the URL.
+    if path:
+        with open(path, 'rb') as f:
+            yield _CountingReader(f)
+    else:
+        with _open_csv(config.CSV_URL) as response:
+            yield _CountingReader(response.raw)
+
+def extract_historical_csv(path=None):
+    print(f"   1.1 Extracting from {path or 'data.gov.ie'}...")
+    with _open_source(path) as source:
+        df_raw_csv = pd.read_csv(source)
     print(f"      Raw: {len(df_raw_csv):,} rows, {len(df_raw_csv.columns)} columns")
     return df_raw_csv
 
-def fetch_and_store_gbfs_snapshots(mongo_uri=config.MONGO_URI, snapshots=config.GBFS_SNAPSHOTS):
-    # MongoDB connection (RAW storage)
-    mongo_client = pymongo.MongoClient(mongo_uri)
-    mongo_db = mongo_client["dublin_bikes"]
-    raw_collection = mongo_db["raw_realtime_snapshots"]
-    raw_collection.delete_many({})
-    print("   Cleared old snapshots from MongoDB")
-
-    station_status_url = config.GBFS_STATUS_URL
-    station_info_url = config.GBFS_INFO_URL
-    print("   STEP 1: Collecting RAW snapshots → MongoDB...")
+def extract_historical_csv_chunks(chunksize=config.HISTORICAL_CHUNKSIZE, path=None):
+    # Only the columns clean_historical needs are parsed; header names are
+    # matched the same way clean_historical normalises them.
+    print(f"   1.1 Streaming from {path or 'data.gov.ie'} in chunks of {chunksize:,} rows...")
+    wanted = set(HISTORICAL_SOURCE_COLUMNS)
+    with _open_source(path) as source:
+        reader = pd.read_csv(
+            source,
+            chunksize=chunksize,
+            usecols=lambda col: col.strip().lower().replace(' ', '_') in wanted,
+        )
+        with reader:
+            for chunk in reader:
+                yield chunk
+
+def download_historical_csv(path, validators=None, url=config.CSV_URL):
+    # Downloads the export to `path` and returns its validators, size and
+    # sha256. With `validators` (etag / last_modified of the copy already
+    # processed) the request is conditional and None means 304 Not Modified.
+    # Bytes land in `path`.part first; if a download is interrupted, the next
+    # call asks for the rest with a Range request guarded by If-Range, and
+    # starts over if the file changed in between.
+    part_path = f"{path}.part"
+    meta_path = f"{part_path}.json"
+    headers = {'Accept-Encoding': 'identity'}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    offset = 0
+    if os.path.exists(part_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            partial = json.load(f)
+        validator = partial.get('etag') or partial.get('last_modified')
+        offset = os.path.getsize(part_path)
+        if offset and validator:
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+    response = resources.http_session().get(url, headers=headers, stream=True, timeout=60)
+    with response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        if response.status_code != 206:
+            offset = 0
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(meta_path, 'w') as f:
+            json.dump({'etag': etag, 'last_modified': last_modified}, f)
+
+        digest = hashlib.sha256()
+        if offset:
+            print(f"      Resuming download at {offset / 1e6:,.1f} MB")
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for block in response.iter_content(chunk_size=1 << 20):
+                f.write(block)
+                digest.update(block)
+                metrics.add_bytes(len(block))
+
+    os.replace(part_path, path)
+    os.remove(meta_path)
+    return {
+        'etag': etag,
+        'last_modified': last_modified,
+        'content_sha256': digest.hexdigest(),
+        'content_bytes': os.path.getsize(path),
+    }
+
+# ── GBFS collection ───────────────────────────────────────────────────────────
+# Every feed request goes through the shared keep-alive session of
+# resources.http_session(), and the ETag /
+# Last-Modified validators of each feed are remembered so repeat polls can be
+# answered with 304 Not Modified.
+_feed_cache = {}
+
+def fetch_gbfs_feed(url, session=None):
+    # Returns (payload, changed, latency_seconds, http_status). "changed" is
+    # False when the server answered 304 or the feed's last_updated has not
+    # moved since the previous poll.
+    session = session or resources.http_session()
+    cached = _feed_cache.get(url)
+    headers = {}
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    started = time.perf_counter()
+    response = session.get(url, headers=headers, timeout=10)
+    latency = time.perf_counter() - started
+
+    metrics.add_bytes(len(response.content))
+    if response.status_code == 304 and cached:
+        return cached['payload'], False, latency, 304
+    response.raise_for_status()
+    payload = response.json()
+
+    changed = cached is None or payload.get('last_updated') != cached['payload'].get('last_updated')
+    _feed_cache[url] = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'payload': payload,
+    }
+    return payload, changed, latency, response.status_code
+
+def next_poll_delay(data_status):
+    # GBFS publishes when the feed was generated (last_updated) and how long it
+    # stays valid (ttl); poll again when the next version is due.
+    ttl = data_status.get('ttl') or 0
+    last_updated = data_status.get('last_updated') or time.time()
+    due_in = last_updated + ttl - time.time()
+    return min(max(due_in, config.GBFS_MIN_POLL_INTERVAL), config.GBFS_MAX_POLL_INTERVAL)
+
+def discover_gbfs_feeds(discovery_url, session=None, language='en'):
+    # Feed name → URL from a gbfs.json discovery document. GBFS 1.x/2.x nest
+    # the feed list under a language key; 3.x lists it directly under data.
+    payload, _, _, _ = fetch_gbfs_feed(discovery_url, session)
+    data = payload.get('data', {})
+    if 'feeds' not in data:
+        data = data.get(language) or next(iter(data.values()), {})
+    return {feed['name']: feed['url'] for feed in data.get('feeds', [])}
+
+def system_feeds(system_id, discovery_url, session):
+    try:
+        feeds = discover_gbfs_feeds(discovery_url, session)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        feeds = config.GBFS_FALLBACK_FEEDS.get(system_id)
+        if not feeds:
+            raise
+        print(f"      [{system_id}] discovery failed ({e}); using configured feed URLs")
+    missing = {'station_status', 'station_information'} - set(feeds)
+    if missing:
+        raise ValueError(f"[{system_id}] gbfs.json does not list {sorted(missing)}")
+    return feeds['station_status'], feeds['station_information']
+
+def _submit(pool, fn, *args):
+    # copy_context() lets pool threads report bytes to the calling stage.
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _snapshot_id(data_status, previous_id=None):
+    # A snapshot is identified by the status feed's last_updated, so polling
+    # an unchanged feed again yields the same id. Feeds without a numeric
+    # last_updated fall back to the fetch time; either way ids stay strictly
+    # increasing per system, even for two snapshots within one second.
+    last_updated = data_status.get('last_updated')
+    if isinstance(last_updated, (int, float)) and not isinstance(last_updated, bool):
+        snapshot_id = int(last_updated)
+    else:
+        snapshot_id = int(datetime.now().timestamp())
+    if previous_id is not None:
+        snapshot_id = max(snapshot_id, previous_id + 1)
+    return snapshot_id
+
+def raw_snapshot(system_id, snapshot_num, data_status, data_info, previous_id=None):
+    return {
+        'system_id': system_id,
+        'snapshot_id': _snapshot_id(data_status, previous_id),
+        'snapshot_num': snapshot_num,
+        'timestamp_utc': datetime.utcnow().isoformat(),
+        'status_raw': data_status,
+        'info_raw': data_info,
+        'status_count': len(data_status['data']['stations']),
+        'info_count': len(data_info['data']['stations'])
+    }
+
+def collect_gbfs_system(system_id, discovery_url, snapshots, session, request_pool):
+    # Polls one system; returns (raw snapshot documents, request latencies).
+    # status and info are requested side by side on the shared request pool.
+    station_status_url, station_info_url = system_feeds(system_id, discovery_url, session)
+    latencies = []
+    collected = []
+    previous_id = None
 
     for snapshot_num in range(snapshots):
-        print(f"      Snapshot {snapshot_num+1}/{snapshots}...", end=" ")
+        data_status = None
         try:
-            response_status = requests.get(station_status_url, timeout=10)
-            response_status.raise_for_status()
-            data_status = response_status.json()
-
-            response_info = requests.get(station_info_url, timeout=10)
-            response_info.raise_for_status()
-            data_info = response_info.json()
-
-            print(f"Status: {len(data_status['data']['stations'])}, Info: {len(data_info['data']['stations'])}", end=" → ")
-
-            snapshot_id = int(datetime.now().timestamp())
-            raw_doc = {
-                'snapshot_id': snapshot_id,
-                'snapshot_num': snapshot_num,
-                'timestamp_utc': datetime.utcnow().isoformat(),
-                'status_raw': data_status,
-                'info_raw': data_info,
-                'status_count': len(data_status['data']['stations']),
-                'info_count': len(data_info['data']['stations'])
-            }
-            raw_collection.insert_one(raw_doc)
-            print(f"Snapshot {snapshot_id} is inserted into MongoDB")
+            status_future = _submit(request_pool, fetch_gbfs_feed, station_status_url, session)
+            info_future = _submit(request_pool, fetch_gbfs_feed, station_info_url, session)
+            data_status, status_changed, status_latency, status_code = status_future.result()
+            data_info, _, info_latency, info_code = info_future.result()
+            latencies.extend([status_latency, info_latency])
+
+            progress = (f"      [{system_id}] Snapshot {snapshot_num+1}/{snapshots}... "
+                        f"status {status_latency*1000:.0f} ms ({status_code}), "
+                        f"info {info_latency*1000:.0f} ms ({info_code}) → ")
+
+            if not status_changed:
+                print(progress + "unchanged, skipped")
+            else:
+                raw_doc = raw_snapshot(system_id, snapshot_num, data_status, data_info, previous_id)
+                previous_id = raw_doc['snapshot_id']
+                collected.append(raw_doc)
+                print(progress + f"Snapshot {raw_doc['snapshot_id']} collected")
 
         except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
+            print(f"      [{system_id}] Snapshot {snapshot_num+1}/{snapshots}... Error: {e}")
 
         if snapshot_num < snapshots - 1:
-            time.sleep(1)
+            delay = next_poll_delay(data_status) if data_status else config.GBFS_MIN_POLL_INTERVAL
+            time.sleep(delay)
+
+    return collected, latencies
+
+def fetch_and_store_gbfs_snapshots(mongo_uri=config.MONGO_URI, snapshots=config.GBFS_SNAPSHOTS,
+                                   systems=None):
+    # MongoDB connection (RAW storage)
+    systems = systems or config.GBFS_SYSTEMS
+    mongo_db = resources.mongo_database(mongo_uri)
+    raw_store.ensure_indexes(mongo_db)
+    raw_collection = mongo_db[raw_store.SNAPSHOT_COLLECTION]
+    raw_collection.delete_many({'system_id': {'$in': list(systems) + [None]}})
+    print(f"   Cleared old snapshots from MongoDB for {len(systems)} system(s)")
+
+    print("   STEP 1: Collecting RAW snapshots → MongoDB...")
+    session = resources.http_session()
+    latencies = []
+    collected = []
+    started = time.perf_counter()
+
+    # Each system runs its own polling loop on a system worker; all of their
+    # feed requests go through one bounded request pool.
+    workers = min(len(systems), config.GBFS_SYSTEM_WORKERS)
+    with ThreadPoolExecutor(max_workers=config.HTTP_POOL_SIZE) as request_pool, \
+         ThreadPoolExecutor(max_workers=workers) as system_pool:
+        futures = {
+            system_id: _submit(system_pool, collect_gbfs_system, system_id, url,
+                               snapshots, session, request_pool)
+            for system_id, url in systems.items()
+        }
+        for system_id, future in futures.items():
+            try:
+                system_docs, system_latencies = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"      [{system_id}] skipped: {e}")
+                continue
+            collected.extend(system_docs)
+            latencies.extend(system_latencies)
+    print(f"      Collected {len(collected)} snapshots from {len(systems)} system(s) "
+          f"in {time.perf_counter() - started:.2f}s")
+
+    write_started = time.perf_counter()
+    stored = raw_store.store_snapshots(mongo_db, collected)
+    print(f"      Wrote {stored} snapshots to MongoDB in {time.perf_counter() - write_started:.2f}s")
+    if config.LAKE_DIR:
+        try:
+            lake.write_raw_snapshots(collected)
+        except Exception as e:
+            print(f"      Could not archive raw snapshots to the lake: {e}")
+
+    if latencies:
+        latencies_ms = sorted(l * 1000 for l in latencies)
+        print(f"      Stored {stored}/{snapshots * len(systems)} snapshots; request latency "
+              f"p50 {latencies_ms[len(latencies_ms) // 2]:.0f} ms, max {latencies_ms[-1]:.0f} ms")
+    return stored
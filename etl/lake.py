@@ -0,0 +1,226 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import config
+import metrics
+from schema import TABLE_COLUMNS
+
+# ── Parquet lake ──────────────────────────────────────────────────────────────
+# Raw and cleaned data are kept as date-partitioned Parquet under
+# config.LAKE_DIR, one directory per dataset in hive layout:
+#
+#   <LAKE_DIR>/<dataset>/date=YYYY-MM-DD/part-*.parquet
+#
+# raw_historical  the historical export as parsed from the CSV (all days)
+# historical      cleaned historical rows, as loaded into historical_stations
+# raw_realtime    one row per GBFS snapshot, payloads kept as JSON text
+# realtime        cleaned realtime rows, as loaded into realtime_stations
+#
+# Every dataset has an explicit Arrow schema; frames are coerced to it before
+# writing so partitions written by different runs always agree. Historical
+# datasets replace the days they write; realtime datasets append. Reads
+# memory-map the files and only touch the requested columns and days.
+
+_PG_TO_ARROW = {
+    'INTEGER':          pa.int32(),
+    'DOUBLE PRECISION': pa.float64(),
+    'NUMERIC(6,4)':     pa.float64(),
+    'TIMESTAMP':        pa.timestamp('us'),
+    'BOOLEAN':          pa.bool_(),
+}
+
+def _arrow_type(pg_type):
+    return _PG_TO_ARROW.get(pg_type, pa.string())
+
+def _table_schema(table):
+    return pa.schema([(name, _arrow_type(pg_type)) for name, pg_type in TABLE_COLUMNS[table]])
+
+SCHEMAS = {
+    'raw_historical': pa.schema([
+        ('station_id',          pa.int64()),
+        ('name',                pa.string()),
+        ('capacity',            pa.int64()),
+        ('lat',                 pa.float64()),
+        ('lon',                 pa.float64()),
+        ('last_reported',       pa.timestamp('us')),
+        ('num_bikes_available', pa.int64()),
+        ('num_docks_available', pa.int64()),
+    ]),
+    'historical': _table_schema('historical_stations'),
+    'raw_realtime': pa.schema([
+        ('system_id',           pa.string()),
+        ('snapshot_id',         pa.int64()),
+        ('snapshot_num',        pa.int32()),
+        ('timestamp_utc',       pa.timestamp('us')),
+        ('status_json',         pa.string()),
+        ('info_json',           pa.string()),
+    ]),
+    'realtime': _table_schema('realtime_stations'),
+}
+
+# Column each dataset is partitioned on, and how it encodes time.
+_PARTITION_SOURCE = {
+    'raw_historical': ('last_reported', 'timestamp'),
+    'historical':     ('last_reported', 'timestamp'),
+    'raw_realtime':   ('snapshot_id',   'epoch'),
+    'realtime':       ('snapshot_id',   'epoch'),
+}
+_APPEND_ONLY = {'raw_realtime', 'realtime'}
+_PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+def dataset_path(dataset, lake_dir=None):
+    return os.path.join(lake_dir or config.LAKE_DIR, dataset)
+
+def _coerce(df, schema):
+    # Converts each column to what the schema expects; unparsable values
+    # become nulls instead of failing the write.
+    columns = {}
+    for field in schema:
+        values = df[field.name] if field.name in df else pd.Series(None, index=df.index, dtype=object)
+        if pa.types.is_integer(field.type):
+            values = pd.to_numeric(values, errors='coerce').astype('Int64')
+        elif pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors='coerce').astype('float64')
+        elif pa.types.is_timestamp(field.type):
+            values = pd.to_datetime(values, errors='coerce')
+        elif pa.types.is_boolean(field.type):
+            values = values.astype('boolean')
+        else:
+            values = values.astype('string')
+        columns[field.name] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def _partition_dates(df, dataset):
+    column, kind = _PARTITION_SOURCE[dataset]
+    if kind == 'epoch':
+        stamps = pd.to_datetime(pd.to_numeric(df[column], errors='coerce'), unit='s')
+    else:
+        stamps = pd.to_datetime(df[column], errors='coerce')
+    return stamps.dt.strftime('%Y-%m-%d')
+
+def _normalise_columns(df):
+    # Header names are matched the way clean_historical normalises them.
+    return df.rename(columns=lambda col: str(col).strip().lower().replace(' ', '_'))
+
+def _to_table(df, dataset):
+    schema = SCHEMAS[dataset]
+    df = _normalise_columns(df)
+    dates = _partition_dates(df, dataset)
+    frame = _coerce(df, schema)
+    frame['date'] = dates
+    frame = frame[frame['date'].notna()]
+    return pa.Table.from_pandas(frame, schema=schema.append(pa.field('date', pa.string())),
+                                preserve_index=False)
+
+def _write_table(table, path):
+    ds.write_dataset(
+        table, path, format='parquet', partitioning=_PARTITIONING,
+        basename_template=f"part-{config.RUN_ID}-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+def _publish(staging, path):
+    # Swaps every day written to `staging` into `path`, replacing the day's
+    # previous files, so a failed write never leaves a half-written day behind.
+    dates = []
+    for name in sorted(os.listdir(staging)):
+        target = os.path.join(path, name)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(os.path.join(staging, name), target)
+        dates.append(name.split('=', 1)[1])
+    return dates
+
+def write_chunks(chunks, dataset, lake_dir=None):
+    # Streams an iterable of frames into the dataset and passes them through
+    # unchanged, so it can sit inside a chunked read. Realtime datasets get
+    # new files next to the existing ones; historical datasets replace the
+    # days they cover once the last chunk has been written.
+    started = time.perf_counter()
+    path = dataset_path(dataset, lake_dir)
+    append = dataset in _APPEND_ONLY
+    target = path if append else os.path.join(path, f"_staging-{uuid.uuid4().hex[:8]}")
+    rows, nbytes, dates = 0, 0, set()
+    try:
+        for chunk in chunks:
+            if len(chunk):
+                table = _to_table(chunk, dataset)
+                if table.num_rows:
+                    _write_table(table, target)
+                    rows += table.num_rows
+                    nbytes += table.nbytes
+                    dates.update(table.column('date').to_pylist())
+            yield chunk
+        if not append and os.path.isdir(target):
+            _publish(target, path)
+    finally:
+        if not append:
+            shutil.rmtree(target, ignore_errors=True)
+    metrics.add_bytes(nbytes)
+    print(f"      Lake: {rows:,} rows → {dataset} ({len(dates)} day(s)) "
+          f"in {time.perf_counter() - started:.2f}s")
+
+def write(df, dataset, lake_dir=None):
+    # Returns the dates written.
+    if df is None or len(df) == 0:
+        return []
+    for _ in write_chunks([df], dataset, lake_dir):
+        pass
+    return sorted(set(_partition_dates(_normalise_columns(df), dataset).dropna()))
+
+def write_raw_snapshots(snapshots, lake_dir=None):
+    rows = pd.DataFrame([{
+        'system_id': snapshot.get('system_id') or config.DEFAULT_SYSTEM_ID,
+        'snapshot_id': snapshot['snapshot_id'],
+        'snapshot_num': snapshot.get('snapshot_num'),
+        'timestamp_utc': snapshot.get('timestamp_utc'),
+        'status_json': json.dumps(snapshot['status_raw'], separators=(',', ':')),
+        'info_json': json.dumps(snapshot['info_raw'], separators=(',', ':')),
+    } for snapshot in snapshots])
+    return write(rows, 'raw_realtime', lake_dir)
+
+def available_dates(dataset, lake_dir=None):
+    path = dataset_path(dataset, lake_dir)
+    if not os.path.isdir(path):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(path)
+                  if name.startswith('date=') and os.listdir(os.path.join(path, name)))
+
+def read(dataset, columns=None, dates=None, filters=None, lake_dir=None):
+    # Memory-mapped read of the given columns, pruned to `dates`
+    # ("YYYY-MM-DD" strings) before any file is opened.
+    path = dataset_path(dataset, lake_dir)
+    schema = SCHEMAS[dataset]
+    if dates is not None:
+        dates = [str(d) for d in dates]
+        present = set(available_dates(dataset, lake_dir))
+        dates = [d for d in dates if d in present]
+        if not dates:
+            return schema.empty_table().select(columns or schema.names).to_pandas()
+        filters = [('date', 'in', dates)] + list(filters or [])
+    elif not os.path.isdir(path):
+        return schema.empty_table().select(columns or schema.names).to_pandas()
+
+    table = pq.read_table(path, columns=columns, filters=filters or None, memory_map=True,
+                          partitioning=_PARTITIONING, schema=schema.append(pa.field('date', pa.string())))
+    metrics.add_bytes(table.nbytes)
+    return table.to_pandas()
+
+def read_raw_snapshots(dates=None, system_id=None, lake_dir=None):
+    # Yields snapshots in the layout clean_realtime_snapshots() takes.
+    filters = [('system_id', '=', system_id)] if system_id else None
+    rows = read('raw_realtime', dates=dates, filters=filters, lake_dir=lake_dir)
+    for row in rows.sort_values(['system_id', 'snapshot_id']).itertuples(index=False):
+        yield {
+            'system_id': row.system_id,
+            'snapshot_id': int(row.snapshot_id),
+            'snapshot_num': row.snapshot_num,
+            'timestamp_utc': row.timestamp_utc.isoformat(),
+            'status_raw': json.loads(row.status_json),
+            'info_raw': json.loads(row.info_json),
+        }
@@ -1,57 +1,295 @@
-from io import StringIO
-from sqlalchemy import create_engine, text
+import struct
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+import config
+import metrics
+from schema import TABLE_COLUMNS, PRIMARY_KEYS, WATERMARK_COLUMNS, WATERMARK_PARTITIONS
+from migrations import DAY_PARTITIONS, ensure_day_partitions, partition_ddl
 
-'''def load_historical_to_postgres(df_csv, engine):
-    print("   1.3 Bulk Insert to PostgreSQL...")
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE TABLE historical_stations RESTART IDENTITY CASCADE"))
-        conn.commit()
-    columns_to_store = ['station_id', 'name', 'capacity', 'lat', 'lon', 
-                       'last_reported', 'num_bikes_available', 'num_docks_available',
-                       'utilization', 'imbalance', 'hour', 'weekday']
+# ── COPY payload encoders ─────────────────────────────────────────────────────
+# PostgreSQL binary COPY: signature, flags, header extension, then one tuple
+# per row (int16 field count, then int32 length + big-endian value per field),
+# terminated by a -1 field count.
+_PGCOPY_HEADER  = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('!h', -1)
+_NULL_FIELD     = struct.pack('!i', -1)
+_PG_EPOCH_US    = 946_684_800_000_000  # 2000-01-01 in microseconds since 1970
+
+def _staging_type(pg_type):
+    # NUMERIC has an awkward binary layout; stage it as float8 and let the
+    # INSERT ... SELECT into the target apply the assignment cast.
+    return 'DOUBLE PRECISION' if pg_type.startswith('NUMERIC') else pg_type
+
+def _fixed_width_cells(values, null_mask, dtype, width):
+    packed = np.empty(len(values), dtype=[('len', '>i4'), ('val', dtype)])
+    packed['len'] = width
+    packed['val'] = values
+    raw = packed.tobytes()
+    step = 4 + width
+    cells = [raw[i:i + step] for i in range(0, len(raw), step)]
+    for i in np.flatnonzero(null_mask):
+        cells[i] = _NULL_FIELD
+    return cells
+
+def _binary_cells(series, pg_type):
+    null_mask = series.isna().to_numpy()
+    pg_type = _staging_type(pg_type)
+
+    if pg_type == 'INTEGER':
+        values = series.fillna(0).to_numpy(dtype=np.int64)
+        return _fixed_width_cells(values, null_mask, '>i4', 4)
+    if pg_type == 'DOUBLE PRECISION':
+        values = series.fillna(0).to_numpy(dtype=np.float64)
+        return _fixed_width_cells(values, null_mask, '>f8', 8)
+    if pg_type == 'BOOLEAN':
+        values = series.fillna(False).to_numpy(dtype=bool)
+        return _fixed_width_cells(values, null_mask, '?', 1)
+    if pg_type == 'TIMESTAMP':
+        stamps = pd.to_datetime(series).astype('datetime64[us]')
+        values = stamps.to_numpy().astype(np.int64) - _PG_EPOCH_US
+        return _fixed_width_cells(values, null_mask, '>i8', 8)
+
+    cells = []
+    for value, is_null in zip(series.astype(str).tolist(), null_mask):
+        if is_null:
+            cells.append(_NULL_FIELD)
+        else:
+            encoded = value.encode('utf-8')
+            cells.append(struct.pack('!i', len(encoded)) + encoded)
+    return cells
+
+def _binary_copy_buffer(df, column_types):
+    field_count = struct.pack('!h', len(column_types))
+    columns = [_binary_cells(df[name], pg_type) for name, pg_type in column_types]
+    buffer = BytesIO()
+    buffer.write(_PGCOPY_HEADER)
+    for row in zip(*columns):
+        buffer.write(field_count)
+        buffer.write(b''.join(row))
+    buffer.write(_PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def _text_copy_buffer(df, column_types):
+    # "text" uses COPY's CSV flavour so station names containing tabs, quotes
+    # or backslashes round-trip without extra escaping.
+    buffer = StringIO()
+    df[[name for name, _ in column_types]].to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+# ── COPY loader ───────────────────────────────────────────────────────────────
+def copy_to_postgres(df, table, engine, fmt=config.COPY_FORMAT, mode="replace",
+                     advance_watermark=False, extra_sql=(), staging=None):
+    # mode="replace" swaps the staged rows in for the current contents;
+    # mode="merge" upserts them on the table's primary key; mode="replace_days"
+    # only replaces the days the staged rows cover (day-partitioned tables
+    # keyed by timestamp), so loads of different days can run side by side
+    # as long as each uses its own `staging` table name. With
+    # advance_watermark the table's watermark moves to the staged maximum in
+    # the same transaction as the rows themselves. extra_sql statements run
+    # last in that transaction; "{staging}" in them names the staging table.
+    column_types = TABLE_COLUMNS[table]
+    column_list = ', '.join(name for name, _ in column_types)
+    staging = staging or f"{table}_staging"
+
+    start = time.perf_counter()
+    if fmt == "binary":
+        payload = _binary_copy_buffer(df, column_types)
+        copy_sql = f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT binary)"
+    elif fmt == "text":
+        payload = _text_copy_buffer(df, column_types)
+        copy_sql = f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    else:
+        raise ValueError(f"Unknown COPY format: {fmt!r} (expected 'text' or 'binary')")
+    encoded_at = time.perf_counter()
+    payload.seek(0, 2)
+    metrics.add_bytes(payload.tell())
+    payload.seek(0)
+
+    staging_ddl = ', '.join(f"{name} {_staging_type(pg_type)}" for name, pg_type in column_types)
+    if mode == "replace":
+        swap_sql = [
+            f"TRUNCATE TABLE {table} RESTART IDENTITY CASCADE",
+            f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging}",
+        ]
+    elif mode == "merge":
+        key = ', '.join(PRIMARY_KEYS[table])
+        updates = ', '.join(
+            f"{name} = EXCLUDED.{name}" for name, _ in column_types
+            if name not in PRIMARY_KEYS[table]
+        )
+        swap_sql = [
+            f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates}",
+        ]
+    elif mode == "replace_days" and DAY_PARTITIONS.get(table, (None, None))[1] == 'timestamp':
+        # Constant bounds, so each DELETE is pruned to its day's partition.
+        column, _ = DAY_PARTITIONS[table]
+        days = sorted(set(df[column].dt.date))
+        swap_sql = [
+            f"DELETE FROM {table} WHERE {column} >= '{day}' AND {column} < '{day + timedelta(days=1)}'"
+            for day in days
+        ] + [f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging}"]
+    else:
+        raise ValueError(f"Unknown load mode: {mode!r} for {table} "
+                         f"(expected 'replace', 'merge' or 'replace_days')")
+
+    if advance_watermark:
+        watermark_column = WATERMARK_COLUMNS[table]
+        partition = WATERMARK_PARTITIONS.get(table)
+        partition_value = partition or "''"
+        group_by = f"GROUP BY {partition} " if partition else ""
+        swap_sql.append(
+            f"INSERT INTO etl_watermarks (table_name, partition_value, watermark_column, watermark_value, updated_at) "
+            f"SELECT '{table}', {partition_value}, '{watermark_column}', MAX({watermark_column})::text, "
+            f"CURRENT_TIMESTAMP FROM {staging} {group_by}"
+            f"HAVING MAX({watermark_column}) IS NOT NULL "
+            f"ON CONFLICT (table_name, partition_value) DO UPDATE SET "
+            f"watermark_value = EXCLUDED.watermark_value, updated_at = EXCLUDED.updated_at"
+        )
+    swap_sql.extend(statement.format(staging=staging) for statement in extra_sql)
 
+    # Everything below runs in a single transaction, so readers keep seeing the
+    # previous contents until the commit.
     connection = engine.raw_connection()
     try:
         cursor = connection.cursor()
-        output = StringIO()
-        df_csv[columns_to_store].to_csv(output, sep='\t', header=False, index=False)
-        output.seek(0)
-        cursor.copy_from(output, 'historical_stations', null='', columns=columns_to_store)
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {staging} ({staging_ddl})")
+        cursor.copy_expert(copy_sql, payload)
+        copied_at = time.perf_counter()
+        if table in DAY_PARTITIONS:
+            ensure_day_partitions(cursor, table, staging)
+        for statement in swap_sql:
+            cursor.execute(statement)
+        cursor.execute(f"DROP TABLE {staging}")
         connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
     finally:
         connection.close()
-    print("The HISTORICAL CSV (2024-09-01) is successfully stored into POSTGRESQL")'''
+    end = time.perf_counter()
 
-def load_historical_to_postgres(df_csv, engine):
-    print("   1.3 Bulk Insert to PostgreSQL...")
+    _report_throughput(f"COPY/{fmt} → {table}", len(df), end - start)
+    print(f"      encode {encoded_at - start:.2f}s, copy {copied_at - encoded_at:.2f}s, "
+          f"{mode} {end - copied_at:.2f}s")
+
+def _report_throughput(label, rows, seconds):
+    rate = rows / seconds if seconds > 0 else float('inf')
+    print(f"      {label}: {rows:,} rows in {seconds:.2f}s ({rate:,.0f} rows/sec)")
 
+def _partition_days(df, table):
+    # The days of the frame's rows, as ensure_day_partitions finds them in SQL.
+    column, kind = DAY_PARTITIONS[table]
+    values = df[column].dropna()
+    stamps = pd.to_datetime(values, unit='s', utc=True) if kind == 'epoch' else pd.to_datetime(values)
+    return sorted(set(stamps.dt.date))
+
+def _to_sql_replace(df, table, engine):
+    start = time.perf_counter()
     with engine.connect() as conn:
-        conn.execute(text("TRUNCATE TABLE historical_stations RESTART IDENTITY CASCADE"))
+        conn.execute(text(f"TRUNCATE TABLE {table} RESTART IDENTITY CASCADE"))
+        # Like the COPY path: the day partitions exist before any row arrives,
+        # so nothing lands in the DEFAULT partition.
+        if table in DAY_PARTITIONS:
+            for day in _partition_days(df, table):
+                conn.execute(text(partition_ddl(table, day)))
         conn.commit()
+    df.to_sql(table, engine, if_exists="append", index=False,
+              chunksize=1000, method="multi")
+    _report_throughput(f"to_sql → {table}", len(df), time.perf_counter() - start)
+
+# ── Incremental loads ─────────────────────────────────────────────────────────
+def read_watermark(table, engine):
+    # The table's high-water mark, or {partition value: mark} for tables in
+    # WATERMARK_PARTITIONS.
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT partition_value, watermark_value FROM etl_watermarks WHERE table_name = :table"),
+            {"table": table},
+        ).all()
+    pg_type = dict(TABLE_COLUMNS[table])[WATERMARK_COLUMNS[table]]
+    parse = pd.Timestamp if pg_type == 'TIMESTAMP' else int
+    if table in WATERMARK_PARTITIONS:
+        return {partition: parse(value) for partition, value in rows}
+    return parse(rows[0][1]) if rows else None
+
+def load_incremental(df, table, engine, fmt=config.COPY_FORMAT, extra_sql=()):
+    # Rows *at* the watermark are reloaded too: the upsert makes that a no-op
+    # for rows already present and picks up any late rows sharing that value.
+    watermark = read_watermark(table, engine)
+    if table in WATERMARK_PARTITIONS:
+        # Mapped on plain values: a categorical partition column would map to
+        # a categorical, which cannot be compared with >=.
+        marks = df[WATERMARK_PARTITIONS[table]].astype(object).map(watermark)
+        if dict(TABLE_COLUMNS[table])[WATERMARK_COLUMNS[table]] == 'TIMESTAMP':
+            marks = pd.to_datetime(marks)
+        else:
+            marks = pd.to_numeric(marks)
+        df = df[marks.isna() | (df[WATERMARK_COLUMNS[table]] >= marks)]
+    elif watermark is not None:
+        df = df[df[WATERMARK_COLUMNS[table]] >= watermark]
+    print(f"      {table} watermark: {watermark} → {len(df):,} rows to upsert")
+
+    if df.empty:
+        print(f"      {table} is already up to date")
+        return 0
+    copy_to_postgres(df, table, engine, fmt=fmt, mode="merge", advance_watermark=True,
+                     extra_sql=extra_sql)
+    return len(df)
 
-    columns_to_store = [
-        'station_id', 'name', 'capacity', 'lat', 'lon',
-        'last_reported', 'num_bikes_available', 'num_docks_available',
-        'utilization', 'imbalance', 'hour', 'weekday'
-    ]
-
-    df_csv[columns_to_store].to_sql(
-        "historical_stations",
-        engine,
-        if_exists="append",
-        index=False,
-        chunksize=1000,
-        method="multi"
-    )
+# ── Table loaders ─────────────────────────────────────────────────────────────
+# Moves the dashboard's per-system latest_snapshot pointers in the same
+# transaction as the realtime rows. A full reload replaces the table, so the
+# pointers follow the staged maxima (and systems no longer present lose
+# theirs); an incremental load only ever moves them forward.
+_LATEST_SNAPSHOT_SQL = (
+    "INSERT INTO latest_snapshot (system_id, snapshot_id, updated_at) "
+    "SELECT system_id, MAX(snapshot_id), CURRENT_TIMESTAMP FROM {{staging}} GROUP BY system_id "
+    "ON CONFLICT (system_id) DO UPDATE SET snapshot_id = {new_value}, updated_at = EXCLUDED.updated_at"
+)
+_LATEST_SNAPSHOT_REPLACE = [
+    "DELETE FROM latest_snapshot WHERE system_id NOT IN (SELECT system_id FROM {staging})",
+    _LATEST_SNAPSHOT_SQL.format(new_value="EXCLUDED.snapshot_id"),
+]
+_LATEST_SNAPSHOT_ADVANCE = [_LATEST_SNAPSHOT_SQL.format(
+    new_value="GREATEST(latest_snapshot.snapshot_id, EXCLUDED.snapshot_id)")]
+
+def load_historical_to_postgres(df_csv, engine, method=config.LOAD_METHOD):
+    print("   1.3 Bulk Insert to PostgreSQL...")
+
+    columns_to_store = [name for name, _ in TABLE_COLUMNS['historical_stations']]
+
+    if config.LOAD_MODE == "incremental":
+        # The cleaned day replaces the stored one whole (as in backfill): a
+        # corrected export can change rows before the watermark, and an
+        # earlier HISTORICAL_DATE lies entirely before it.
+        copy_to_postgres(df_csv[columns_to_store], 'historical_stations', engine, mode="replace_days")
+    elif method == "copy":
+        copy_to_postgres(df_csv[columns_to_store], 'historical_stations', engine)
+    else:
+        _to_sql_replace(df_csv[columns_to_store], 'historical_stations', engine)
 
     print("Historical data successfully loaded")
 
 
-def load_realtime_to_postgres(df_realtime, engine):
+def load_realtime_to_postgres(df_realtime, engine, method=config.LOAD_METHOD):
     print("   2.3 Bulk Insert 2000+ rows to PostgreSQL...")
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE TABLE realtime_stations RESTART IDENTITY CASCADE"))
-        conn.commit()
-    df_realtime.to_sql('realtime_stations', engine, if_exists='append', 
-                      index=False, method='multi', chunksize=1000)
+    if config.LOAD_MODE == "incremental":
+        load_incremental(df_realtime, 'realtime_stations', engine,
+                         extra_sql=_LATEST_SNAPSHOT_ADVANCE)
+    elif method == "copy":
+        copy_to_postgres(df_realtime, 'realtime_stations', engine,
+                         extra_sql=_LATEST_SNAPSHOT_REPLACE)
+    else:
+        _to_sql_replace(df_realtime, 'realtime_stations', engine)
+        with engine.begin() as conn:
+            for statement in _LATEST_SNAPSHOT_REPLACE:
+                conn.execute(text(statement.format(staging='realtime_stations')))
     print("20-SNAPSHOT GBFS data → Stored in MONGODB(RAW) → Cleaned and moved to POSTGRESQL is COMPLETE")
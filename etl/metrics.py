@@ -0,0 +1,127 @@
+import contextvars
+import json
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import text
+import config
+
+# ── Per-stage instrumentation ─────────────────────────────────────────────────
+# Every pipeline stage runs inside stage(), which records wall time, rows in
+# and out, rows/sec, bytes transferred and the process's peak RSS, and prints
+# the record as one JSON line prefixed with "METRIC ". Code running inside a
+# stage (including threads started with contextvars.copy_context().run) can
+# call add_bytes() / set_rows() without being handed the record.
+_current = contextvars.ContextVar("etl_stage", default=None)
+_records = []
+_lock = threading.Lock()
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def add_bytes(n):
+    record = _current.get()
+    if record is not None:
+        with _lock:
+            record["bytes"] += n
+
+def set_rows(rows_in=None, rows_out=None):
+    record = _current.get()
+    if record is None:
+        return
+    if rows_in is not None:
+        record["rows_in"] = rows_in
+    if rows_out is not None:
+        record["rows_out"] = rows_out
+
+@contextmanager
+def stage(name, rows_in=None):
+    record = {
+        "run_id": config.RUN_ID,
+        "stage": name,
+        "started_at": datetime.utcnow().isoformat(),
+        "rows_in": rows_in,
+        "rows_out": None,
+        "bytes": 0,
+        "status": "ok",
+        "error": None,
+    }
+    token = _current.set(record)
+    rss_before = _peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = repr(e)[:500]
+        raise
+    finally:
+        _current.reset(token)
+        wall = time.perf_counter() - started
+        rows = record["rows_out"] if record["rows_out"] is not None else record["rows_in"]
+        record["wall_s"] = round(wall, 3)
+        record["rows_per_sec"] = round(rows / wall, 1) if rows and wall > 0 else None
+        record["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        record["peak_rss_growth_mb"] = round(record["peak_rss_mb"] - rss_before, 1)
+        with _lock:
+            _records.append(record)
+        print("METRIC " + json.dumps(record, default=str), flush=True)
+
+class LatencyWindow:
+    # Rolling p50/p95/max of the last `size` values added.
+    def __init__(self, size=1000):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._values.append(value)
+
+    def snapshot(self):
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return {"p50": None, "p95": None, "max": None}
+        return {
+            "p50": round(values[len(values) // 2], 3),
+            "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+            "max": round(values[-1], 3),
+        }
+
+def records():
+    with _lock:
+        return list(_records)
+
+def summary():
+    stages = records()
+    return {
+        "run_id": config.RUN_ID,
+        "stages": len(stages),
+        "failed": [r["stage"] for r in stages if r["status"] != "ok"],
+        "wall_s": round(sum(r["wall_s"] for r in stages), 3),
+        "bytes": sum(r["bytes"] for r in stages),
+        "peak_rss_mb": max((r["peak_rss_mb"] for r in stages), default=None),
+    }
+
+def write_json(path):
+    with open(path, "w") as f:
+        json.dump({"summary": summary(), "stages": records()}, f, indent=2, default=str)
+
+def persist(engine):
+    stages = records()
+    if not stages:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO pipeline_runs (run_id, stage, started_at, wall_s, rows_in, rows_out,
+                                       rows_per_sec, bytes, peak_rss_mb, status, error)
+            VALUES (:run_id, :stage, :started_at, :wall_s, :rows_in, :rows_out,
+                    :rows_per_sec, :bytes, :peak_rss_mb, :status, :error)
+        """), stages)
+    print(f"   Persisted {len(stages)} stage metrics to pipeline_runs")
@@ -0,0 +1,315 @@
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+# ── Versioned schema migrations ───────────────────────────────────────────────
+# Each migration is (version, description, steps); a step is either a SQL
+# string or a callable taking the open connection. Applied versions are
+# recorded in schema_migrations. Every migration runs in its own transaction
+# under an advisory lock, so two pipelines starting at once cannot apply the
+# same version twice. Never edit a released migration: append a new one.
+
+_MIGRATION_LOCK_ID = 7_243_001
+
+# ── Day partitions ────────────────────────────────────────────────────────────
+# Tables range-partitioned by day: partition key column and how it encodes
+# time ("timestamp", or "epoch" seconds for snapshot ids). Partitions are
+# named <table>_pYYYYMMDD and created on demand by the loaders; a DEFAULT
+# partition catches anything that arrives before its day exists.
+DAY_PARTITIONS = {
+    'historical_stations': ('last_reported', 'timestamp'),
+    'realtime_stations':   ('snapshot_id',   'epoch'),
+}
+
+def partition_day_expr(table):
+    column, kind = DAY_PARTITIONS[table]
+    if kind == 'epoch':
+        return f"CAST(to_timestamp({column}) AT TIME ZONE 'UTC' AS DATE)"
+    return f"CAST({column} AS DATE)"
+
+def partition_ddl(table, day):
+    _, kind = DAY_PARTITIONS[table]
+    next_day = day + timedelta(days=1)
+    if kind == 'epoch':
+        lower = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+        upper = lower + 86_400
+    else:
+        lower, upper = f"'{day.isoformat()}'", f"'{next_day.isoformat()}'"
+    return (f"CREATE TABLE IF NOT EXISTS {table}_p{day:%Y%m%d} PARTITION OF {table} "
+            f"FOR VALUES FROM ({lower}) TO ({upper})")
+
+def ensure_day_partitions(cursor, table, source):
+    # Creates the partitions needed by the rows in `source` (a table or
+    # staging table with the same partition key). DB-API cursor.
+    cursor.execute(f"SELECT DISTINCT {partition_day_expr(table)} FROM {source}")
+    days = [row[0] for row in cursor.fetchall() if row[0] is not None]
+    for day in days:
+        cursor.execute(partition_ddl(table, day))
+    return days
+
+def _is_partitioned(conn, table):
+    return conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+        )
+    """), {"table": table}).scalar()
+
+def _partition_by_day(table, primary_key):
+    def step(conn):
+        if _is_partitioned(conn, table):
+            return
+        column, _ = DAY_PARTITIONS[table]
+        old = f"{table}_unpartitioned"
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey"))
+        conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({column})"
+        ))
+        conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(primary_key)})"))
+        conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+        days = conn.execute(text(f"SELECT DISTINCT {partition_day_expr(table)} FROM {old}")).scalars().all()
+        for day in days:
+            if day is not None:
+                conn.execute(text(partition_ddl(table, day)))
+        conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+        conn.execute(text(f"DROP TABLE {old}"))
+    return step
+
+MIGRATIONS = [
+    (1, "baseline tables", [
+        """
+        CREATE TABLE IF NOT EXISTS historical_stations (
+            station_id        INTEGER          NOT NULL,
+            name              VARCHAR(255),
+            capacity          INTEGER          NOT NULL,
+            lat               DOUBLE PRECISION NOT NULL,
+            lon               DOUBLE PRECISION NOT NULL,
+            last_reported     TIMESTAMP        NOT NULL,
+            num_bikes_available  INTEGER       NOT NULL,
+            num_docks_available  INTEGER       NOT NULL,
+            utilization       NUMERIC(6,4),
+            imbalance         NUMERIC(6,4),
+            hour              INTEGER,
+            weekday           VARCHAR(20),
+            ingest_timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (station_id, last_reported)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_stations (
+            snapshot_id          INTEGER          NOT NULL,
+            station_id           INTEGER          NOT NULL,
+            name                 VARCHAR(255),
+            capacity             INTEGER          NOT NULL,
+            latitude             DOUBLE PRECISION NOT NULL,
+            longitude            DOUBLE PRECISION NOT NULL,
+            num_bikes_available  INTEGER          NOT NULL,
+            num_docks_available  INTEGER          NOT NULL,
+            is_installed         BOOLEAN,
+            is_renting           BOOLEAN,
+            is_returning         BOOLEAN,
+            last_reported        TIMESTAMP,
+            fetch_timestamp      TIMESTAMP        NOT NULL,
+            api_source           VARCHAR(50),
+            utilization          NUMERIC(6,4),
+            status               VARCHAR(20),
+            ingest_timestamp     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (snapshot_id, station_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS etl_watermarks (
+            table_name           VARCHAR(63)      PRIMARY KEY,
+            watermark_column     VARCHAR(63)      NOT NULL,
+            watermark_value      TEXT             NOT NULL,
+            updated_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            id                   BIGSERIAL        PRIMARY KEY,
+            run_id               VARCHAR(64)      NOT NULL,
+            stage                VARCHAR(64)      NOT NULL,
+            started_at           TIMESTAMP        NOT NULL,
+            wall_s               DOUBLE PRECISION,
+            rows_in              BIGINT,
+            rows_out             BIGINT,
+            rows_per_sec         DOUBLE PRECISION,
+            bytes                BIGINT,
+            peak_rss_mb          DOUBLE PRECISION,
+            status               VARCHAR(20),
+            error                TEXT,
+            ingest_timestamp     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS station_hourly_rollup (
+            stat_date            DATE             NOT NULL,
+            hour                 INTEGER          NOT NULL,
+            station_id           INTEGER          NOT NULL,
+            name                 VARCHAR(255),
+            capacity             INTEGER,
+            lat                  DOUBLE PRECISION,
+            lon                  DOUBLE PRECISION,
+            samples              INTEGER          NOT NULL,
+            max_util             DOUBLE PRECISION,
+            mean_util            DOUBLE PRECISION,
+            sum_util             DOUBLE PRECISION,
+            max_imbalance        DOUBLE PRECISION,
+            min_bikes            INTEGER,
+            max_bikes            INTEGER,
+            mean_docks           DOUBLE PRECISION,
+            sum_docks            DOUBLE PRECISION,
+            refreshed_at         TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (stat_date, hour, station_id)
+        );
+        """,
+    ]),
+    (2, "partition historical_stations and realtime_stations by day", [
+        _partition_by_day('historical_stations', ('station_id', 'last_reported')),
+        _partition_by_day('realtime_stations', ('snapshot_id', 'station_id')),
+    ]),
+    (3, "indexes for the dashboard and run-history queries", [
+        # Within a day partition the dashboard filters on hour.
+        "CREATE INDEX IF NOT EXISTS historical_stations_hour_idx ON historical_stations (hour)",
+        "CREATE INDEX IF NOT EXISTS realtime_stations_snapshot_id_idx ON realtime_stations (snapshot_id)",
+        "CREATE INDEX IF NOT EXISTS pipeline_runs_stage_started_idx ON pipeline_runs (stage, started_at)",
+    ]),
+    (4, "latest_snapshot pointer", [
+        """
+        CREATE TABLE IF NOT EXISTS latest_snapshot (
+            id                   BOOLEAN          PRIMARY KEY DEFAULT TRUE CHECK (id),
+            snapshot_id          INTEGER          NOT NULL,
+            updated_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        INSERT INTO latest_snapshot (id, snapshot_id)
+        SELECT TRUE, MAX(snapshot_id) FROM realtime_stations
+        HAVING MAX(snapshot_id) IS NOT NULL
+        ON CONFLICT (id) DO NOTHING
+        """,
+    ]),
+    (5, "station_geometry", [
+        """
+        CREATE TABLE IF NOT EXISTS station_geometry (
+            station_id           INTEGER          PRIMARY KEY,
+            name                 VARCHAR(255),
+            capacity             INTEGER,
+            lat                  DOUBLE PRECISION NOT NULL,
+            lon                  DOUBLE PRECISION NOT NULL,
+            last_seen            TIMESTAMP,
+            updated_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        INSERT INTO station_geometry (station_id, name, capacity, lat, lon, last_seen)
+        SELECT DISTINCT ON (station_id) station_id, name, capacity, lat, lon, last_reported
+        FROM historical_stations
+        ORDER BY station_id, last_reported DESC
+        ON CONFLICT (station_id) DO NOTHING
+        """,
+    ]),
+    (6, "system_id on realtime rows; per-system watermarks and latest snapshot", [
+        # Rows collected before systems were tracked are Dublin's.
+        "ALTER TABLE realtime_stations ADD COLUMN IF NOT EXISTS system_id VARCHAR(32) NOT NULL DEFAULT 'dublin'",
+        "ALTER TABLE realtime_stations DROP CONSTRAINT realtime_stations_pkey",
+        "ALTER TABLE realtime_stations ADD PRIMARY KEY (system_id, snapshot_id, station_id)",
+        "ALTER TABLE etl_watermarks ADD COLUMN IF NOT EXISTS partition_value VARCHAR(64) NOT NULL DEFAULT ''",
+        "ALTER TABLE etl_watermarks DROP CONSTRAINT etl_watermarks_pkey",
+        "ALTER TABLE etl_watermarks ADD PRIMARY KEY (table_name, partition_value)",
+        "UPDATE etl_watermarks SET partition_value = 'dublin' WHERE table_name = 'realtime_stations'",
+        "ALTER TABLE latest_snapshot ADD COLUMN IF NOT EXISTS system_id VARCHAR(32) NOT NULL DEFAULT 'dublin'",
+        "ALTER TABLE latest_snapshot DROP CONSTRAINT latest_snapshot_pkey",
+        "ALTER TABLE latest_snapshot DROP COLUMN id",
+        "ALTER TABLE latest_snapshot ADD PRIMARY KEY (system_id)",
+    ]),
+    (7, "source_state for change detection", [
+        """
+        CREATE TABLE IF NOT EXISTS source_state (
+            source               VARCHAR(64)      PRIMARY KEY,
+            url                  TEXT,
+            etag                 TEXT,
+            last_modified        TEXT,
+            content_sha256       CHAR(64),
+            content_bytes        BIGINT,
+            target_date          DATE,
+            output_fingerprint   CHAR(64),
+            output_rows          INTEGER,
+            run_id               VARCHAR(64),
+            checked_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            changed_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (8, "arrival and departure flows in station_hourly_rollup", [
+        "ALTER TABLE station_hourly_rollup ADD COLUMN IF NOT EXISTS arrivals   INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE station_hourly_rollup ADD COLUMN IF NOT EXISTS departures INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE station_hourly_rollup ADD COLUMN IF NOT EXISTS observed_s DOUBLE PRECISION NOT NULL DEFAULT 0",
+        # Days rolled up before this version get their flows from the
+        # historical rows (same rules as etl/rollup.py at this version).
+        """
+        UPDATE station_hourly_rollup r
+        SET arrivals = f.arrivals, departures = f.departures, observed_s = f.observed_s
+        FROM (
+            SELECT CAST(last_reported AS DATE) AS stat_date, hour, station_id,
+                   COALESCE(SUM(GREATEST(change, 0)) FILTER (WHERE gap_s <= 1800), 0) AS arrivals,
+                   COALESCE(SUM(GREATEST(-change, 0)) FILTER (WHERE gap_s <= 1800), 0) AS departures,
+                   COALESCE(SUM(gap_s) FILTER (WHERE gap_s <= 1800), 0)::float8 AS observed_s
+            FROM (
+                SELECT last_reported, hour, station_id,
+                       num_bikes_available - LAG(num_bikes_available) OVER w AS change,
+                       EXTRACT(EPOCH FROM last_reported - LAG(last_reported) OVER w) AS gap_s
+                FROM historical_stations
+                WHERE CAST(last_reported AS DATE) IN (SELECT DISTINCT stat_date FROM station_hourly_rollup)
+                WINDOW w AS (PARTITION BY station_id, CAST(last_reported AS DATE) ORDER BY last_reported)
+            ) AS samples
+            GROUP BY 1, hour, station_id
+        ) AS f
+        WHERE r.stat_date = f.stat_date AND r.hour = f.hour AND r.station_id = f.station_id
+        """,
+    ]),
+]
+
+def _ensure_migrations_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version              INTEGER          PRIMARY KEY,
+                description          TEXT             NOT NULL,
+                applied_at           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+def current_version(engine):
+    _ensure_migrations_table(engine)
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+def migrate(engine, target=None):
+    _ensure_migrations_table(engine)
+    for version, description, steps in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _MIGRATION_LOCK_ID})
+            applied = conn.execute(
+                text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": version}
+            ).scalar()
+            if applied:
+                continue
+            started = time.perf_counter()
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                {"v": version, "d": description},
+            )
+            print(f"   Applied migration {version}: {description} ({time.perf_counter() - started:.2f}s)")
+    return current_version(engine)
@@ -1,37 +1,141 @@
-from sqlalchemy import create_engine
-from extract import extract_historical_csv, fetch_and_store_gbfs_snapshots
-from transform import clean_historical, clean_realtime_data
+import json
+from extract import extract_historical_csv, extract_historical_csv_chunks, fetch_and_store_gbfs_snapshots
+from transform import clean_historical, clean_historical_stream, clean_realtime_data, HISTORICAL_SOURCE_COLUMNS
 from load import load_historical_to_postgres, load_realtime_to_postgres
 from schema import create_tables
+from rollup import refresh_hourly_rollup
+from geometry import refresh_station_geometry
+from source_state import check_historical_source, output_fingerprint, save_source_state, touch_source_state
+from dag import Task, run_dag
 import config
+import metrics
+import lake
+import resources
 
 def run_pipeline():
     print("Starting Dublin Bikes ETL pipeline...")
 
-    engine = create_engine(
-        config.POSTGRES_URI,
-        connect_args={"sslmode": "require"},
-        pool_pre_ping=True,
-        pool_recycle=300,
-    )
+    engine = resources.postgres_engine()
 
     # Setup tables
-    print("Step 1: Setting up database tables...")
-    create_tables(engine)
+    def setup_tables():
+        print("Step 1: Setting up database tables...")
+        create_tables(engine)
 
     # Historical ETL
-    print("Step 2: Running historical ETL...")
-    df_raw = extract_historical_csv()
-    df_clean = clean_historical(df_raw)
-    load_historical_to_postgres(df_clean, engine)
-    print(f"  Inserted {len(df_clean)} historical rows")
+    # check_historical decides whether anything downstream has to run (see
+    # etl/source_state.py); when it does not, clean_historical returns None
+    # and the load, rollup, geometry and archive steps pass straight through.
+    def check_historical(_):
+        print("Step 2: Running historical ETL...")
+        return check_historical_source(engine)
+
+    def extract_clean_historical(source):
+        if source['action'] == 'skip':
+            return None
+        if source['action'] == 'lake':
+            print(f"   1.1 Reading {config.HISTORICAL_DATE} from the raw lake...")
+            day = lake.read('raw_historical', columns=HISTORICAL_SOURCE_COLUMNS,
+                            dates=[config.HISTORICAL_DATE])
+            df_clean = clean_historical_stream([day])
+        elif config.HISTORICAL_CHUNKSIZE:
+            chunks = extract_historical_csv_chunks(path=source['path'])
+            if config.LAKE_DIR:
+                chunks = lake.write_chunks(chunks, 'raw_historical')
+            df_clean = clean_historical_stream(chunks)
+        else:
+            df_raw = extract_historical_csv(path=source['path'])
+            if config.LAKE_DIR:
+                lake.write(df_raw, 'raw_historical')
+            df_clean = clean_historical(df_raw)
+
+        fingerprint = output_fingerprint(df_clean)
+        if fingerprint == source['loaded_fingerprint']:
+            print(f"      Cleaned {config.HISTORICAL_DATE} is identical to the loaded one; not reloading")
+            save_source_state(engine, {**source['source'], 'target_date': config.HISTORICAL_DATE,
+                                       'output_fingerprint': fingerprint, 'output_rows': len(df_clean)})
+            return None
+        return df_clean
+
+    def load_historical(_, df_clean):
+        if df_clean is None:
+            return
+        load_historical_to_postgres(df_clean, engine)
+        print(f"  Inserted {len(df_clean)} historical rows")
+
+    def refresh_rollup(_, df_clean):
+        if df_clean is not None:
+            refresh_hourly_rollup(engine, df_clean['last_reported'].dt.date.unique())
+
+    def refresh_geometry(_, df_clean):
+        if df_clean is not None:
+            refresh_station_geometry(engine, df_clean)
+
+    def archive_historical(df_clean):
+        if df_clean is not None:
+            lake.write(df_clean, 'historical')
+
+    def record_historical_source(source, df_clean, *_):
+        # Only once the day is fully loaded, so a failed run is redone.
+        if df_clean is None:
+            if source['action'] == 'skip':
+                touch_source_state(engine)
+            return
+        save_source_state(engine, {**source['source'], 'target_date': config.HISTORICAL_DATE,
+                                   'output_fingerprint': output_fingerprint(df_clean),
+                                   'output_rows': len(df_clean)})
 
     # Realtime ETL
-    print("Step 3: Running realtime ETL...")
-    fetch_and_store_gbfs_snapshots()
-    df_realtime = clean_realtime_data()
-    load_realtime_to_postgres(df_realtime, engine)
-    print(f"  Inserted {len(df_realtime)} realtime rows")
+    def collect_realtime():
+        print("Step 3: Running realtime ETL...")
+        return fetch_and_store_gbfs_snapshots()
+
+    def clean_realtime(_):
+        return clean_realtime_data()
+
+    def load_realtime(_, df_realtime):
+        load_realtime_to_postgres(df_realtime, engine)
+        print(f"  Inserted {len(df_realtime)} realtime rows")
+
+    def archive_realtime(df_realtime):
+        lake.write(df_realtime, 'realtime')
+
+    # The historical and realtime branches only meet at the table setup step,
+    # so they run side by side. With REALTIME_MODE="daemon" the realtime
+    # branch is left to etl/daemon.py.
+    tasks = [
+        Task("create_tables",      setup_tables),
+        Task("check_historical",   check_historical, deps=["create_tables"]),
+        Task("clean_historical",   extract_clean_historical, deps=["check_historical"]),
+        Task("load_historical",    load_historical, deps=["create_tables", "clean_historical"]),
+        Task("refresh_rollup",     refresh_rollup, deps=["load_historical", "clean_historical"]),
+        Task("refresh_geometry",   refresh_geometry, deps=["create_tables", "clean_historical"]),
+        Task("record_historical_source", record_historical_source,
+             deps=["check_historical", "clean_historical", "load_historical",
+                   "refresh_rollup", "refresh_geometry"]),
+    ]
+    if config.LAKE_DIR:
+        tasks.append(Task("archive_historical", archive_historical, deps=["clean_historical"]))
+    if config.REALTIME_MODE != "daemon":
+        tasks += [
+            Task("collect_realtime",   collect_realtime),
+            Task("clean_realtime",     clean_realtime, deps=["collect_realtime"]),
+            Task("load_realtime",      load_realtime, deps=["create_tables", "clean_realtime"]),
+        ]
+        if config.LAKE_DIR:
+            tasks.append(Task("archive_realtime", archive_realtime, deps=["clean_realtime"]))
+    try:
+        run_dag(tasks)
+    finally:
+        print("METRIC_SUMMARY " + json.dumps(metrics.summary()))
+        print("METRIC_POOLS " + json.dumps(resources.pool_stats()))
+        if config.METRICS_PATH:
+            metrics.write_json(config.METRICS_PATH)
+        if config.PERSIST_METRICS:
+            try:
+                metrics.persist(engine)
+            except Exception as e:
+                print(f"   Could not persist metrics: {e}")
 
     print("ETL pipeline complete!")
 
@@ -0,0 +1,190 @@
+import hashlib
+import json
+from datetime import datetime
+import pymongo
+import config
+
+# ── Raw snapshot layout in MongoDB ────────────────────────────────────────────
+# raw_station_info        one document per distinct station_information payload,
+#                         keyed by the SHA-256 of its canonical JSON.
+# raw_realtime_snapshots  one document per status snapshot, referencing its
+#                         info payload by hash. A snapshot is either stored in
+#                         full ("status_raw") or, when deltas are enabled, as the
+#                         stations that changed since the previous snapshot
+#                         ("status_delta" + "delta_base").
+# iter_snapshots() rebuilds the original {status_raw, info_raw} documents.
+# Every snapshot carries the system_id of the GBFS system it came from; delta
+# chains never cross systems.
+INFO_COLLECTION     = "raw_station_info"
+SNAPSHOT_COLLECTION = "raw_realtime_snapshots"
+DUPLICATE_KEY       = 11000   # MongoDB error code
+
+def ensure_indexes(mongo_db):
+    mongo_db[SNAPSHOT_COLLECTION].create_index(
+        [('system_id', 1), ('snapshot_id', 1), ('snapshot_num', 1)])
+
+def snapshot_system(snapshot):
+    return snapshot.get('system_id') or config.DEFAULT_SYSTEM_ID
+
+def content_hash(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _split_status(status_raw):
+    # Separates the station list from the envelope (last_updated, ttl, version...).
+    meta = {key: value for key, value in status_raw.items() if key != 'data'}
+    data_meta = {key: value for key, value in status_raw.get('data', {}).items() if key != 'stations'}
+    return meta, data_meta, status_raw['data']['stations']
+
+def _status_delta(previous_stations, stations):
+    previous = {s['station_id']: s for s in previous_stations}
+    current_ids = [s['station_id'] for s in stations]
+    current = set(current_ids)
+
+    delta = {
+        'changed': [s for s in stations if previous.get(s['station_id']) != s],
+        'removed': [station_id for station_id in previous if station_id not in current],
+    }
+    # Order is only stored when it cannot be derived from the previous snapshot.
+    derived = [sid for sid in previous if sid in current]
+    derived += [sid for sid in current_ids if sid not in previous]
+    if derived != current_ids:
+        delta['order'] = current_ids
+    return delta
+
+def _apply_delta(previous_stations, delta):
+    stations = {s['station_id']: s for s in previous_stations}
+    order = list(stations)
+    for station_id in delta['removed']:
+        stations.pop(station_id, None)
+    for station in delta['changed']:
+        if station['station_id'] not in stations:
+            order.append(station['station_id'])
+        stations[station['station_id']] = station
+    order = delta.get('order') or [sid for sid in order if sid in stations]
+    return [stations[sid] for sid in order]
+
+def build_snapshot_docs(snapshots, use_deltas=config.MONGO_STATUS_DELTAS):
+    # snapshots: documents in the original layout, in collection order.
+    # Returns (snapshot_docs, info_payloads_by_hash). The first snapshot of
+    # every system in a batch is stored in full so each batch reconstructs
+    # on its own.
+    info_payloads = {}
+    docs = []
+    previous_by_system = {}
+
+    for snapshot in snapshots:
+        info_hash = content_hash(snapshot['info_raw'])
+        info_payloads[info_hash] = snapshot['info_raw']
+
+        meta, data_meta, stations = _split_status(snapshot['status_raw'])
+        doc = {key: value for key, value in snapshot.items() if key not in ('status_raw', 'info_raw')}
+        doc['system_id'] = system_id = snapshot_system(snapshot)
+        doc['info_hash'] = info_hash
+        previous = previous_by_system.get(system_id)
+
+        if use_deltas and previous is not None:
+            doc['delta_base'] = previous['snapshot_id']
+            doc['status_meta'] = meta
+            doc['status_data_meta'] = data_meta
+            doc['status_delta'] = _status_delta(previous['stations'], stations)
+        else:
+            doc['status_raw'] = snapshot['status_raw']
+
+        docs.append(doc)
+        previous_by_system[system_id] = {'snapshot_id': snapshot['snapshot_id'], 'stations': stations}
+
+    return docs, info_payloads
+
+def store_snapshots(mongo_db, snapshots, use_deltas=config.MONGO_STATUS_DELTAS):
+    if not snapshots:
+        return 0
+    docs, info_payloads = build_snapshot_docs(snapshots, use_deltas)
+
+    info_collection = mongo_db[INFO_COLLECTION]
+    known = {doc['_id'] for doc in info_collection.find(
+        {'_id': {'$in': list(info_payloads)}}, {'_id': 1})}
+    new_info = [
+        {'_id': info_hash, 'info_raw': payload, 'first_seen_utc': datetime.utcnow().isoformat()}
+        for info_hash, payload in info_payloads.items() if info_hash not in known
+    ]
+    if new_info:
+        try:
+            info_collection.insert_many(new_info, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Duplicate keys only mean another writer stored the same payload
+            # first; anything else is a real failure.
+            if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])) \
+                    or e.details.get('writeConcernErrors'):
+                raise
+
+    mongo_db[SNAPSHOT_COLLECTION].insert_many(docs, ordered=True)
+    return len(docs)
+
+def prune_snapshots(mongo_db, before_snapshot_id):
+    # Deletes each system's snapshots older than before_snapshot_id. The cut
+    # is moved back to the newest full snapshot at or before it, so every
+    # delta chain that is kept still starts from its full snapshot. Returns
+    # the number of snapshots deleted.
+    collection = mongo_db[SNAPSHOT_COLLECTION]
+    deleted = 0
+    for system_id in collection.distinct('system_id'):
+        anchor = next(iter(collection.find(
+            {'system_id': system_id, 'snapshot_id': {'$lte': before_snapshot_id},
+             'status_raw': {'$exists': True}},
+            {'snapshot_id': 1}).sort([('snapshot_id', -1)]).limit(1)), None)
+        if anchor is not None:
+            deleted += collection.delete_many(
+                {'system_id': system_id, 'snapshot_id': {'$lt': anchor['snapshot_id']}}).deleted_count
+    return deleted
+
+def stored_systems(mongo_db):
+    collection = mongo_db[SNAPSHOT_COLLECTION]
+    systems = {system_id for system_id in collection.distinct('system_id') if system_id}
+    if collection.find_one({'system_id': None}, {'_id': 1}):
+        systems.add(config.DEFAULT_SYSTEM_ID)
+    return sorted(systems)
+
+def iter_snapshots(mongo_db, limit=None, system_id=None):
+    # Yields snapshots in the original {status_raw, info_raw} layout, one
+    # system after another; limit applies per system.
+    if system_id is None:
+        for stored in stored_systems(mongo_db):
+            yield from iter_snapshots(mongo_db, limit, stored)
+        return
+
+    query = {'system_id': system_id}
+    if system_id == config.DEFAULT_SYSTEM_ID:
+        # Snapshots written before systems were tracked belong to the default one.
+        query = {'system_id': {'$in': [system_id, None]}}
+    cursor = mongo_db[SNAPSHOT_COLLECTION].find(query).sort([('snapshot_id', 1), ('snapshot_num', 1)])
+    if limit:
+        cursor = cursor.limit(limit)
+
+    info_cache = {}
+    previous = None
+    for doc in cursor:
+        if 'status_raw' in doc:
+            status_raw = doc['status_raw']
+        else:
+            if previous is None or previous['snapshot_id'] != doc['delta_base']:
+                raise ValueError(
+                    f"Snapshot {doc['snapshot_id']} is a delta on {doc['delta_base']}, "
+                    "which was not read before it"
+                )
+            status_raw = dict(doc['status_meta'])
+            status_raw['data'] = dict(doc['status_data_meta'])
+            status_raw['data']['stations'] = _apply_delta(
+                previous['status_raw']['data']['stations'], doc['status_delta'])
+
+        info_hash = doc['info_hash']
+        if info_hash not in info_cache:
+            info_cache[info_hash] = mongo_db[INFO_COLLECTION].find_one({'_id': info_hash})['info_raw']
+
+        snapshot = {key: value for key, value in doc.items()
+                    if key not in ('status_meta', 'status_data_meta', 'status_delta', 'delta_base')}
+        snapshot['system_id'] = system_id
+        snapshot['status_raw'] = status_raw
+        snapshot['info_raw'] = info_cache[info_hash]
+        previous = snapshot
+        yield snapshot
@@ -0,0 +1,210 @@
+import atexit
+import os
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+import config
+import metrics
+
+# ── Shared connections ────────────────────────────────────────────────────────
+# One pooled client per backend for the whole process: a SQLAlchemy engine per
+# Postgres URI, a MongoClient per MongoDB URI and a single keep-alive requests
+# session for HTTP. Every module asks here instead of building its own, so a
+# process opens each connection once and reuses it across tasks, threads and
+# pipeline steps. Pool sizes and timeouts come from config; close_all() runs
+# at exit. A forked child (backfill workers) starts with empty registries
+# rather than sharing its parent's sockets.
+#
+# Acquisition metrics, per backend: how many times a connection was taken
+# from the pool, how many new connections that needed, and the latency of
+# both (ms). pool_stats() returns them; the pipeline and the daemon print them
+# as METRIC lines.
+
+_lock = threading.Lock()
+_engines = {}
+_mongo_clients = {}
+_http_session = None
+_acquire = {}
+_connect = {}
+
+def _observe(windows, backend, ms):
+    with _lock:
+        window = windows.get(backend)
+        if window is None:
+            window = windows[backend] = [0, metrics.LatencyWindow()]
+        window[0] += 1
+    window[1].add(ms)
+
+# ── PostgreSQL ────────────────────────────────────────────────────────────────
+class _TimedQueuePool(QueuePool):
+    # Times every checkout: the wait for a free connection, the pre-ping and,
+    # when the pool has none to hand out, the new connection.
+    def connect(self):
+        started = time.perf_counter()
+        connection = super().connect()
+        _observe(_acquire, 'postgres', (time.perf_counter() - started) * 1000)
+        return connection
+
+def pooler_mode(url):
+    if config.POSTGRES_POOLER != "auto":
+        return config.POSTGRES_POOLER
+    # Supabase (Supavisor) and pgbouncer deployments put transaction pooling
+    # on 6543 and session pooling / direct connections on 5432.
+    return "transaction" if url.port == 6543 else "session"
+
+def _engine_options(url):
+    connect_args = {"sslmode": config.POSTGRES_SSLMODE, "connect_timeout": config.POSTGRES_CONNECT_TIMEOUT}
+    if pooler_mode(url) == "transaction" and url.get_backend_name() == "postgresql" \
+            and url.get_driver_name() == "psycopg":
+        # A transaction pooler hands every transaction to whichever server
+        # connection is free, so statements psycopg 3 prepares on one are
+        # missing on the next. psycopg2 never prepares server-side.
+        connect_args["prepare_threshold"] = None
+    return {
+        "connect_args": connect_args,
+        "poolclass": _TimedQueuePool,
+        "pool_size": config.POSTGRES_POOL_SIZE,
+        "max_overflow": config.POSTGRES_MAX_OVERFLOW,
+        "pool_timeout": config.POSTGRES_POOL_TIMEOUT,
+        "pool_recycle": config.POSTGRES_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def postgres_engine(uri=None):
+    uri = uri or config.POSTGRES_URI
+    with _lock:
+        engine = _engines.get(uri)
+        if engine is not None:
+            return engine
+        engine = create_engine(uri, **_engine_options(make_url(uri)))
+
+        @event.listens_for(engine, "do_connect")
+        def _timed_connect(dialect, conn_rec, cargs, cparams):
+            started = time.perf_counter()
+            connection = dialect.connect(*cargs, **cparams)
+            _observe(_connect, 'postgres', (time.perf_counter() - started) * 1000)
+            return connection
+
+        _engines[uri] = engine
+        return engine
+
+# ── MongoDB ───────────────────────────────────────────────────────────────────
+# pymongo and requests are imported on first use, so processes that only need
+# Postgres (the dashboard) don't pay for them.
+def _mongo_listener():
+    from pymongo import monitoring
+
+    class PoolListener(monitoring.ConnectionPoolListener):
+        def connection_checked_out(self, event):
+            _observe(_acquire, 'mongo', (event.duration or 0.0) * 1000)
+
+        def connection_ready(self, event):
+            _observe(_connect, 'mongo', (event.duration or 0.0) * 1000)
+
+        def pool_created(self, event): pass
+        def pool_ready(self, event): pass
+        def pool_cleared(self, event): pass
+        def pool_closed(self, event): pass
+        def connection_created(self, event): pass
+        def connection_closed(self, event): pass
+        def connection_check_out_started(self, event): pass
+        def connection_check_out_failed(self, event): pass
+        def connection_checked_in(self, event): pass
+
+    return PoolListener()
+
+def mongo_client(uri=None):
+    uri = uri or config.MONGO_URI
+    with _lock:
+        client = _mongo_clients.get(uri)
+        if client is None:
+            import pymongo
+            client = _mongo_clients[uri] = pymongo.MongoClient(
+                uri,
+                maxPoolSize=config.MONGO_POOL_SIZE,
+                serverSelectionTimeoutMS=config.MONGO_TIMEOUT_MS,
+                connectTimeoutMS=config.MONGO_TIMEOUT_MS,
+                event_listeners=[_mongo_listener()],
+            )
+        return client
+
+def mongo_database(uri=None, name=config.MONGO_DB):
+    return mongo_client(uri)[name]
+
+# ── HTTP ──────────────────────────────────────────────────────────────────────
+def http_session():
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=max(4, len(config.GBFS_SYSTEMS)),
+                pool_maxsize=config.HTTP_POOL_SIZE,
+                max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)),
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+def _http_counts():
+    # urllib3 counts requests and new connections per host pool.
+    if _http_session is None:
+        return None
+    pools = [adapter.poolmanager.pools[key] for adapter in set(_http_session.adapters.values())
+             for key in adapter.poolmanager.pools.keys()]
+    return {"requests": sum(pool.num_requests for pool in pools),
+            "connections": sum(pool.num_connections for pool in pools)}
+
+# ── Metrics & lifecycle ───────────────────────────────────────────────────────
+def pool_stats():
+    with _lock:
+        backends = sorted(set(_acquire) | set(_connect))
+        stats = {
+            backend: {
+                "acquired": _acquire[backend][0] if backend in _acquire else 0,
+                "acquire_ms": _acquire[backend][1].snapshot() if backend in _acquire else None,
+                "connections": _connect[backend][0] if backend in _connect else 0,
+                "connect_ms": _connect[backend][1].snapshot() if backend in _connect else None,
+            }
+            for backend in backends
+        }
+    http = _http_counts()
+    if http:
+        stats["http"] = http
+    return stats
+
+def close_all():
+    global _http_session
+    with _lock:
+        engines, clients, session = list(_engines.values()), list(_mongo_clients.values()), _http_session
+        _engines.clear()
+        _mongo_clients.clear()
+        _http_session = None
+    for engine in engines:
+        engine.dispose()
+    for client in clients:
+        client.close()
+    if session is not None:
+        session.close()
+
+def _forget_after_fork():
+    # The parent's sockets stay the parent's: drop the references without
+    # closing anything, and start the child's metrics from zero.
+    global _http_session, _lock
+    _lock = threading.Lock()
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+    _mongo_clients.clear()
+    _http_session = None
+    _acquire.clear()
+    _connect.clear()
+
+atexit.register(close_all)
+os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,67 @@
+import time
+from sqlalchemy import text
+
+# ── Station × hour rollup ─────────────────────────────────────────────────────
+# station_hourly_rollup holds one row per (day, hour, station) so the
+# dashboard reads a few thousand pre-aggregated rows instead of the raw day.
+# Sums and sample counts are kept next to the means so any hour range can be
+# re-aggregated exactly: mean = SUM(sum_*) / SUM(samples).
+# Refreshes are per day: the day's rows are rebuilt in one transaction, so
+# readers never see a partially refreshed day.
+#
+# arrivals / departures are the bikes gained / lost between consecutive
+# samples of a station, counted in the hour of the later sample, and
+# observed_s the time those samples span, so arrival and departure rates over
+# any set of days are SUM(arrivals) / SUM(observed_s). Gaps longer than
+# MAX_FLOW_GAP_S (a station offline) are left out. These are net changes per
+# sample interval: a bike taken and another returned in between cancel out.
+MAX_FLOW_GAP_S = 1800
+
+_DELETE_DAY_SQL = """
+    DELETE FROM station_hourly_rollup WHERE stat_date = CAST(:day AS DATE)
+"""
+
+_INSERT_DAY_SQL = """
+    INSERT INTO station_hourly_rollup (
+        stat_date, hour, station_id, name, capacity, lat, lon, samples,
+        max_util, mean_util, sum_util, max_imbalance,
+        min_bikes, max_bikes, mean_docks, sum_docks,
+        arrivals, departures, observed_s
+    )
+    SELECT CAST(:day AS DATE), hour, station_id,
+           MAX(name), MAX(capacity), MAX(lat), MAX(lon), COUNT(*),
+           MAX(utilization)::float8, AVG(utilization)::float8, SUM(utilization)::float8,
+           MAX(imbalance)::float8,
+           MIN(num_bikes_available), MAX(num_bikes_available),
+           AVG(num_docks_available)::float8, SUM(num_docks_available)::float8,
+           COALESCE(SUM(GREATEST(change, 0)) FILTER (WHERE gap_s <= :max_gap), 0),
+           COALESCE(SUM(GREATEST(-change, 0)) FILTER (WHERE gap_s <= :max_gap), 0),
+           COALESCE(SUM(gap_s) FILTER (WHERE gap_s <= :max_gap), 0)::float8
+    FROM (
+        SELECT *,
+               num_bikes_available - LAG(num_bikes_available) OVER w AS change,
+               EXTRACT(EPOCH FROM last_reported - LAG(last_reported) OVER w) AS gap_s
+        FROM historical_stations
+        WHERE last_reported >= CAST(:day AS DATE)
+          AND last_reported <  CAST(:day AS DATE) + INTERVAL '1 day'
+        WINDOW w AS (PARTITION BY station_id ORDER BY last_reported)
+    ) AS day
+    GROUP BY hour, station_id
+"""
+
+def refresh_hourly_rollup(engine, days):
+    days = sorted({str(day) for day in days})
+    if not days:
+        print("   No days to roll up")
+        return 0
+
+    started = time.perf_counter()
+    total = 0
+    for day in days:
+        with engine.begin() as conn:
+            conn.execute(text(_DELETE_DAY_SQL), {"day": day})
+            total += conn.execute(text(_INSERT_DAY_SQL),
+                                  {"day": day, "max_gap": MAX_FLOW_GAP_S}).rowcount
+    print(f"   Refreshed station_hourly_rollup for {len(days)} day(s): "
+          f"{total:,} rows in {time.perf_counter() - started:.2f}s")
+    return total
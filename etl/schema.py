@@ -1,52 +1,101 @@
-from sqlalchemy import create_engine, text
+from migrations import migrate
+
+# Columns written by the ETL, in load order, with their PostgreSQL types.
+# Kept next to the DDL below so the loaders can build staging tables and
+# encode COPY payloads without reflecting the database.
+HISTORICAL_COLUMNS = [
+    ('station_id',          'INTEGER'),
+    ('name',                'VARCHAR(255)'),
+    ('capacity',            'INTEGER'),
+    ('lat',                 'DOUBLE PRECISION'),
+    ('lon',                 'DOUBLE PRECISION'),
+    ('last_reported',       'TIMESTAMP'),
+    ('num_bikes_available', 'INTEGER'),
+    ('num_docks_available', 'INTEGER'),
+    ('utilization',         'NUMERIC(6,4)'),
+    ('imbalance',           'NUMERIC(6,4)'),
+    ('hour',                'INTEGER'),
+    ('weekday',             'VARCHAR(20)'),
+]
+
+REALTIME_COLUMNS = [
+    ('system_id',           'VARCHAR(32)'),
+    ('snapshot_id',         'INTEGER'),
+    ('station_id',          'INTEGER'),
+    ('name',                'VARCHAR(255)'),
+    ('capacity',            'INTEGER'),
+    ('latitude',            'DOUBLE PRECISION'),
+    ('longitude',           'DOUBLE PRECISION'),
+    ('num_bikes_available', 'INTEGER'),
+    ('num_docks_available', 'INTEGER'),
+    ('is_installed',        'BOOLEAN'),
+    ('is_renting',          'BOOLEAN'),
+    ('is_returning',        'BOOLEAN'),
+    ('last_reported',       'TIMESTAMP'),
+    ('fetch_timestamp',     'TIMESTAMP'),
+    ('api_source',          'VARCHAR(50)'),
+    ('utilization',         'NUMERIC(6,4)'),
+    ('status',              'VARCHAR(20)'),
+]
+
+TABLE_COLUMNS = {
+    'historical_stations': HISTORICAL_COLUMNS,
+    'realtime_stations':   REALTIME_COLUMNS,
+}
+
+# In-memory dtypes of the cleaned frames, derived from the column types
+# above: VARCHAR → category, NUMERIC(6,4) → float32 (the table keeps four
+# decimals anyway), INTEGER → int32 unless the column's values are known to
+# be small, TIMESTAMP → datetime64[us] (PostgreSQL's resolution). Latitude
+# and longitude stay float64 so stored positions are unchanged.
+SMALL_INTEGER_COLUMNS = {
+    'capacity':            'int16',
+    'num_bikes_available': 'int16',
+    'num_docks_available': 'int16',
+    'hour':                'int8',
+}
+_PANDAS_TYPES = {
+    'INTEGER':          'int32',
+    'DOUBLE PRECISION': 'float64',
+    'BOOLEAN':          'bool',
+    'TIMESTAMP':        'datetime64[us]',
+}
+
+def pandas_dtype(name, pg_type):
+    if name in SMALL_INTEGER_COLUMNS:
+        return SMALL_INTEGER_COLUMNS[name]
+    if pg_type.startswith('VARCHAR'):
+        return 'category'
+    if pg_type.startswith('NUMERIC'):
+        return 'float32'
+    return _PANDAS_TYPES[pg_type]
+
+FRAME_DTYPES = {
+    table: {name: pandas_dtype(name, pg_type) for name, pg_type in columns}
+    for table, columns in TABLE_COLUMNS.items()
+}
+
+PRIMARY_KEYS = {
+    'historical_stations': ('station_id', 'last_reported'),
+    'realtime_stations':   ('system_id', 'snapshot_id', 'station_id'),
+}
+
+# Column whose high-water mark drives incremental loads of each table.
+WATERMARK_COLUMNS = {
+    'historical_stations': 'last_reported',
+    'realtime_stations':   'snapshot_id',
+}
+
+# Tables whose watermark is kept per value of this column (one row per
+# GBFS system), so a slow or failed system never hides another's rows.
+WATERMARK_PARTITIONS = {
+    'realtime_stations':   'system_id',
+}
 
 
 def create_tables(engine):
-    historical_table_sql = """
-    CREATE TABLE IF NOT EXISTS historical_stations (
-        station_id        INTEGER          NOT NULL,
-        name              VARCHAR(255),
-        capacity          INTEGER          NOT NULL,
-        lat               DOUBLE PRECISION NOT NULL,
-        lon               DOUBLE PRECISION NOT NULL,
-        last_reported     TIMESTAMP        NOT NULL,
-        num_bikes_available  INTEGER       NOT NULL,
-        num_docks_available  INTEGER       NOT NULL,
-        utilization       NUMERIC(6,4),
-        imbalance         NUMERIC(6,4),
-        hour              INTEGER,
-        weekday           VARCHAR(20),
-        ingest_timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (station_id, last_reported)
-    );
-    """
-
-    realtime_table_sql = """
-    CREATE TABLE IF NOT EXISTS realtime_stations (
-        snapshot_id          INTEGER          NOT NULL,
-        station_id           INTEGER          NOT NULL,
-        name                 VARCHAR(255),
-        capacity             INTEGER          NOT NULL,
-        latitude             DOUBLE PRECISION NOT NULL,
-        longitude            DOUBLE PRECISION NOT NULL,
-        num_bikes_available  INTEGER          NOT NULL,
-        num_docks_available  INTEGER          NOT NULL,
-        is_installed         BOOLEAN,
-        is_renting           BOOLEAN,
-        is_returning         BOOLEAN,
-        last_reported        TIMESTAMP,
-        fetch_timestamp      TIMESTAMP        NOT NULL,
-        api_source           VARCHAR(50),
-        utilization          NUMERIC(6,4),
-        status               VARCHAR(20),
-        ingest_timestamp     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (snapshot_id, station_id)
-    );
-    """
-
-    print("Creating PostgreSQL tables (if they don't already exist)...")
-    with engine.connect() as conn:
-        conn.execute(text(historical_table_sql))
-        conn.execute(text(realtime_table_sql))
-        conn.commit()
-    print("Tables ready.")
+    # Tables are created and evolved by the versioned migrations in
+    # migrations.py; this stays the single entry point the pipeline calls.
+    print("Applying PostgreSQL schema migrations...")
+    version = migrate(engine)
+    print(f"Tables ready (schema version {version}).")
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import pandas as pd
+from sqlalchemy import text
+from extract import download_historical_csv
+import config
+import lake
+
+# ── Change detection ──────────────────────────────────────────────────────────
+# source_state remembers, per source, what the last successful run processed:
+# the HTTP validators and sha256 of the download, and the fingerprint and row
+# count of the cleaned target day that was loaded. check_historical_source()
+# decides what the historical branch has to do this run:
+#
+#   skip   the export did not change (304, or same sha256) and the target day
+#          is already loaded: nothing downstream runs
+#   lake   the export did not change but the day is not loaded yet (e.g. a new
+#          HISTORICAL_DATE): clean it from the raw lake without downloading
+#   csv    clean the local copy of the export
+#
+# A cleaned day whose fingerprint matches the stored one is not reloaded
+# either, even if the export itself changed.
+
+HISTORICAL_SOURCE = "historical_csv"
+FINGERPRINT_COLUMNS = [
+    'station_id', 'name', 'capacity', 'lat', 'lon', 'last_reported',
+    'num_bikes_available', 'num_docks_available', 'utilization', 'imbalance',
+]
+
+_UPSERT_SQL = """
+    INSERT INTO source_state (source, url, etag, last_modified, content_sha256, content_bytes,
+                              target_date, output_fingerprint, output_rows, run_id,
+                              checked_at, changed_at)
+    VALUES (:source, :url, :etag, :last_modified, :content_sha256, :content_bytes,
+            :target_date, :output_fingerprint, :output_rows, :run_id,
+            CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (source) DO UPDATE SET
+        url                = EXCLUDED.url,
+        etag               = EXCLUDED.etag,
+        last_modified      = EXCLUDED.last_modified,
+        content_sha256     = EXCLUDED.content_sha256,
+        content_bytes      = EXCLUDED.content_bytes,
+        target_date        = EXCLUDED.target_date,
+        output_fingerprint = EXCLUDED.output_fingerprint,
+        output_rows        = EXCLUDED.output_rows,
+        run_id             = EXCLUDED.run_id,
+        checked_at         = CURRENT_TIMESTAMP,
+        changed_at         = CASE
+            WHEN (source_state.content_sha256, source_state.output_fingerprint)
+                 IS DISTINCT FROM (EXCLUDED.content_sha256, EXCLUDED.output_fingerprint)
+            THEN CURRENT_TIMESTAMP ELSE source_state.changed_at END
+"""
+
+def read_source_state(engine, source=HISTORICAL_SOURCE):
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT * FROM source_state WHERE source = :source"),
+                           {"source": source}).mappings().first()
+    return dict(row) if row else None
+
+def save_source_state(engine, state, source=HISTORICAL_SOURCE):
+    fields = ('url', 'etag', 'last_modified', 'content_sha256', 'content_bytes',
+              'target_date', 'output_fingerprint', 'output_rows')
+    params = {field: state.get(field) for field in fields}
+    with engine.begin() as conn:
+        conn.execute(text(_UPSERT_SQL), {**params, "source": source, "run_id": config.RUN_ID})
+
+def touch_source_state(engine, source=HISTORICAL_SOURCE):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE source_state SET checked_at = CURRENT_TIMESTAMP, run_id = :run_id "
+                          "WHERE source = :source"), {"source": source, "run_id": config.RUN_ID})
+
+def output_fingerprint(df):
+    # sha256 over the cleaned rows in a canonical order and dtype, so the
+    # same day gives the same fingerprint whether it came from the CSV or
+    # from the lake.
+    frame = df[FINGERPRINT_COLUMNS].sort_values(['station_id', 'last_reported'], kind='stable')
+    normalised = {}
+    for column in FINGERPRINT_COLUMNS:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            normalised[column] = values.astype('datetime64[ns]').astype('int64')
+        elif pd.api.types.is_numeric_dtype(values):
+            normalised[column] = values.astype('float64')
+        else:
+            normalised[column] = values.astype(str)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(normalised), index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+def _loaded_rows(engine, day):
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT COUNT(*) FROM historical_stations
+            WHERE last_reported >= CAST(:day AS DATE)
+              AND last_reported <  CAST(:day AS DATE) + INTERVAL '1 day'
+        """), {"day": day}).scalar()
+
+def _day_loaded(engine, state):
+    # The stored fingerprint only counts if the table still holds that day.
+    return (state is not None
+            and state['output_fingerprint'] is not None
+            and str(state['target_date']) == config.HISTORICAL_DATE
+            and _loaded_rows(engine, config.HISTORICAL_DATE) >= state['output_rows'])
+
+def check_historical_source(engine):
+    # Returns {'action', 'source': validators and hash of the export,
+    # 'loaded_fingerprint': fingerprint of the day as loaded, 'path'}.
+    path = os.path.join(config.SOURCE_CACHE_DIR, "historical.csv")
+    state = None if config.FORCE_HISTORICAL else read_source_state(engine)
+
+    print("   1.0 Checking the historical export for changes...")
+    download = download_historical_csv(path, validators=state)
+    if download is None:
+        print("      Not modified (304)")
+        source = {key: state[key] for key in ('etag', 'last_modified', 'content_sha256', 'content_bytes')}
+        changed = False
+    else:
+        source = download
+        changed = state is None or download['content_sha256'] != state['content_sha256']
+        print(f"      Downloaded {download['content_bytes'] / 1e6:,.1f} MB, "
+              f"{'changed' if changed else 'same content'} (sha256 {download['content_sha256'][:12]})")
+    source['url'] = config.CSV_URL
+
+    loaded = _day_loaded(engine, state)
+    decision = {'source': source, 'loaded_fingerprint': state['output_fingerprint'] if loaded else None,
+                'path': path}
+    if not changed and loaded:
+        print(f"      {config.HISTORICAL_DATE} is already loaded from this export; skipping")
+        return {**decision, 'action': 'skip'}
+    if not changed and config.LAKE_DIR and config.HISTORICAL_FROM_LAKE \
+            and config.HISTORICAL_DATE in lake.available_dates('raw_historical'):
+        return {**decision, 'action': 'lake'}
+    if download is None and not os.path.exists(path):
+        # 304 for an export we no longer have a local copy of.
+        decision['source'] = {**download_historical_csv(path), 'url': config.CSV_URL}
+    return {**decision, 'action': 'csv'}
@@ -1,96 +1,239 @@
 import pandas as pd
 import numpy as np
-import pymongo
+from concurrent.futures import ThreadPoolExecutor
+from pandas.api.types import union_categoricals
 import config
-
-def clean_historical(df_raw_csv):
+import raw_store
+import resources
+from schema import FRAME_DTYPES
+
+HISTORICAL_SOURCE_COLUMNS = [
+    'station_id', 'name', 'capacity', 'lat', 'lon', 'last_reported',
+    'num_bikes_available', 'num_docks_available'
+]
+
+HISTORICAL_DTYPES = FRAME_DTYPES['historical_stations']
+REALTIME_DTYPES = FRAME_DTYPES['realtime_stations']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# ── Compact frames ────────────────────────────────────────────────────────────
+# Cleaned frames carry exactly their table's columns, in the dtypes of
+# schema.FRAME_DTYPES. Columns are built one at a time from the rows that
+# survive validation, so the full input is never copied.
+def _typed_frame(columns, dtypes):
+    return pd.DataFrame({name: pd.Series(columns[name]).astype(dtype)
+                         for name, dtype in dtypes.items()})
+
+def empty_frame(table):
+    return pd.DataFrame({name: pd.Series(dtype=dtype)
+                         for name, dtype in FRAME_DTYPES[table].items()})
+
+def concat_frames(frames, table):
+    # pd.concat turns categoricals with different categories into object
+    # columns; align the categories first so the result stays compact.
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return empty_frame(table)
+    if len(frames) == 1:
+        return frames[0]
+    for name, dtype in FRAME_DTYPES[table].items():
+        if dtype == 'category':
+            categories = union_categoricals([frame[name] for frame in frames]).categories
+            frames = [frame.assign(**{name: frame[name].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+# ── Historical ────────────────────────────────────────────────────────────────
+def _filter_historical_date(df_csv, target_date):
+    # The target day's rows with last_reported parsed; the input is left as
+    # it is and only the matching rows of the needed columns are taken.
+    df_csv = df_csv.rename(columns=lambda col: col.lower().replace(' ', '_'))
+    stamps = pd.to_datetime(df_csv['last_reported'], errors='coerce')
+    on_day = (stamps.dt.normalize() == pd.Timestamp(target_date)).to_numpy()
+    day = df_csv.loc[on_day, [col for col in HISTORICAL_SOURCE_COLUMNS if col != 'last_reported']]
+    day['last_reported'] = stamps[on_day]
+    return day
+
+def _validate_historical(df_csv):
+    # One pass of masks over the day's rows, then a single take of the valid
+    # ones straight into the table's dtypes.
+    present = df_csv[['station_id', 'capacity', 'lat', 'lon']].notna().all(axis=1).to_numpy()
+    bikes = pd.to_numeric(df_csv['num_bikes_available'], errors='coerce').fillna(0).to_numpy()
+    docks = pd.to_numeric(df_csv['num_docks_available'], errors='coerce').fillna(0).to_numpy()
+    capacity = pd.to_numeric(df_csv['capacity'], errors='coerce').fillna(0).to_numpy()
+    valid = present & (bikes >= 0) & (docks >= 0) & (capacity > 0) & (bikes <= capacity)
+    dropped_missing = int((~present).sum())
+    dropped_invalid = int((present & ~valid).sum())
+
+    columns = {
+        'station_id':          df_csv['station_id'].to_numpy()[valid],
+        'name':                df_csv['name'].to_numpy()[valid],
+        'capacity':            capacity[valid],
+        'lat':                 df_csv['lat'].to_numpy()[valid],
+        'lon':                 df_csv['lon'].to_numpy()[valid],
+        'last_reported':       df_csv['last_reported'].to_numpy()[valid],
+        'num_bikes_available': bikes[valid],
+        'num_docks_available': docks[valid],
+    }
+    columns.update(_enrich_historical(columns))
+    return _typed_frame(columns, HISTORICAL_DTYPES), dropped_missing, dropped_invalid
+
+def _enrich_historical(columns):
+    bikes, capacity = columns['num_bikes_available'], columns['capacity']
+    stamps = pd.DatetimeIndex(columns['last_reported'])
+    return {
+        'utilization': np.round(bikes / capacity, 4),
+        'imbalance':   np.round(np.minimum(np.abs(bikes - capacity * 0.5), 9.99), 4),
+        'hour':        stamps.hour,
+        'weekday':     pd.Categorical.from_codes(stamps.dayofweek, categories=WEEKDAYS),
+    }
+
+def clean_historical(df_raw_csv, target_date=None):
+    # target_date ("YYYY-MM-DD") defaults to config.HISTORICAL_DATE.
+    target_date = target_date or config.HISTORICAL_DATE
     print("   1.2 Cleaning the historical data...")
 
-    df_csv = df_raw_csv.copy()
-
-    print("   Filtering for 2024-09-01 only...")
-    df_csv['last_reported'] = pd.to_datetime(df_csv['last_reported'], errors='coerce')
-    df_csv = df_csv[df_csv['last_reported'].dt.date == pd.to_datetime(config.HISTORICAL_DATE).date()]
-    print(f"      Filtered to {len(df_csv):,} rows for 2024-09-01")
-
-    df_csv.columns = df_csv.columns.str.lower().str.replace(' ', '_')
-
-    initial_rows = len(df_csv)
-    df_csv = df_csv.dropna(subset=['station_id', 'capacity', 'lat', 'lon'])
-    print(f"      Dropped {initial_rows - len(df_csv):,} rows (missing critical fields)")
+    print(f"   Filtering for {target_date} only...")
+    df_csv = _filter_historical_date(df_raw_csv, pd.to_datetime(target_date).date())
+    print(f"      Filtered to {len(df_csv):,} rows for {target_date}")
 
-    df_csv['station_id'] = df_csv['station_id'].astype(int)
-    df_csv['num_bikes_available'] = pd.to_numeric(df_csv['num_bikes_available'], errors='coerce').fillna(0).astype(int)
-    df_csv['num_docks_available'] = pd.to_numeric(df_csv['num_docks_available'], errors='coerce').fillna(0).astype(int)
-    df_csv['capacity'] = pd.to_numeric(df_csv['capacity'], errors='coerce').fillna(0).astype(int)
+    df_csv, dropped_missing, dropped_invalid = _validate_historical(df_csv)
+    print(f"      Dropped {dropped_missing:,} rows (missing critical fields)")
+    print(f"      Dropped {dropped_invalid:,} invalid business logic rows")
 
-    before_validation = len(df_csv)
-    df_csv = df_csv[
-        (df_csv['num_bikes_available'] >= 0) & 
-        (df_csv['num_docks_available'] >= 0) & 
-        (df_csv['capacity'] > 0) &
-        (df_csv['num_bikes_available'] <= df_csv['capacity'])
-    ]
-    print(f"      Dropped {before_validation - len(df_csv):,} invalid business logic rows")
-
-    df_csv['utilization'] = (df_csv['num_bikes_available'] / df_csv['capacity']).round(4)
-    df_csv['imbalance'] = np.minimum(np.abs(df_csv['num_bikes_available'] - df_csv['capacity'] * 0.5),9.99).round(4)
-    df_csv['hour'] = df_csv['last_reported'].dt.hour
-    df_csv['weekday'] = df_csv['last_reported'].dt.day_name()
-
-    print(f"      Final clean dataset: {len(df_csv):,} rows for 2024-09-01")
+    print(f"      Final clean dataset: {len(df_csv):,} rows for {target_date}")
     return df_csv
 
-def clean_realtime_data(mongo_uri=config.MONGO_URI):
-    mongo_client = pymongo.MongoClient(mongo_uri)
-    mongo_db = mongo_client["dublin_bikes"]
-    raw_collection = mongo_db["raw_realtime_snapshots"]
-    all_enriched_data = []
-
-    raw_docs = list(raw_collection.find().sort('snapshot_num', 1).limit(20))
+def clean_historical_chunks(chunks, target_date=None):
+    # Streaming variant of clean_historical: the date filter runs first on every
+    # chunk, so only the target day's rows are ever validated or kept in memory.
+    day = target_date or config.HISTORICAL_DATE
+    target_date = pd.to_datetime(day).date()
+    totals = {'read': 0, 'filtered': 0, 'missing': 0, 'invalid': 0, 'clean': 0}
+
+    for chunk in chunks:
+        totals['read'] += len(chunk)
+        chunk = _filter_historical_date(chunk, target_date)
+        totals['filtered'] += len(chunk)
+        if chunk.empty:
+            continue
+
+        chunk, dropped_missing, dropped_invalid = _validate_historical(chunk)
+        totals['missing'] += dropped_missing
+        totals['invalid'] += dropped_invalid
+        if chunk.empty:
+            continue
+
+        totals['clean'] += len(chunk)
+        yield chunk
+
+    print(f"      Streamed {totals['read']:,} rows, {totals['filtered']:,} on {day}")
+    print(f"      Dropped {totals['missing']:,} rows (missing critical fields)")
+    print(f"      Dropped {totals['invalid']:,} invalid business logic rows")
+    print(f"      Final clean dataset: {totals['clean']:,} rows for {day}")
+
+def clean_historical_stream(chunks, target_date=None):
+    print("   1.2 Cleaning the historical data (streaming)...")
+    return concat_frames(clean_historical_chunks(chunks, target_date), 'historical_stations')
+
+def _column(frame, name, default):
+    if name not in frame:
+        return pd.Series(default, index=frame.index)
+    return frame[name].where(frame[name].notna(), default)
+
+def _coordinate(info, short_name, long_name):
+    # Same precedence as info.get('lat', info.get('latitude', 0)).
+    value = _column(info, short_name, np.nan)
+    if long_name in info:
+        value = value.fillna(info[long_name])
+    return value.fillna(0)
+
+def _status_frame(raw_docs):
+    # Flattens every snapshot's station list into one frame; per-snapshot
+    # values are repeated with NumPy rather than copied into each record.
+    # Distinct info payloads are framed once and tagged with an integer key.
+    records, system_ids, snapshot_ids, fetch_times, info_codes, counts = [], [], [], [], [], []
+    info_frames, info_codes_by_key = [], {}
     for raw_doc in raw_docs:
         try:
+            stations = raw_doc['status_raw']['data']['stations']
             stations_info = raw_doc['info_raw']['data']['stations']
-            station_lookup = {s['station_id']: s for s in stations_info}
-
-            snapshot_id = raw_doc['snapshot_id']
-            snapshot_data = []
-
-            for station in raw_doc['status_raw']['data']['stations']:
-                station_id = station['station_id']
-                if station_id in station_lookup:
-                    info = station_lookup[station_id]
-                    row = {
-                        'snapshot_id': snapshot_id,
-                        'station_id': station_id,
-                        'name': info.get('name', 'Unknown'),
-                        'capacity': info.get('capacity', 0),
-                        'latitude': info.get('lat', info.get('latitude', 0)),
-                        'longitude': info.get('lon', info.get('longitude', 0)),
-                        'num_bikes_available': station.get('num_bikes_available', 0),
-                        'num_docks_available': station.get('num_docks_available', 0),
-                        'is_installed': station.get('is_installed', True),
-                        'is_renting': station.get('is_renting', True),
-                        'is_returning': station.get('is_returning', True),
-                        'last_reported': pd.to_datetime(station.get('last_reported', None), unit='s'),
-                        'fetch_timestamp': pd.to_datetime(raw_doc['timestamp_utc']),
-                        'api_source': 'cyclocity_gbfs',
-                        'utilization': 0.0,
-                        'status': station.get('status', 'active')
-                    }
-                    snapshot_data.append(row)
-
-            all_enriched_data.extend(snapshot_data)
-        except Exception as e:
-            print(f"Error while cleaning: {e}")
-
-    df_realtime = pd.DataFrame(all_enriched_data)
-    print(f"\n      TOTAL: {len(df_realtime):,} rows across {df_realtime['snapshot_id'].nunique()} snapshots")
+        except (KeyError, TypeError) as e:
+            print(f"Error while cleaning: snapshot {raw_doc.get('snapshot_id')} is missing {e}")
+            continue
+
+        info_key = raw_doc.get('info_hash') or id(raw_doc['info_raw'])
+        if info_key not in info_codes_by_key:
+            info_codes_by_key[info_key] = len(info_frames)
+            info_frames.append(pd.DataFrame.from_records(stations_info).assign(info_key=len(info_frames)))
+
+        records.extend(stations)
+        counts.append(len(stations))
+        system_ids.append(raw_doc.get('system_id') or config.DEFAULT_SYSTEM_ID)
+        snapshot_ids.append(raw_doc['snapshot_id'])
+        fetch_times.append(raw_doc['timestamp_utc'])
+        info_codes.append(info_codes_by_key[info_key])
+
+    status = pd.DataFrame.from_records(records)
+    status['system_id'] = np.repeat(np.asarray(system_ids, dtype=object), counts)
+    status['snapshot_id'] = np.repeat(np.asarray(snapshot_ids, dtype=np.int64), counts)
+    status['fetch_timestamp'] = np.repeat(pd.to_datetime(pd.Series(fetch_times, dtype=object)).to_numpy(), counts)
+    status['info_key'] = np.repeat(np.asarray(info_codes, dtype=np.int64), counts)
+
+    info = pd.concat(info_frames, ignore_index=True) if info_frames else pd.DataFrame()
+    if info.empty:
+        info = pd.DataFrame(columns=['station_id', 'info_key'])
+    # A dict lookup keeps the last entry for a repeated station_id; so does this.
+    info = info.drop_duplicates(subset=['info_key', 'station_id'], keep='last')
+    return status, info
+
+def clean_realtime_snapshots(raw_docs):
+    status, info = _status_frame(raw_docs)
+    if status.empty:
+        return empty_frame('realtime_stations')
+
+    info = pd.DataFrame({
+        'info_key':   info['info_key'],
+        'station_id': info['station_id'],
+        'name':       _column(info, 'name', 'Unknown'),
+        'capacity':   _column(info, 'capacity', 0),
+        'latitude':   _coordinate(info, 'lat', 'latitude'),
+        'longitude':  _coordinate(info, 'lon', 'longitude'),
+    })
+    # info_key already identifies the system, since payloads are framed per
+    # distinct content.
+    df_realtime = status.merge(info, on=['info_key', 'station_id'], how='inner', sort=False)
+
+    df_realtime['num_bikes_available'] = _column(df_realtime, 'num_bikes_available', 0)
+    df_realtime['num_docks_available'] = _column(df_realtime, 'num_docks_available', 0)
+    for flag in ('is_installed', 'is_renting', 'is_returning'):
+        df_realtime[flag] = _column(df_realtime, flag, True)
+    df_realtime['last_reported'] = pd.to_datetime(
+        pd.to_numeric(_column(df_realtime, 'last_reported', np.nan), errors='coerce'), unit='s')
+    df_realtime['api_source'] = 'cyclocity_gbfs'
+    df_realtime['status'] = _column(df_realtime, 'status', 'active')
 
     df_realtime['utilization'] = (df_realtime['num_bikes_available'] / df_realtime['capacity']).fillna(0).round(4)
-    df_realtime['snapshot_id'] = df_realtime['snapshot_id'].astype(int)
-    df_realtime['station_id'] = df_realtime['station_id'].astype(int)
-    df_realtime['num_bikes_available'] = df_realtime['num_bikes_available'].astype(int)
-    df_realtime['num_docks_available'] = df_realtime['num_docks_available'].astype(int)
-    df_realtime['capacity'] = df_realtime['capacity'].astype(int)
+    return _typed_frame(df_realtime, REALTIME_DTYPES)
+
+def clean_realtime_data(mongo_uri=config.MONGO_URI):
+    # Systems are read and cleaned side by side; Mongo reads dominate.
+    mongo_db = resources.mongo_database(mongo_uri)
+    systems = raw_store.stored_systems(mongo_db)
+
+    def clean_system(system_id):
+        # A malformed system is skipped, like a failed feed during extraction,
+        # so it cannot cost the other systems their rows.
+        try:
+            raw_docs = raw_store.iter_snapshots(mongo_db, limit=config.GBFS_SNAPSHOTS, system_id=system_id)
+            return clean_realtime_snapshots(raw_docs)
+        except Exception as e:
+            print(f"      [{system_id}] cleaning failed, skipped: {e}")
+            return empty_frame('realtime_stations')
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(systems), config.GBFS_SYSTEM_WORKERS))) as pool:
+        frames = list(pool.map(clean_system, systems))
+    df_realtime = concat_frames(frames, 'realtime_stations')
+    snapshots = df_realtime[['system_id', 'snapshot_id']].drop_duplicates()
+    print(f"\n      TOTAL: {len(df_realtime):,} rows across {len(snapshots)} snapshots "
+          f"from {df_realtime['system_id'].nunique()} system(s)")
     return df_realtime
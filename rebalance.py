@@ -0,0 +1,91 @@
+# DUBLIN BIKES: network-wide rebalancing plan as a min-cost transportation
+# problem, solved with scipy's HiGHS linprog.
+#
+# Every SURPLUS station offers the bikes it holds above the target fill at its
+# peak; every DEFICIT station asks for the bikes it is short of the target at
+# its low point. Candidate moves are pruned to each surplus station's k
+# nearest deficit stations (haversine BallTree from spatial.build_index), each
+# move is capped at one van load, and the LP minimises bike-km plus a penalty
+# per bike left unmet, so distant or unreachable demand is reported instead of
+# making the problem infeasible. The transportation polytope has integral
+# vertices, so HiGHS returns whole bikes.
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+from spatial import build_index, EARTH_RADIUS_M
+
+TARGET_UTIL = 0.5
+VAN_CAPACITY = 20
+K_NEAREST = 8
+UNMET_PENALTY_KM = 50.0
+
+MOVE_COLUMNS = ["from_station_id", "from_name", "to_station_id", "to_name",
+                "bikes", "distance_km", "from_lat", "from_lon", "to_lat", "to_lon"]
+
+def station_quantities(peak_data, target_util=TARGET_UTIL):
+    # Bikes to take from each SURPLUS station and bring to each DEFICIT one.
+    target = np.rint(peak_data["capacity"] * target_util)
+    supply = (peak_data["max_demand"] - target).clip(lower=0)
+    demand = (target - peak_data["min_supply"]).clip(lower=0)
+    is_surplus = (peak_data["status"] == "SURPLUS") & (supply > 0)
+    is_deficit = (peak_data["status"] == "DEFICIT") & (demand > 0)
+    surplus = peak_data[is_surplus].assign(bikes=supply[is_surplus].to_numpy())
+    deficit = peak_data[is_deficit].assign(bikes=demand[is_deficit].to_numpy())
+    return surplus, deficit
+
+def candidate_edges(surplus, deficit, k=K_NEAREST):
+    # (surplus index, deficit index, distance km) for each surplus station's
+    # k nearest deficit stations.
+    k = min(k, len(deficit))
+    tree = build_index(deficit)
+    dist, idx = tree.query(np.radians(surplus[["lat", "lon"]].to_numpy(dtype=float)), k=k)
+    src = np.repeat(np.arange(len(surplus)), k)
+    return src, idx.ravel(), dist.ravel() * EARTH_RADIUS_M / 1000
+
+def plan_moves(peak_data, van_capacity=VAN_CAPACITY, k=K_NEAREST,
+               unmet_penalty_km=UNMET_PENALTY_KM, target_util=TARGET_UTIL):
+    """Returns (moves, summary): one row per station pair with bikes > 0, and
+    totals for supply, demand, moved bikes, bike-km and unmet demand."""
+    surplus, deficit = station_quantities(peak_data, target_util)
+    summary = {"surplus_stations": len(surplus), "deficit_stations": len(deficit),
+               "supply": int(surplus["bikes"].sum()), "demand": int(deficit["bikes"].sum()),
+               "moved": 0, "bike_km": 0.0, "unmet": int(deficit["bikes"].sum())}
+    if surplus.empty or deficit.empty:
+        return pd.DataFrame(columns=MOVE_COLUMNS), summary
+
+    src, dst, dist = candidate_edges(surplus, deficit, k)
+    n_edges, n_deficit = len(src), len(deficit)
+    # Variables: one flow per edge, then one unmet-demand slack per deficit station.
+    cost = np.concatenate([dist, np.full(n_deficit, unmet_penalty_km)])
+    edges = np.arange(n_edges)
+    a_ub = sparse.csr_matrix((np.ones(n_edges), (src, edges)), shape=(len(surplus), n_edges + n_deficit))
+    a_eq = sparse.hstack([
+        sparse.csr_matrix((np.ones(n_edges), (dst, edges)), shape=(n_deficit, n_edges)),
+        sparse.identity(n_deficit, format="csr"),
+    ]).tocsr()
+    bounds = np.column_stack([
+        np.zeros(n_edges + n_deficit),
+        np.concatenate([np.full(n_edges, float(van_capacity)), np.full(n_deficit, np.inf)]),
+    ])
+    result = linprog(cost, A_ub=a_ub, b_ub=surplus["bikes"].to_numpy(dtype=float),
+                     A_eq=a_eq, b_eq=deficit["bikes"].to_numpy(dtype=float),
+                     bounds=bounds, method="highs")
+    if result.status != 0:
+        raise RuntimeError(f"Rebalancing LP failed: {result.message}")
+
+    flow = np.rint(result.x[:n_edges]).astype(int)
+    used = flow > 0
+    s, d = surplus.iloc[src[used]], deficit.iloc[dst[used]]
+    moves = pd.DataFrame({
+        "from_station_id": s.index.to_numpy(), "from_name": s["name"].to_numpy(),
+        "to_station_id": d.index.to_numpy(), "to_name": d["name"].to_numpy(),
+        "bikes": flow[used], "distance_km": dist[used].round(2),
+        "from_lat": s["lat"].to_numpy(), "from_lon": s["lon"].to_numpy(),
+        "to_lat": d["lat"].to_numpy(), "to_lon": d["lon"].to_numpy(),
+    }).sort_values(["bikes", "distance_km"], ascending=[False, True], ignore_index=True)
+
+    summary["moved"] = int(moves["bikes"].sum())
+    summary["bike_km"] = float((moves["bikes"] * moves["distance_km"]).sum())
+    summary["unmet"] = summary["demand"] - summary["moved"]
+    return moves, summary
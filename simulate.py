@@ -0,0 +1,184 @@
+# DUBLIN BIKES: Monte Carlo station-inventory simulator that scores a
+# rebalancing plan against doing nothing.
+#
+# Every station's bikes follow a birth-death process: arrivals and departures
+# are Poisson with the station's hourly rates from station_hourly_rollup
+# (SUM(arrivals) / SUM(observed_s) over recent days). A departure from an empty
+# station or an arrival at a full one is lost. The network is stepped in
+# STEP_MINUTES steps with the whole state as one (scenarios, trials, stations)
+# array; each step draws one (trials, stations) batch of arrivals and
+# departures that every scenario shares, so "no plan" and "with plan" are
+# compared on the same random demand and their difference has little noise.
+# A plan is scored by expected empty and full station-minutes.
+#
+# Poisson counts are drawn by inverting the CDF through a lookup table: a
+# uniform draw picks one of CDF_LEVELS bins, the table gives the count at the
+# bin's lower edge, and one comparison with the next CDF threshold settles
+# counts whose threshold falls inside the bin. At these rates that is about 3x
+# faster than Generator.poisson (the tables stay in cache); a bin holding two
+# thresholds, which needs a count less likely than 1 / CDF_LEVELS, rounds the
+# rarer one away.
+import numpy as np
+import pandas as pd
+
+STEP_MINUTES = 5
+N_TRIALS = 1000
+SEED = 0
+CDF_LEVELS = 1024
+
+def hourly_rates(flows, station_ids):
+    """(arrivals, departures) per minute as (24, stations) arrays, in the order
+    of `station_ids`, from rows of station_id, hour, arrivals, departures and
+    observed_s. Hours without observations get the station's all-day rate."""
+    n = len(station_ids)
+    pos = pd.Index(station_ids).get_indexer(flows["station_id"])
+    keep = pos >= 0
+    hour, pos = flows["hour"].to_numpy()[keep].astype(int), pos[keep]
+    totals = np.zeros((3, 24, n))
+    for i, column in enumerate(("arrivals", "departures", "observed_s")):
+        np.add.at(totals[i], (hour, pos), flows[column].to_numpy(dtype=float)[keep])
+    arrivals, departures, minutes = totals[0], totals[1], totals[2] / 60
+
+    all_day = minutes.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily = np.nan_to_num(np.stack([arrivals.sum(axis=0), departures.sum(axis=0)]) / all_day)
+        rates = np.where(minutes > 0, np.stack([arrivals, departures]) / minutes, daily[:, None, :])
+    return rates[0], rates[1]
+
+def _poisson_tables(lam, levels=CDF_LEVELS):
+    # Lookup tables for Poisson(lam) draws, one row per entry of lam:
+    # (count at each bin's lower edge, next CDF threshold), flattened so that
+    # row r's bin b is entry r * levels + b.
+    lam = np.asarray(lam, dtype=float).reshape(-1)
+    top = float(lam.max(initial=0.0))
+    k = np.arange(int(np.ceil(top + 8 * np.sqrt(top) + 8)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_pmf = k * np.log(lam[:, None]) - lam[:, None] - np.cumsum(np.log(np.maximum(k, 1)))
+    cdf = np.cumsum(np.exp(np.nan_to_num(log_pmf, nan=0.0, neginf=-np.inf)), axis=1)
+    cdf[:, -1] = 2.0  # the truncated tail goes to the last count
+    # A bin's count is the number of thresholds at or below its lower edge.
+    first_bin = np.minimum(np.ceil(cdf * levels), levels).astype(np.int64)
+    rows = np.arange(len(lam))[:, None] * (levels + 1)
+    hits = np.bincount((rows + first_bin).ravel(), minlength=len(lam) * (levels + 1))
+    counts = np.cumsum(hits.reshape(len(lam), levels + 1), axis=1)[:, :levels]
+    thresholds = cdf.ravel().take(counts + np.arange(len(lam))[:, None] * len(k))
+    return counts.astype(np.int16).ravel(), thresholds.astype(np.float32).ravel()
+
+def _draw_poisson(rng, tables, n_trials, levels=CDF_LEVELS):
+    # (2, n_trials, stations) counts from tables built on (2, stations) rates.
+    counts, thresholds = tables
+    n = counts.size // levels // 2
+    u = rng.random((2, n_trials, n), dtype=np.float32)
+    index = (u * levels).astype(np.int32)
+    index += (np.arange(2 * n, dtype=np.int32) * levels).reshape(2, 1, n)
+    drawn = counts.take(index)
+    drawn += u >= thresholds.take(index)
+    return drawn
+
+def simulate_inventory(initial_bikes, capacity, arrival_rate, departure_rate, hours,
+                       n_trials=N_TRIALS, step_minutes=STEP_MINUTES, seed=SEED):
+    """Runs every scenario in `initial_bikes` (scenarios, stations) through
+    `hours` (hours of day, in order) and returns per scenario the expected
+    empty and full minutes per station and the empty + full station-minutes of
+    every trial."""
+    # int16 state: stations have at most a few hundred docks, and the counters
+    # top out at 24 * 60 / step_minutes steps.
+    capacity = np.asarray(capacity, dtype=np.int16)
+    bikes = np.asarray(initial_bikes, dtype=np.int16)
+    if ((bikes < 0) | (bikes > capacity)).any():
+        raise ValueError("Initial bikes must lie between 0 and each station's capacity")
+    scenarios, n = bikes.shape
+    bikes = np.ascontiguousarray(np.broadcast_to(bikes[:, None, :], (scenarios, n_trials, n)))
+    empty = np.zeros((scenarios, n_trials, n), dtype=np.int16)
+    full = np.zeros((scenarios, n_trials, n), dtype=np.int16)
+    rng = np.random.default_rng(seed)
+
+    for hour in hours:
+        tables = _poisson_tables(np.stack([arrival_rate[hour % 24], departure_rate[hour % 24]]) * step_minutes)
+        for _ in range(60 // step_minutes):
+            arriving, leaving = _draw_poisson(rng, tables, n_trials)
+            # Departures first, each capped by the bikes docked; then
+            # arrivals, capped by the free docks.
+            bikes -= np.minimum(leaving, bikes)
+            bikes += np.minimum(arriving, capacity - bikes)
+            empty += bikes == 0
+            full += bikes == capacity
+
+    per_trial = (empty.sum(axis=2, dtype=np.int64) + full.sum(axis=2, dtype=np.int64)) * step_minutes
+    return {
+        "empty_minutes": empty.mean(axis=1) * step_minutes,
+        "full_minutes": full.mean(axis=1) * step_minutes,
+        "trial_minutes": per_trial,
+    }
+
+def apply_moves(bikes, capacity, station_ids, moves):
+    """Applies a plan's moves in order to `bikes` (in `station_ids` order).
+    Each move takes at most the bikes its source still holds and the docks
+    its target still has free, so bikes are conserved. Returns (bikes after
+    the plan, bikes actually moved per move, ids of stations in the plan that
+    are not in `station_ids`; their moves are skipped)."""
+    bikes = np.asarray(bikes, dtype=np.int32).copy()
+    capacity = np.asarray(capacity, dtype=np.int32)
+    if moves is None or moves.empty:
+        return bikes, np.zeros(0, dtype=np.int32), []
+    index = pd.Index(station_ids)
+    sources = index.get_indexer(moves["from_station_id"])
+    targets = index.get_indexer(moves["to_station_id"])
+    unknown = sorted(set(moves["from_station_id"][sources < 0]) | set(moves["to_station_id"][targets < 0]))
+
+    applied = np.zeros(len(moves), dtype=np.int32)
+    for i, (source, target, planned) in enumerate(zip(sources, targets, moves["bikes"].to_numpy(dtype=np.int32))):
+        if source < 0 or target < 0:
+            continue
+        moved = max(0, min(planned, bikes[source], capacity[target] - bikes[target]))
+        bikes[source] -= moved
+        bikes[target] += moved
+        applied[i] = moved
+    return bikes, applied, unknown
+
+def start_inventory(rollup, hour):
+    # Stations with capacity and bikes (the hour's mean, to the nearest bike)
+    # from station_hourly_rollup rows, for evaluate_plan.
+    # The estimate is kept within 0..capacity (docks out of service can make
+    # capacity - docks negative).
+    rows = rollup[rollup["hour"] == hour].drop_duplicates("station_id").set_index("station_id")
+    capacity = rows["capacity"].astype(int)
+    bikes = np.rint(capacity - rows["sum_docks"] / rows["samples"]).astype(int)
+    return pd.DataFrame({"name": rows["name"], "capacity": capacity,
+                         "bikes": bikes.clip(lower=0, upper=capacity)})
+
+def evaluate_plan(stations, flows, moves, hours, n_trials=N_TRIALS, step_minutes=STEP_MINUTES, seed=SEED):
+    """Scores a rebalancing plan (rebalance.plan_moves output) over `hours`.
+    `stations` is indexed by station_id with capacity and bikes (the inventory
+    at the start of the window). Returns (per_station, summary): expected
+    empty / full minutes per station without and with the plan, and the
+    network totals with the expected station-minutes the plan prevents and
+    its standard error. Moves are applied as apply_moves does; the summary
+    gives the bikes planned and actually moved, and any unknown stations."""
+    station_ids = stations.index.to_numpy()
+    capacity = stations["capacity"].to_numpy(dtype=np.int32)
+    before = stations["bikes"].to_numpy(dtype=np.int32)
+    after, applied, unknown = apply_moves(before, capacity, station_ids, moves)
+    arrival_rate, departure_rate = hourly_rates(flows, station_ids)
+
+    result = simulate_inventory(np.stack([before, after]), capacity, arrival_rate, departure_rate,
+                                hours, n_trials=n_trials, step_minutes=step_minutes, seed=seed)
+    empty, full = result["empty_minutes"], result["full_minutes"]
+    per_station = pd.DataFrame({
+        "name": stations["name"].to_numpy() if "name" in stations else station_ids,
+        "bikes": before, "bikes_after_plan": after,
+        "empty_minutes": empty[0], "full_minutes": full[0],
+        "plan_empty_minutes": empty[1], "plan_full_minutes": full[1],
+    }, index=stations.index)
+
+    prevented = result["trial_minutes"][0] - result["trial_minutes"][1]
+    summary = {
+        "trials": n_trials, "hours": len(hours),
+        "planned_bikes": int(moves["bikes"].sum()) if moves is not None and not moves.empty else 0,
+        "moved_bikes": int(applied.sum()), "unknown_stations": unknown,
+        "empty_minutes": float(empty[0].sum()), "full_minutes": float(full[0].sum()),
+        "plan_empty_minutes": float(empty[1].sum()), "plan_full_minutes": float(full[1].sum()),
+        "prevented_minutes": float(prevented.mean()),
+        "prevented_stderr": float(prevented.std(ddof=1) / np.sqrt(n_trials)) if n_trials > 1 else 0.0,
+    }
+    return per_station, summary
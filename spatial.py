@@ -0,0 +1,38 @@
+# DUBLIN BIKES: station geometry index shared by the dashboard's clustering
+# and the rebalancer's nearest-neighbour pruning.
+#
+# Coordinates are indexed in a haversine BallTree (on radians), so distances
+# are great-circle metres rather than degrees, which at Dublin's latitude
+# stretch east-west by ~1.65x. The dashboard builds the index once per
+# station set (identified by the md5 of station_geometry) and caches it and
+# the derived cluster labels under that hash, rebuilding only when a station
+# is added, removed or moved.
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_M = 6_371_000.0
+
+def build_index(geometry):
+    # geometry: one row per station with station_id, lat, lon. Rows of the
+    # returned tree follow the frame's order.
+    return BallTree(np.radians(geometry[["lat", "lon"]].to_numpy(dtype=float)), metric="haversine")
+
+def radius_graph(tree, radius_m):
+    # Sparse station x station distance graph (metres) holding every pair
+    # within radius_m, self-pairs included.
+    points = np.asarray(tree.data)
+    neighbours, distances = tree.query_radius(points, r=radius_m / EARTH_RADIUS_M, return_distance=True)
+    rows = np.repeat(np.arange(len(points)), [len(n) for n in neighbours])
+    cols = np.concatenate(neighbours) if len(points) else np.empty(0, dtype=int)
+    data = np.concatenate(distances) * EARTH_RADIUS_M if len(points) else np.empty(0)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(points), len(points)))
+
+def dbscan_labels(tree, radius_m=500, min_samples=3):
+    # DBSCAN on great-circle distance, reusing the index's neighbourhoods
+    # instead of letting DBSCAN build its own.
+    if tree.data.shape[0] == 0:
+        return np.empty(0, dtype=int)
+    graph = radius_graph(tree, radius_m)
+    return DBSCAN(eps=radius_m, min_samples=min_samples, metric="precomputed").fit(graph).labels_
@@ -1,15 +1,22 @@
 # DUBLIN BIKES: SURPLUS/DEFICIT OPTIMIZATION DASHBOARD
+import json
+import os
+import time
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
 from sqlalchemy import create_engine, text
 import warnings
-from sklearn.metrics.pairwise import haversine_distances
-from scipy.optimize import linear_sum_assignment
-from sklearn.cluster import DBSCAN
+from analysis import (
+    compute_peak_data_from_rollup, hourly_heatmap_frame,
+    quantile_from_counts, compact_rollup,
+    rollup_from_historical, utilization_counts,
+)
+
+# plotly, pyarrow, scipy and scikit-learn (via rebalance.py / spatial.py) are
+# imported inside the functions that need them, so a session only pays for
+# the libraries of the sections it actually opens.
 
+RUN_STARTED = time.perf_counter()
 warnings.filterwarnings('ignore')
 
 # ── Page config ───────────────────────────────────────────────────────────────
@@ -31,6 +38,22 @@ engine = get_engine()
 # ── Title & sidebar ───────────────────────────────────────────────────────────
 st.title("DUBLIN BIKES: SURPLUS/DEFICIT OPTIMIZATION DASHBOARD")
 
+# Any day the ETL has rolled up (the daily run's, or a range loaded with
+# etl/backfill.py) can be picked; HISTORICAL_DAY is the default.
+HISTORICAL_DAY = "2024-09-01"
+
+@st.cache_data(ttl=30, show_spinner=False)
+def available_days():
+    with engine.connect() as conn:
+        days = conn.execute(text(
+            "SELECT DISTINCT stat_date FROM station_hourly_rollup ORDER BY stat_date"
+        )).scalars().all()
+    return [day.isoformat() for day in days] or [HISTORICAL_DAY]
+
+days = available_days()
+day = st.sidebar.selectbox("Day", days,
+                           index=days.index(HISTORICAL_DAY) if HISTORICAL_DAY in days else len(days) - 1)
+
 st.sidebar.header("Time Range Selection")
 start_hour = st.sidebar.slider("Start Hour", 0, 23, 7)
 end_hour   = st.sidebar.slider("End Hour",   0, 23, 10)
@@ -40,68 +63,116 @@ if start_hour > end_hour:
     st.stop()
 
 # ── Data loading ──────────────────────────────────────────────────────────────
-@st.cache_data(ttl=300)
-def load_data(start_h, end_h):
-    query = text("""
-        SELECT station_id, name, capacity, lat, lon, last_reported,
-               num_bikes_available, num_docks_available, utilization, imbalance, hour
+# The whole day is fetched once into a compact in-memory frame and every hour
+# range is sliced locally, so moving the sliders never touches Postgres. The
+# cache is keyed by the data version (latest ETL run id, realtime snapshot
+# id and a hash of station_geometry) instead of a timer: it is refetched exactly when the ETL has written
+# something new. The 95th-percentile KPI comes from per-hour utilization
+# counts, which reproduce the exact quantile for any hour range.
+GBFS_SYSTEM    = "dublin"   # realtime rows are stored per GBFS system
+
+# When the ETL's Parquet lake is reachable from the app (LAKE_DIR secret), the
+# historical day is memory-mapped from its partition and rolled up locally
+# instead of being read from Postgres. Realtime rows still come from Postgres.
+LAKE_DIR = st.secrets.get("LAKE_DIR", "")
+LAKE_COLUMNS = ["station_id", "name", "capacity", "lat", "lon", "hour", "last_reported",
+                "utilization", "imbalance", "num_bikes_available", "num_docks_available"]
+
+def read_lake_day(day):
+    partition = os.path.join(LAKE_DIR, "historical", f"date={day}") if LAKE_DIR else None
+    if not partition or not os.path.isdir(partition):
+        return None
+    import pyarrow.parquet as pq
+    return pq.read_table(partition, columns=LAKE_COLUMNS, memory_map=True).to_pandas()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_data_version():
+    with engine.connect() as conn:
+        return tuple(conn.execute(text("""
+            SELECT (SELECT run_id FROM pipeline_runs ORDER BY id DESC LIMIT 1),
+                   (SELECT snapshot_id FROM latest_snapshot WHERE system_id = :system),
+                   (SELECT md5(string_agg(station_id || ':' || lat || ':' || lon, ',' ORDER BY station_id))
+                    FROM station_geometry)
+        """), {"system": GBFS_SYSTEM}).one())
+
+def read_day_rollup(conn, params):
+    df = pd.read_sql(text("""
+        SELECT station_id, name, capacity, lat, lon, hour, samples,
+               max_util, mean_util, sum_util, max_imbalance,
+               min_bikes, max_bikes, mean_docks, sum_docks,
+               arrivals, departures, observed_s
+        FROM station_hourly_rollup
+        WHERE stat_date = CAST(:day AS DATE)
+    """), conn, params=params)
+    util_counts = pd.read_sql(text("""
+        SELECT hour, utilization::float8 AS utilization, COUNT(*) AS n
         FROM historical_stations
-        WHERE DATE(last_reported) = '2024-09-01'
-          AND hour BETWEEN :start AND :end
-    """)
+        WHERE last_reported >= CAST(:day AS DATE)
+          AND last_reported <  CAST(:day AS DATE) + INTERVAL '1 day'
+          AND utilization IS NOT NULL
+        GROUP BY hour, utilization
+    """), conn, params=params)
+    return df, util_counts
+
+@st.cache_data(max_entries=4)
+def load_day(day, version):
+    # `version` is only part of the cache key.
+    historical = read_lake_day(day)
     with engine.connect() as conn:
-        df = pd.read_sql(query, conn, params={"start": start_h, "end": end_h})
-        df_rt = pd.read_sql("""
+        if historical is not None:
+            df, util_counts = rollup_from_historical(historical), utilization_counts(historical)
+        else:
+            df, util_counts = read_day_rollup(conn, {"day": day})
+        df_rt = pd.read_sql(text("""
             SELECT station_id, name, capacity,
                    latitude  AS lat,
                    longitude AS lon,
                    num_bikes_available, num_docks_available, utilization
             FROM realtime_stations
-            WHERE snapshot_id = (SELECT MAX(snapshot_id) FROM realtime_stations)
-        """, conn)
-    return df, df_rt
-
-df, df_rt = load_data(start_hour, end_hour)
+            WHERE system_id = :system
+              AND snapshot_id = (SELECT snapshot_id FROM latest_snapshot WHERE system_id = :system)
+        """), conn, params={"system": GBFS_SYSTEM})
+    util_counts = util_counts.astype({"hour": "int8", "n": "int32"})
+    return compact_rollup(df), util_counts, df_rt
+
+# ── Station geometry ──────────────────────────────────────────────────────────
+# The haversine index is built once per station set (see spatial.py) and
+# shared by every session; cluster labels are cached per set and radius.
+@st.cache_resource(max_entries=2)
+def station_index(geometry_hash):
+    from spatial import build_index
+    with engine.connect() as conn:
+        geometry = pd.read_sql(
+            "SELECT station_id, name, capacity, lat, lon FROM station_geometry ORDER BY station_id", conn
+        )
+    return geometry, build_index(geometry)
+
+@st.cache_data(max_entries=32)
+def cluster_labels(geometry_hash, radius_m):
+    from spatial import dbscan_labels
+    _, tree = station_index(geometry_hash)
+    return dbscan_labels(tree, radius_m=radius_m, min_samples=3)
+
+def load_data(start_h, end_h, version):
+    df_day, util_counts, df_rt = load_day(day, version)
+    df = df_day[df_day["hour"].between(start_h, end_h)]
+    in_range = util_counts[util_counts["hour"].between(start_h, end_h)]
+    by_value = in_range.groupby("utilization")["n"].sum()
+    peak_util_95th = quantile_from_counts(by_value.index.values, by_value.values, 0.95)
+    return df, df_rt, peak_util_95th
+
+# The selected day is part of the version, so every cache below is per day.
+data_version = get_data_version() + (day,)
+df, df_rt, peak_util_95th = load_data(start_hour, end_hour, data_version)
 
 if df.empty:
     st.warning("No data found for the selected time range.")
     st.stop()
 
-# ── Peak analysis ─────────────────────────────────────────────────────────────
-peak_data = df.groupby("station_id").agg(
-    name        =("name",                "first"),
-    capacity    =("capacity",            "first"),
-    lat         =("lat",                 "first"),
-    lon         =("lon",                 "first"),
-    max_util    =("utilization",         "max"),
-    avg_util    =("utilization",         "mean"),
-    max_imbalance=("imbalance",          "max"),
-    max_demand  =("num_bikes_available", "max"),
-    min_supply  =("num_bikes_available", "min"),
-    avg_docks   =("num_docks_available", "mean"),
-).round(3)
-
-for col in ("capacity", "max_util", "avg_util"):
-    peak_data[col] = pd.to_numeric(peak_data[col], errors="coerce")
-
-# Derived metrics
-peak_util_95th          = df["utilization"].quantile(0.95)
-peak_data["imbalance_score"] = (
-    np.abs(peak_data["max_util"] - 0.5) * peak_data["capacity"]
-)
-peak_data["imbalance_score"] = (
-    pd.to_numeric(peak_data["imbalance_score"], errors="coerce").fillna(0)
-)
-
-critical = peak_data[peak_data["imbalance_score"] > peak_data["capacity"] * 0.3]
-
-peak_data["status"] = np.where(
-    peak_data["max_util"] > 0.90, "SURPLUS",
-    np.where(peak_data["avg_util"] < 0.10, "DEFICIT", "BALANCED"),
-)
 
-top5_surplus = peak_data[peak_data["status"] == "SURPLUS"].nlargest(5, "imbalance_score")
-top5_deficit = peak_data[peak_data["status"] == "DEFICIT"].nlargest(5, "imbalance_score")
+# ── Peak analysis ─────────────────────────────────────────────────────────────
+peak_data = compute_peak_data_from_rollup(df)
+hour_range = (start_hour, end_hour)
 
 # ── KPI cards ─────────────────────────────────────────────────────────────────
 col1, col2, col3, col4 = st.columns(4)
@@ -112,150 +183,238 @@ col4.metric("Avg Imbalance Score",    f"{peak_data['imbalance_score'].mean():.1f
 
 st.markdown("---")
 
-# ── Top 5 tables ──────────────────────────────────────────────────────────────
-col1, col2 = st.columns(2)
-
-with col1:
-    st.subheader("Top 5 Surplus Stations")
-    surplus_display = top5_surplus[["name", "capacity", "max_util", "imbalance_score", "status"]].round(2).copy()
-    surplus_display.columns = ["Station Name", "Capacity", "Max Utilization", "Imbalance Score", "Status"]
-    st.dataframe(surplus_display, use_container_width=True)
-
-with col2:
-    st.subheader("Top 5 Deficit Stations")
-    deficit_display = top5_deficit[["name", "capacity", "max_util", "imbalance_score", "status"]].round(2).copy()
-    deficit_display.columns = ["Station Name", "Capacity", "Max Utilization", "Imbalance Score", "Status"]
-    st.dataframe(deficit_display, use_container_width=True)
-
-# ── Smart routes table ────────────────────────────────────────────────────────
-row_ind = col_ind = None  # initialise so the routes map block can check safely
-
-if len(top5_surplus) > 0 and len(top5_deficit) > 0:
-    st.subheader("Optimized Rebalancing Suggestions")
-
-    surplus_coords = top5_surplus[["lat", "lon"]].values
-    deficit_coords = top5_deficit[["lat", "lon"]].values
-    dist_matrix    = haversine_distances(np.radians(surplus_coords), np.radians(deficit_coords)) * 6371
-
-    row_ind, col_ind = linear_sum_assignment(dist_matrix)
-
-    routes_rows = []
-    for i, j in zip(row_ind, col_ind):
-        surplus = top5_surplus.iloc[i]
-        deficit = top5_deficit.iloc[j]
-        routes_rows.append({
-            "From":     surplus["name"][:25],
-            "To":       deficit["name"][:25],
-            "Distance": f"{dist_matrix[i, j]:.1f} km",
-            "Surplus":  f"+{surplus['imbalance_score']:.0f}",
-            "Deficit":  f"-{deficit['imbalance_score']:.0f}",
-        })
-    st.dataframe(pd.DataFrame(routes_rows), use_container_width=True)
-
-st.markdown("---")
-
-# ── Visualizations ────────────────────────────────────────────────────────────
-
-# 1. Utilization Heatmap
-st.subheader("1. Utilization Heatmap")
-peak_hours = df[df["hour"].between(start_hour, end_hour)]
-fig1 = px.density_heatmap(
-    peak_hours.groupby(["hour", "station_id"])["utilization"].mean().reset_index(),
-    x="hour", y="station_id", z="utilization",
-    title=f"Utilization Heatmap ({start_hour:02d}–{end_hour:02d} hours)",
-    color_continuous_scale="RdYlGn_r",
-)
-st.plotly_chart(fig1, use_container_width=True)
-
-# 2. Station Clusters
-st.subheader("2. Station Clusters")
-coords       = df.groupby("station_id")[["lat", "lon", "name", "capacity"]].first().reset_index()
-coords_array = coords[["lat", "lon"]].values
-db           = DBSCAN(eps=500 / 111_000, min_samples=3).fit(coords_array)
-coords["cluster"] = db.labels_
-
-fig2 = px.scatter_mapbox(
-    coords, lat="lat", lon="lon",
-    size="capacity", color="cluster",
-    hover_name="name", hover_data=["capacity"],
-    color_continuous_scale="Viridis",
-    mapbox_style="open-street-map",
-    zoom=12, height=500,
-    title="Station Clusters (radius 500 m)",
-)
-st.plotly_chart(fig2, use_container_width=True)
-
-# 3. Top 10 Critical Stations
-st.subheader("3. Top 10 Critical Stations")
-critical_stations = critical.nlargest(10, "imbalance_score")
-fig_critical = px.bar(
-    critical_stations, x="name", y="imbalance_score", color="max_util",
-    title="Top 10 Critical Stations",
-    color_continuous_scale="Reds", height=450,
-)
-fig_critical.update_layout(xaxis_tickangle=45, margin={"t": 50})
-st.plotly_chart(fig_critical, use_container_width=True)
-
-# 4. Surplus vs Deficit Map
-st.subheader("4. Surplus (Green) vs Deficit (Red)")
-fig3 = px.scatter_mapbox(
-    peak_data, lat="lat", lon="lon",
-    size="capacity", color="status",
-    color_discrete_map={"SURPLUS": "green", "DEFICIT": "red", "BALANCED": "blue"},
-    hover_name="name", hover_data=["max_util", "imbalance_score"],
-    mapbox_style="carto-positron", zoom=12, height=500,
-    title=f"Surplus vs Deficit — {start_hour:02d}–{end_hour:02d} hours",
-)
-st.plotly_chart(fig3, use_container_width=True)
-
-# 5. Top 5 Bar Charts
-col1, col2 = st.columns(2)
-with col1:
-    fig4 = px.bar(top5_surplus, x="name", y="imbalance_score",
-                  title="Top 5 Surplus Stations", color="max_util",
-                  color_continuous_scale="Greens")
-    st.plotly_chart(fig4, use_container_width=True)
-with col2:
-    fig5 = px.bar(top5_deficit, x="name", y="imbalance_score",
-                  title="Top 5 Deficit Stations", color="max_util",
-                  color_continuous_scale="Reds")
-    st.plotly_chart(fig5, use_container_width=True)
-
-# 6. Optimized Rebalancing Routes Map
-if row_ind is not None and col_ind is not None:
-    st.subheader("5. Optimized Rebalancing Routes")
+# ── Figure cache ──────────────────────────────────────────────────────────────
+# Figures are cached as plain plotly dicts per chart, data version and hour
+# range (or radius), so reopening a section or returning to an hour range
+# skips both the computation and building the figure. `_build` is not hashed:
+# the other arguments identify the figure.
+@st.cache_data(max_entries=256, show_spinner=False)
+def figure_spec(name, version, key, _build):
+    return _build().to_dict()
+
+def show_figure(name, key, build):
+    st.plotly_chart(figure_spec(name, data_version, key, build), use_container_width=True)
+
+def station_bar(stations, title, scale):
+    import plotly.express as px
+    return px.bar(stations, x="name", y="imbalance_score", title=title,
+                  color="max_util", color_continuous_scale=scale)
+
+# ── Rebalancing plan ──────────────────────────────────────────────────────────
+# Network-wide min-cost plan over every surplus and deficit station (see
+# rebalance.py). Cached per data version and hour range; the leading
+# underscore keeps Streamlit from hashing the frame on every rerun.
+@st.cache_data(max_entries=64)
+def plan_rebalancing(version, start_h, end_h, _peak_data):
+    from rebalance import plan_moves
+    return plan_moves(_peak_data)
+
+# ── Plan simulation ───────────────────────────────────────────────────────────
+# The plan is scored by a Monte Carlo run of every station's inventory over
+# the selected hours (see simulate.py), with arrival and departure rates from
+# the FLOW_DAYS days of the rollup up to the selected day.
+FLOW_DAYS = 28
+
+@st.cache_data(max_entries=4)
+def flow_rates(version):
+    with engine.connect() as conn:
+        return pd.read_sql(text("""
+            SELECT station_id, hour, SUM(arrivals) AS arrivals, SUM(departures) AS departures,
+                   SUM(observed_s) AS observed_s
+            FROM station_hourly_rollup
+            WHERE stat_date >  CAST(:day AS DATE) - :days
+              AND stat_date <= CAST(:day AS DATE)
+            GROUP BY station_id, hour
+        """), conn, params={"day": version[-1], "days": FLOW_DAYS})
+
+@st.cache_data(max_entries=64)
+def evaluate_rebalancing(version, start_h, end_h, _rollup, _moves):
+    from simulate import evaluate_plan, start_inventory
+    _, summary = evaluate_plan(start_inventory(_rollup, start_h), flow_rates(version), _moves,
+                               list(range(start_h, end_h + 1)))
+    return summary
+
+# ── Sections ──────────────────────────────────────────────────────────────────
+# Only the selected section runs, so charts nobody looks at are never built
+# and their libraries never imported.
+def top_stations_section():
+    top5_surplus = peak_data[peak_data["status"] == "SURPLUS"].nlargest(5, "imbalance_score")
+    top5_deficit = peak_data[peak_data["status"] == "DEFICIT"].nlargest(5, "imbalance_score")
+
+    col1, col2 = st.columns(2)
+    for col, stations, label, scale in ((col1, top5_surplus, "Surplus", "Greens"),
+                                        (col2, top5_deficit, "Deficit", "Reds")):
+        with col:
+            st.subheader(f"Top 5 {label} Stations")
+            display = stations[["name", "capacity", "max_util", "imbalance_score", "status"]].round(2).copy()
+            display.columns = ["Station Name", "Capacity", "Max Utilization", "Imbalance Score", "Status"]
+            st.dataframe(display, use_container_width=True)
+            show_figure(f"top5_{label.lower()}", hour_range,
+                        lambda: station_bar(stations, f"Top 5 {label} Stations", scale))
+
+def rebalancing_section():
+    moves, plan = plan_rebalancing(data_version, start_hour, end_hour, peak_data)
+    if moves.empty:
+        st.info("No rebalancing moves needed for this time range.")
+        return
+
+    st.subheader("Optimized Rebalancing Plan")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Bikes to Move",   f"{plan['moved']:,}")
+    col2.metric("Van Trips",       f"{len(moves):,}")
+    col3.metric("Bike-km",         f"{plan['bike_km']:,.1f}")
+    col4.metric("Unmet Demand",    f"{plan['unmet']:,} bikes")
+
+    outcome = evaluate_rebalancing(data_version, start_hour, end_hour, df, moves)
+    st.subheader("Simulated Outcome")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Empty Station-Minutes", f"{outcome['plan_empty_minutes']:,.0f}",
+                f"{outcome['plan_empty_minutes'] - outcome['empty_minutes']:,.0f}", delta_color="inverse")
+    col2.metric("Full Station-Minutes", f"{outcome['plan_full_minutes']:,.0f}",
+                f"{outcome['plan_full_minutes'] - outcome['full_minutes']:,.0f}", delta_color="inverse")
+    col3.metric("Prevented", f"{outcome['prevented_minutes']:,.0f} ± {outcome['prevented_stderr']:,.0f}")
+    if outcome["moved_bikes"] < outcome["planned_bikes"]:
+        st.warning(f"Simulated {outcome['moved_bikes']:,} of the {outcome['planned_bikes']:,} planned bikes: "
+                   f"moves are capped by the bikes and free docks at {start_hour:02d}:00"
+                   + (f", and {len(outcome['unknown_stations'])} station(s) had no data then"
+                      if outcome["unknown_stations"] else "") + ".")
+    st.caption(f"Expected over {outcome['trials']:,} simulated runs of {start_hour:02d}:00–{end_hour + 1:02d}:00, "
+               f"with and without the plan, at the arrival and departure rates of the last {FLOW_DAYS} days.")
+
+    routes_display = moves[["from_name", "to_name", "bikes", "distance_km"]].copy()
+    routes_display["from_name"] = routes_display["from_name"].astype(str).str[:25]
+    routes_display["to_name"]   = routes_display["to_name"].astype(str).str[:25]
+    routes_display.columns = ["From", "To", "Bikes", "Distance (km)"]
+    st.dataframe(routes_display, use_container_width=True, height=300)
+
+    st.subheader("Optimized Rebalancing Routes")
+    show_figure("routes", hour_range, lambda: routes_figure(moves))
+
+ROUTES_ON_MAP = 15
+
+def routes_figure(moves):
+    import plotly.express as px
+    import plotly.graph_objects as go
     fig6   = go.Figure()
     colors = px.colors.qualitative.Set1
+    shown  = moves.head(ROUTES_ON_MAP)
 
-    for idx, (i, j) in enumerate(zip(row_ind, col_ind)):
-        surplus     = top5_surplus.iloc[i]
-        deficit     = top5_deficit.iloc[j]
-        distance_km = dist_matrix[i, j]
-        color       = colors[idx % len(colors)]
-
+    for idx, move in enumerate(shown.itertuples(index=False)):
+        color = colors[idx % len(colors)]
         fig6.add_trace(go.Scattermapbox(
-            lat=[surplus["lat"], deficit["lat"]],
-            lon=[surplus["lon"], deficit["lon"]],
+            lat=[move.from_lat, move.to_lat],
+            lon=[move.from_lon, move.to_lon],
             mode="lines+markers",
-            line=dict(width=10, color=color),
-            marker=dict(size=15, color=color),
-            name=f"{surplus['name'][:12]}→{deficit['name'][:12]} ({distance_km:.1f} km)",
+            line=dict(width=2 + move.bikes // 2, color=color),
+            marker=dict(size=12, color=color),
+            name=f"{str(move.from_name)[:12]}→{str(move.to_name)[:12]} ({move.bikes} bikes, {move.distance_km:.1f} km)",
             hovertemplate=(
                 f"<b>%{{fullData.name}}</b><br>"
-                f"Distance: {distance_km:.1f} km<extra></extra>"
+                f"Bikes: {move.bikes}<br>"
+                f"Distance: {move.distance_km:.1f} km<extra></extra>"
             ),
         ))
 
     fig6.update_layout(
         mapbox=dict(
             style="carto-positron",
-            center=dict(lat=surplus_coords[:, 0].mean(), lon=surplus_coords[:, 1].mean()),
+            center=dict(lat=shown["from_lat"].mean(), lon=shown["from_lon"].mean()),
             zoom=12,
         ),
         height=500,
-        title="Optimized Bike Rebalancing Routes",
+        title=f"Optimized Bike Rebalancing Routes (largest {len(shown)} of {len(moves)} moves)",
         showlegend=True,
     )
-    st.plotly_chart(fig6, use_container_width=True)
+    return fig6
+
+def heatmap_section():
+    def build():
+        import plotly.express as px
+        return px.density_heatmap(
+            hourly_heatmap_frame(df),
+            x="hour", y="station_id", z="utilization",
+            title=f"Utilization Heatmap ({start_hour:02d}–{end_hour:02d} hours)",
+            color_continuous_scale="RdYlGn_r",
+        )
+    st.subheader("Utilization Heatmap")
+    show_figure("heatmap", hour_range, build)
+
+# The cluster radius slider reruns only this fragment, not the whole script.
+@st.fragment
+def clusters_section(geometry_hash):
+    st.subheader("Station Clusters")
+    radius_m = st.slider("Cluster radius (m)", 100, 1500, 500, step=50)
+
+    def build():
+        import plotly.express as px
+        geometry, _ = station_index(geometry_hash)
+        coords = geometry.assign(cluster=cluster_labels(geometry_hash, radius_m))
+        return px.scatter_mapbox(
+            coords, lat="lat", lon="lon",
+            size="capacity", color="cluster",
+            hover_name="name", hover_data=["capacity"],
+            color_continuous_scale="Viridis",
+            mapbox_style="open-street-map",
+            zoom=12, height=500,
+            title=f"Station Clusters (radius {radius_m} m)",
+        )
+    show_figure("clusters", (geometry_hash, radius_m), build)
+
+def critical_section():
+    critical = peak_data[peak_data["imbalance_score"] > peak_data["capacity"] * 0.3]
+
+    def build_critical():
+        import plotly.express as px
+        fig = px.bar(
+            critical.nlargest(10, "imbalance_score"), x="name", y="imbalance_score", color="max_util",
+            title="Top 10 Critical Stations",
+            color_continuous_scale="Reds", height=450,
+        )
+        fig.update_layout(xaxis_tickangle=45, margin={"t": 50})
+        return fig
+
+    def build_map():
+        import plotly.express as px
+        return px.scatter_mapbox(
+            peak_data, lat="lat", lon="lon",
+            size="capacity", color="status",
+            color_discrete_map={"SURPLUS": "green", "DEFICIT": "red", "BALANCED": "blue"},
+            hover_name="name", hover_data=["max_util", "imbalance_score"],
+            mapbox_style="carto-positron", zoom=12, height=500,
+            title=f"Surplus vs Deficit — {start_hour:02d}–{end_hour:02d} hours",
+        )
+
+    st.subheader("Top 10 Critical Stations")
+    show_figure("critical", hour_range, build_critical)
+    st.subheader("Surplus (Green) vs Deficit (Red)")
+    show_figure("surplus_deficit", hour_range, build_map)
+
+SECTIONS = {
+    "Top stations":       top_stations_section,
+    "Rebalancing":        rebalancing_section,
+    "Heatmap":            heatmap_section,
+    "Clusters":           lambda: clusters_section(data_version[2]),
+    "Surplus vs deficit": critical_section,
+}
+section = st.radio("Section", list(SECTIONS), horizontal=True, key="section",
+                   label_visibility="collapsed")
+SECTIONS[section]()
 
 st.markdown("---")
+
+# ── Render timing ─────────────────────────────────────────────────────────────
+# One METRIC line per script run in the app logs (the same format as the
+# ETL's); "run" counts script runs in this server process, so run 1 is the
+# cold start.
+@st.cache_resource
+def run_counter():
+    return {"runs": 0}
+
+counter = run_counter()
+counter["runs"] += 1
+render_s = time.perf_counter() - RUN_STARTED
+print("METRIC " + json.dumps({
+    "stage": "dashboard.render", "section": section, "day": day, "hours": list(hour_range),
+    "run": counter["runs"], "wall_s": round(render_s, 3),
+}), flush=True)
+st.caption(f"Rendered in {render_s:.2f}s")